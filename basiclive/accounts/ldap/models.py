@@ -16,14 +16,12 @@ def on_project_create(sender, instance, created, **kwargs):
             'first_name': instance.first_name,
             'last_name': instance.last_name
         }
-        ldap = slap.Directory()
-        info = ldap.add_user(user_info)
+        info = slap.directory.add_user(user_info)
         instance.name = info.get('username')
         instance.save()
 
 
 @receiver(pre_delete, sender=User)
 def on_project_delete(sender, instance, **kwargs):
-    directory = slap.Directory()
-    directory.delete_user(instance.name)
+    slap.directory.delete_user(instance.name)
 
@@ -1,11 +1,18 @@
 import os
+import queue
 import random
 import string
+import threading
+import time
+from contextlib import contextmanager
 
 import ldap3
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import mail_managers
 from ldap3 import Server, Connection
+from ldap3.core.exceptions import LDAPBindError, LDAPCommunicationError, LDAPException
+from ldap3.utils.conv import escape_filter_chars
 
 BASE_DN = getattr(settings, 'LDAP_BASE_DN', 'dc=demo1,dc=freeipa,dc=org')
 SERVER_URI = getattr(settings, 'LDAP_SERVER_URI', 'ipa.demo1.freeipa.org')
@@ -16,6 +23,10 @@ USER_ROOT = getattr(settings, 'LDAP_USER_ROOT', '/home')
 GROUP_TABLE = getattr(settings, 'LDAP_GROUP_TABLE', 'ou=Groups')
 USER_SHELL = getattr(settings, 'LDAP_USER_SHELL', '/bin/bash')
 EMAIL_NEW_ACCOUNTS = getattr(settings, 'LDAP_SEND_EMAILS', False)
+POOL_SIZE = getattr(settings, 'LDAP_POOL_SIZE', 4)
+POOL_LIFETIME = getattr(settings, 'LDAP_POOL_LIFETIME', 300)  # seconds before idle connections are replaced
+INDEX_TIMEOUT = getattr(settings, 'LDAP_INDEX_TIMEOUT', 86400)  # seconds between full rebuilds of the uid index
+INDEX_KEY = 'ldap:uid-index'
 
 USER_ATTRIBUTES = ['cn', 'uid', 'uidNumber', 'gidNumber', 'homeDirectory', 'loginShell', 'description', 'gecos',
                    'objectclass']
@@ -29,12 +40,21 @@ def uniquefy(name, existing):
     :param existing: list of existing names
     :return: a unique name based on the suggested name
     """
-    root = (u'%s' % name).replace('-', '').replace(' ', '').strip().lower()
-    choices = [root] + ['{}{}'.format(root, i) for i in range(1, 20)]
-    candidates = sorted((set(choices) - set(existing)))
+    existing = set(existing)
+    candidates = [candidate for candidate in candidate_names(name) if candidate not in existing]
     return candidates[0]
 
 
+def candidate_names(name):
+    """
+    Usernames which may be generated from the requested name
+    :param name: initial guess of name
+    :return: list of names
+    """
+    root = (u'%s' % name).replace('-', '').replace(' ', '').strip().lower()
+    return [root] + ['{}{}'.format(root, i) for i in range(1, 20)]
+
+
 def pwd_generator(alpha=6, numeric=3):
     """
     Generate and Returns a human-readble password (say rol816din instead of
@@ -84,21 +104,168 @@ def pwd_generator(alpha=6, numeric=3):
     return "{}{}{}".format(start, mid, end)
 
 
+class ConnectionPool(object):
+    """
+    Pool of bound connections to a directory server. Connections are checked out for the duration of an operation,
+    and up to `size` idle connections are kept for reuse. Connections older than `lifetime` seconds, or which failed
+    during an operation, are discarded. Operations started with run() are retried once on a fresh connection if the
+    server has closed the connection they were given.
+
+    :param server: ldap3 Server
+    :param user: user name to bind or None for anonymous bind
+    :param secret: password to bind or None for anonymous
+    :param size: maximum number of idle connections
+    :param lifetime: maximum age in seconds of pooled connections
+    :param strategy: ldap3 client strategy, ldap3.MOCK_SYNC runs against an in-process mock directory
+    """
+
+    def __init__(self, server, user=None, secret=None, size=POOL_SIZE, lifetime=POOL_LIFETIME, strategy=ldap3.SYNC):
+        self.server = server
+        self.user = user
+        self.secret = secret
+        self.size = size
+        self.lifetime = lifetime
+        self.strategy = strategy
+        self.idle = queue.LifoQueue()
+
+    def connect(self):
+        connection = Connection(self.server, user=self.user, password=self.secret, client_strategy=self.strategy)
+        if not connection.bind():
+            raise LDAPBindError(connection.last_error)
+        return connection
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """
+        Check out a connection
+        :param fresh: if True, always open a new connection instead of reusing an idle one
+        """
+        connection = None
+        if not fresh:
+            try:
+                connection, created = self.idle.get_nowait()
+            except queue.Empty:
+                pass
+        if connection is None:
+            connection, created = self.connect(), time.time()
+
+        reusable = False
+        try:
+            yield connection
+            reusable = not connection.closed and time.time() - created < self.lifetime
+        finally:
+            if reusable and self.idle.qsize() < self.size:
+                self.idle.put((connection, created))
+            else:
+                self.discard(connection)
+
+    def run(self, operation):
+        """
+        Run an operation on a pooled connection, retrying once on a fresh connection if the server closed it
+        :param operation: callable taking a connection
+        :return: result of the operation
+        """
+        try:
+            with self.connection() as connection:
+                return operation(connection)
+        except LDAPCommunicationError:
+            # idle connections were probably closed by the server too
+            self.clear()
+            with self.connection(fresh=True) as connection:
+                return operation(connection)
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.unbind()
+        except LDAPException:
+            pass
+
+    def clear(self):
+        while True:
+            try:
+                connection, created = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connection)
+
+
 class Directory(object):
     """
-    A Directory manager implementing methods for listing and modifying a directory
+    A Directory manager implementing methods for listing and modifying a directory. Operations run on pooled
+    manager connections. The largest uidNumber in the directory is kept in a cached index, which is extended
+    incrementally with users added since it was last updated, so new accounts can be allocated without searching the
+    whole directory.
     """
 
-    def __init__(self, uri=SERVER_URI, user=MANAGER_DN, secret=MANAGER_SECRET, use_ssl=True):
+    def __init__(self, uri=SERVER_URI, user=MANAGER_DN, secret=MANAGER_SECRET, use_ssl=True, strategy=ldap3.SYNC,
+                 server=None):
         """
         :param uri: Server URI
         :param user: user name to bind or None for anonymous bind
         :param secret: password to bind or None for anonymous.
         :param use_ssl: whether to use SSL or not. Default True.
+        :param strategy: ldap3 client strategy. Default SYNC.
+        :param server: ldap3 Server to use instead of creating one from the uri
         """
         self.admin_user = user
         self.admin_secret = secret
-        self.server = Server(uri, use_ssl=use_ssl, get_info=ldap3.ALL)
+        self.strategy = strategy
+        self.server = server or Server(uri, use_ssl=use_ssl, get_info=ldap3.ALL)
+        self.pool = ConnectionPool(self.server, user=user, secret=secret, strategy=strategy)
+        self.lock = threading.Lock()
+
+    @property
+    def search_dn(self):
+        return '{user_table},{base_dn}'.format(user_table=USER_TABLE, base_dn=BASE_DN)
+
+    def search_users(self, search_filter, attributes=('uid', 'uidNumber')):
+        """
+        Search user entries
+        :param search_filter: LDAP filter, combined with (objectclass=posixAccount)
+        :param attributes: attributes to fetch
+        :return: entries
+        """
+        def search(connection):
+            connection.extend.standard.paged_search(
+                self.search_dn, '(&(objectclass=posixAccount){})'.format(search_filter), attributes=list(attributes),
+                paged_size=PAGE_SIZE, generator=False
+            )
+            return connection.entries
+
+        return self.pool.run(search)
+
+    def get_index(self):
+        """
+        Index of existing users, rebuilt from a full search at most every INDEX_TIMEOUT seconds and otherwise
+        extended with users whose uidNumber is larger than any seen so far
+        :return: dictionary with the largest uidNumber in 'max' and the time of the last full search in 'time'
+        """
+        index = cache.get(INDEX_KEY)
+        if index is None or time.time() - index['time'] > INDEX_TIMEOUT:
+            entries = self.search_users('', attributes=['uidNumber'])
+            index = {'max': 0, 'time': time.time()}
+        else:
+            entries = self.search_users('(uidNumber>={})'.format(index['max'] + 1), attributes=['uidNumber'])
+        for entry in entries:
+            index['max'] = max(index['max'], int(entry['uidNumber'].value))
+        cache.set(INDEX_KEY, index, None)
+        return index
+
+    def update_index(self, uid_number):
+        index = cache.get(INDEX_KEY)
+        if index is not None:
+            index['max'] = max(index['max'], uid_number)
+            cache.set(INDEX_KEY, index, None)
+
+    def existing_names(self, names):
+        """
+        Find which of the given user names are taken
+        :param names: list of candidate user names
+        :return: set of names already in the directory
+        """
+        uid_filter = ''.join(['(uid={})'.format(escape_filter_chars(name)) for name in names])
+        return {entry['uid'].value for entry in self.search_users('(|{})'.format(uid_filter), attributes=['uid'])}
 
     def add_user(self, info):
         """
@@ -107,10 +274,14 @@ class Directory(object):
         :return: dictionary of new user information
         """
 
-        users = {user['uid'].value: user['uidNumber'].value for user in self.fetch_users()}
-        uidNumber = gidNumber = max(list(users.values())) + 1
+        with self.lock:
+            return self.create_user(info)
+
+    def create_user(self, info):
+        index = self.get_index()
+        uidNumber = gidNumber = index['max'] + 1
         if not info.get('username', '').strip():
-            info['username'] = uniquefy(info['last_name'], list(users.keys()))
+            info['username'] = uniquefy(info['last_name'], self.existing_names(candidate_names(info['last_name'])))
         if not info.get('password', '').strip():
             info['password'] = pwd_generator()
 
@@ -142,9 +313,16 @@ class Directory(object):
             'objectClass': user_object_classes,
             'userPassword': info['password'],
         }
-        with Connection(self.server, user=self.admin_user, password=self.admin_secret, auto_bind=True) as connection:
-            group_success = connection.add(group_dn, group_object_classes, group_record)
-            user_success = connection.add(user_dn, user_object_classes, user_record)
+
+        def add(connection):
+            return (
+                connection.add(group_dn, group_object_classes, group_record),
+                connection.add(user_dn, user_object_classes, user_record)
+            )
+
+        group_success, user_success = self.pool.run(add)
+        if user_success:
+            self.update_index(uidNumber)
 
         if user_success and group_success and EMAIL_NEW_ACCOUNTS:
             mail_managers(
@@ -170,8 +348,8 @@ class Directory(object):
         group_dn = 'cn={group},{group_table},{base_dn}'.format(
             group=group, group_table=GROUP_TABLE, base_dn=BASE_DN
         )
-        with Connection(self.server, user=self.admin_user, password=self.admin_secret, auto_bind=True) as connection:
-            return connection.modify(group_dn, {'memberUid': [(ldap3.MODIFY_ADD, [user])]})
+        group_record = {'memberUid': [(ldap3.MODIFY_ADD, [user])]}
+        return self.pool.run(lambda connection: connection.modify(group_dn, group_record))
 
     def delete_user(self, username):
         """
@@ -186,11 +364,13 @@ class Directory(object):
             username=username, user_table=USER_TABLE, base_dn=BASE_DN
         )
 
-        with Connection(self.server, user=self.admin_user, password=self.admin_secret, auto_bind=True) as connection:
+        def delete(connection):
             success_user = connection.delete(user_dn)
             success_group = connection.delete(group_dn)
             return success_group and success_user
 
+        return self.pool.run(delete)
+
     def update_user(self, username, info):
         """
         Update user attributes to those specified in a new dictionary
@@ -207,8 +387,7 @@ class Directory(object):
             key: [(ldap3.MODIFY_REPLACE, [value])]
             for key, value in info.items()
         }
-        with Connection(self.server, user=self.admin_user, password=self.admin_secret, auto_bind=True) as connection:
-            return connection.modify(user_dn, user_record)
+        return self.pool.run(lambda connection: connection.modify(user_dn, user_record))
 
     def change_password(self, username, old_pwd, new_pwd):
         """
@@ -225,7 +404,7 @@ class Directory(object):
         user_record = {
             'userPassword': [(ldap3.MODIFY_REPLACE, [new_pwd])]
         }
-        with Connection(self.server, user_dn, old_pwd, auto_bind=True) as connection:
+        with Connection(self.server, user_dn, old_pwd, client_strategy=self.strategy, auto_bind=True) as connection:
             return connection.modify(user_dn, user_record)
 
     def fetch_users(self, *user_names, full=False):
@@ -235,16 +414,13 @@ class Directory(object):
         :full: if True, return all attributes otherwise just uid and uidNumber, forced to True if user_names are provided
         :return: entries.
         """
-        search_dn = '{user_table},{base_dn}'.format(
-            user_table=USER_TABLE, base_dn=BASE_DN
-        )
         if not user_names:
-            search_filter = '(objectclass=posixAccount)'
+            search_filter = ''
         else:
-            uid_filter = ''.join(['(uid={})'.format(name) for name in user_names])
-            search_filter = '(&(objectclass=posixAccount)(|{})'.format(uid_filter)
-        search_attrs = ['uid', 'uidNumber', 'objectclass'] if not full else USER_ATTRIBUTES
-        with Connection(self.server, user=self.admin_user, password=self.admin_secret, auto_bind=True) as connection:
-            connection.extend.standard.paged_search(search_dn, search_filter, attributes=search_attrs,
-                                                    paged_size=PAGE_SIZE, generator=False)
-            return connection.entries
+            uid_filter = ''.join(['(uid={})'.format(escape_filter_chars(name)) for name in user_names])
+            search_filter = '(|{})'.format(uid_filter)
+        search_attrs = ['uid', 'uidNumber', 'objectclass'] if not (full or user_names) else USER_ATTRIBUTES
+        return self.search_users(search_filter, attributes=search_attrs)
+
+
+directory = Directory()
@@ -0,0 +1,124 @@
+import time
+from unittest import mock
+
+import ldap3
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from ldap3.core.exceptions import LDAPSessionTerminatedByServerError
+
+from . import slap
+
+MANAGER_DN = 'cn=manager,{}'.format(slap.BASE_DN)
+MANAGER_SECRET = 'secret'
+
+
+class DirectoryTests(SimpleTestCase):
+    """
+    Directory operations against an in-process ldap3 mock directory
+    """
+
+    def setUp(self):
+        cache.delete(slap.INDEX_KEY)
+        # connections to the same Server object share the mock directory
+        self.server = ldap3.Server('mock-{}'.format(self.id()))
+        self.seed = ldap3.Connection(
+            self.server, user=MANAGER_DN, password=MANAGER_SECRET, client_strategy=ldap3.MOCK_SYNC
+        )
+        self.seed.strategy.add_entry(MANAGER_DN, {'userPassword': MANAGER_SECRET, 'cn': 'manager'})
+        self.seed.bind()
+        for i, uid in enumerate(['smith', 'smith1', 'jones']):
+            self.add_entry(uid, 1000 + i)
+        self.directory = slap.Directory(
+            user=MANAGER_DN, secret=MANAGER_SECRET, strategy=ldap3.MOCK_SYNC, server=self.server
+        )
+
+    def tearDown(self):
+        self.directory.pool.clear()
+        self.seed.unbind()
+        cache.delete(slap.INDEX_KEY)
+
+    def add_entry(self, uid, uid_number):
+        self.seed.add(
+            'uid={},{}'.format(uid, self.directory_dn()), ['posixAccount'],
+            {'uid': uid, 'cn': uid, 'uidNumber': uid_number}
+        )
+
+    @staticmethod
+    def directory_dn():
+        return '{},{}'.format(slap.USER_TABLE, slap.BASE_DN)
+
+    def add_user(self, last_name, username=''):
+        return self.directory.add_user({
+            'username': username, 'password': '', 'first_name': 'Ann', 'last_name': last_name
+        })
+
+    def uid_number(self, username):
+        return int(self.directory.fetch_users(username)[0]['uidNumber'].value)
+
+    def test_uniquefy(self):
+        self.assertEqual(slap.uniquefy('Smith', []), 'smith')
+        self.assertEqual(slap.uniquefy('Smith', ['smith', 'smith1']), 'smith2')
+        self.assertEqual(slap.uniquefy('Van Der-Berg', ['smith']), 'vanderberg')
+        self.assertEqual(slap.uniquefy('smith', ['smith'] + ['smith{}'.format(i) for i in range(1, 10)]), 'smith10')
+
+    def test_add_user(self):
+        info = self.add_user('Smith')
+        self.assertEqual(info, {'username': 'smith2', 'first_name': 'Ann', 'last_name': 'Smith'})
+        self.assertEqual(self.uid_number('smith2'), 1003)
+
+        entry = self.directory.fetch_users('smith2', full=True)[0]
+        self.assertEqual(entry['homeDirectory'].value, '{}/smith2'.format(slap.USER_ROOT))
+        self.assertEqual(entry['gecos'].value, 'Ann Smith')
+
+        # a requested username is kept
+        self.add_user('Jones', username='ajones')
+        self.assertEqual(self.uid_number('ajones'), 1004)
+
+    def test_index_grows_incrementally(self):
+        with mock.patch.object(self.directory, 'search_users', wraps=self.directory.search_users) as search:
+            self.add_user('Smith')
+            self.assertEqual(search.call_args_list[0], mock.call('', attributes=['uidNumber']))
+            self.assertEqual(cache.get(slap.INDEX_KEY)['max'], 1003)
+
+            # users added elsewhere since the last update are picked up without a full search
+            self.add_entry('late', 1050)
+            search.reset_mock()
+            self.add_user('Jones')
+            self.assertEqual(search.call_args_list[0], mock.call('(uidNumber>=1004)', attributes=['uidNumber']))
+
+        self.assertEqual(self.uid_number('jones1'), 1051)
+        self.assertEqual(set(cache.get(slap.INDEX_KEY)), {'max', 'time'})
+        self.assertEqual(cache.get(slap.INDEX_KEY)['max'], 1051)
+
+    def test_index_rebuilt_after_timeout(self):
+        self.add_user('Smith')
+        cache.set(slap.INDEX_KEY, {'max': 5000, 'time': time.time() - slap.INDEX_TIMEOUT - 1}, None)
+        with mock.patch.object(self.directory, 'search_users', wraps=self.directory.search_users) as search:
+            self.add_user('Jones')
+            self.assertEqual(search.call_args_list[0], mock.call('', attributes=['uidNumber']))
+        self.assertEqual(self.uid_number('jones1'), 1004)
+
+    def test_pooled_connections_are_reused(self):
+        with mock.patch.object(self.directory.pool, 'connect', wraps=self.directory.pool.connect) as connect:
+            self.add_user('Smith')
+            self.directory.fetch_users()
+            self.directory.update_user('smith2', {'loginShell': '/bin/zsh'})
+            self.assertTrue(self.directory.delete_user('smith2'))
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(self.directory.pool.idle.qsize(), 1)
+
+    def test_expired_connections_are_replaced(self):
+        self.directory.fetch_users()
+        self.directory.pool.lifetime = 0
+        self.directory.fetch_users()
+        self.assertEqual(self.directory.pool.idle.qsize(), 0)
+
+    def test_retry_after_disconnect(self):
+        self.directory.fetch_users()
+        stale, created = self.directory.pool.idle.queue[-1]
+        with mock.patch.object(stale, 'search', side_effect=LDAPSessionTerminatedByServerError('closed')):
+            with mock.patch.object(self.directory.pool, 'connect', wraps=self.directory.pool.connect) as connect:
+                users = [entry['uid'].value for entry in self.directory.fetch_users()]
+        self.assertEqual(sorted(users), ['jones', 'smith', 'smith1'])
+        self.assertEqual(connect.call_count, 1)
+        self.assertNotIn(stale, [connection for connection, created in self.directory.pool.idle.queue])
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from basiclive.core.acl.models import Access
+from basiclive.core.acl.usage import rollup_usage
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily remote access usage rollup, and brings hours of open connections up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Number of past days to rebuild')
+
+    def handle(self, *args, **options):
+        start = timezone.now() - timedelta(days=options['days'])
+        accesses = list(Access.objects.filter(Q(end__isnull=True) | Q(end__gte=start) | Q(created__gte=start)))
+        rollup_usage(accesses)
+        print('Usage updated for {} connections'.format(len(accesses)))
@@ -0,0 +1,111 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Access, AccessList, ACL_SNAPSHOT_VERSION_KEY
+
+ACL_SNAPSHOT_TIMEOUT = getattr(settings, 'ACL_SNAPSHOT_TIMEOUT', 300)
+ACL_SNAPSHOT_KEY = 'acl:snapshot:{version}:{schedule}'
+EMPTY_MEMBERSHIP = {'allowed': [], 'scheduled': [], 'current': [], 'users': []}
+
+if settings.LIMS_USE_SCHEDULE:
+    from basiclive.core.schedule.models import Beamtime, SCHEDULE_FEED_VERSION_KEY
+    HALF_SHIFT = timedelta(hours=int(getattr(settings, 'HOURS_PER_SHIFT', 8) / 2))
+
+
+def snapshot_key():
+    schedule = cache.get(SCHEDULE_FEED_VERSION_KEY, 0) if settings.LIMS_USE_SCHEDULE else 0
+    return ACL_SNAPSHOT_KEY.format(version=cache.get(ACL_SNAPSHOT_VERSION_KEY, 0), schedule=schedule)
+
+
+def scheduled_users(now):
+    """
+    Users with remote beamtime in progress on each beamline
+    :param now: current time
+    :return: tuple (dictionary mapping beamline pk to usernames, time at which the schedule next changes or None)
+    """
+    if not settings.LIMS_USE_SCHEDULE:
+        return {}, None
+
+    remote = Beamtime.objects.filter(cancelled=False, access__remote=True)
+    scheduled = defaultdict(list)
+    changes = []
+    for beamline, username, end in remote.filter(start__lte=now, end__gte=now - HALF_SHIFT).values_list(
+            'beamline', 'project__username', 'end'):
+        scheduled[beamline].append(username)
+        changes.append(end + HALF_SHIFT)
+    upcoming = remote.filter(start__gt=now).order_by('start').values_list('start', flat=True).first()
+    if upcoming:
+        changes.append(upcoming)
+    return scheduled, min(changes, default=None)
+
+
+def resolve_access(now=None):
+    """
+    Resolve allowed, scheduled and connected users of all access lists in a fixed number of queries
+    :param now: time at which to resolve the schedule, defaults to the current time
+    :return: tuple (list of dictionaries, one per access list, time at which the schedule next changes or None)
+    """
+    now = now or timezone.now()
+    allowed = defaultdict(list)
+    for acl, username in AccessList.users.through.objects.values_list('accesslist', 'project__username'):
+        allowed[acl].append(username)
+    beamlines = defaultdict(list)
+    for acl, beamline, acronym in AccessList.beamline.through.objects.values_list(
+            'accesslist', 'beamline', 'beamline__acronym'):
+        beamlines[acl].append((beamline, acronym))
+    current = defaultdict(set)
+    for acl, username in Access.objects.filter(status__in=['Connected', 'Disconnected']).values_list(
+            'userlist', 'user__username'):
+        current[acl].add(username)
+    scheduled, changes = scheduled_users(now)
+
+    lists = []
+    for acl in AccessList.objects.order_by('name').values('pk', 'name', 'address', 'active'):
+        pk = acl['pk']
+        acl_scheduled = sorted({username for beamline, acronym in beamlines[pk] for username in scheduled[beamline]})
+        lists.append({
+            'id': pk,
+            'name': acl['name'],
+            'address': acl['address'],
+            'active': acl['active'],
+            'beamlines': sorted(acronym for beamline, acronym in beamlines[pk]),
+            'allowed': sorted(allowed[pk]),
+            'scheduled': acl_scheduled,
+            'current': sorted(current[pk]),
+            'users': sorted(set(allowed[pk]) | set(acl_scheduled)),
+        })
+    return lists, changes
+
+
+def get_snapshot():
+    """
+    Access list snapshot, cached until access lists, connections or beamtime change, or until the schedule moves on
+    :return: dictionary with 'version', 'generated' and 'lists' keys
+    """
+    key = snapshot_key()
+    snapshot = cache.get(key)
+    if snapshot is None:
+        now = timezone.now()
+        lists, changes = resolve_access(now)
+        snapshot = {'version': key.split(':', 2)[-1], 'generated': now.isoformat(), 'lists': lists}
+        timeout = ACL_SNAPSHOT_TIMEOUT
+        if changes:
+            timeout = max(1, min(timeout, int((changes - now).total_seconds()) + 1))
+        cache.set(key, snapshot, timeout)
+    return snapshot
+
+
+def get_membership(pk):
+    """
+    Resolved membership of one access list
+    :param pk: access list primary key
+    :return: dictionary with 'allowed', 'scheduled', 'current' and 'users' lists of usernames
+    """
+    for entry in get_snapshot()['lists']:
+        if entry['id'] == pk:
+            return entry
+    return EMPTY_MEMBERSHIP
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.4 on 2026-10-19 13:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('acl', '0019_auto_20201202_1632'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='access',
+            index=models.Index(fields=['userlist', 'user', 'name'], name='acl_access_connection_idx'),
+        ),
+        migrations.CreateModel(
+            name='AccessUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hours', models.FloatField(default=0.0)),
+                ('connections', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('userlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='acl.accesslist')),
+            ],
+            options={
+                'verbose_name': 'Access Usage',
+                'verbose_name_plural': 'Access Usage',
+                'unique_together': {('date', 'user', 'userlist')},
+            },
+        ),
+    ]
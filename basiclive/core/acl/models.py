@@ -1,14 +1,13 @@
 import os
-from datetime import timedelta
 
-from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.utils import timezone
 from model_utils import Choices
 
-if settings.LIMS_USE_SCHEDULE:
-    from basiclive.core.schedule.models import Beamtime
-    HOURS_PER_SHIFT = getattr(settings, 'HOURS_PER_SHIFT', 8)
+ACL_SNAPSHOT_VERSION_KEY = 'acl:snapshot-version'
 
 
 def get_storage_path(instance, filename):
@@ -25,29 +24,28 @@ class AccessList(models.Model):
     modified = models.DateTimeField('date modified', auto_now_add=True, editable=False)
     beamline = models.ManyToManyField("lims.Beamline", blank=True, related_name="access_lists")
 
+    def membership(self):
+        """
+        Resolved membership of this access list from the cached snapshot
+        :return: dictionary with 'allowed', 'scheduled', 'current' and 'users' lists of usernames
+        """
+        from .membership import get_membership
+        return get_membership(self.pk)
+
     def allowed_users(self):
-        return ' | '.join(self.users.values_list('username', flat=True))
+        return ' | '.join(user.username for user in self.users.all())
 
     def current_users(self):
-        return ' | '.join(self.connections.filter(status__in=['Connected', 'Disconnected']).values_list('user__username', flat=True).distinct())
+        return ' | '.join(self.membership()['current'])
 
     def scheduled_users(self):
         return ' | '.join(self.scheduled())
 
     def scheduled(self):
-        if settings.LIMS_USE_SCHEDULE:
-            now = timezone.localtime()
-            return list(Beamtime.objects.filter(cancelled=False, access__remote=True, beamline__in=self.beamline.all(),
-                                                start__lte=now,
-                                                end__gte=now - timedelta(hours=int(HOURS_PER_SHIFT / 2))).values_list(
-                'project__username', flat=True))
-        return []
+        return self.membership()['scheduled']
 
     def access_users(self):
-        users = list(self.users.values_list('username', flat=True))
-        if settings.LIMS_USE_SCHEDULE:
-            users += self.scheduled()
-        return users
+        return self.membership()['users']
 
     def identity(self):
         return self.name
@@ -80,3 +78,49 @@ class Access(models.Model):
         end = self.end or timezone.now()
         return (end - self.created).total_seconds()/3600.
     total_time.short_description = "Duration"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['userlist', 'user', 'name'], name='acl_access_connection_idx'),
+        ]
+
+
+class AccessUsage(models.Model):
+    """
+    Daily rollup of remote connection hours per user and access list, maintained as connection events are recorded
+    """
+    date = models.DateField()
+    user = models.ForeignKey("lims.Project", on_delete=models.CASCADE, related_name="+")
+    userlist = models.ForeignKey(AccessList, related_name="usage", on_delete=models.CASCADE)
+    hours = models.FloatField(default=0.0)
+    connections = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Access Usage"
+        verbose_name_plural = "Access Usage"
+        unique_together = ('date', 'user', 'userlist')
+
+
+def expire_acl_snapshot():
+    """
+    Invalidate the cached access list snapshot by changing the version included in its cache key
+    """
+    try:
+        cache.incr(ACL_SNAPSHOT_VERSION_KEY)
+    except ValueError:
+        cache.set(ACL_SNAPSHOT_VERSION_KEY, 1, None)
+
+
+@receiver(post_save, sender=AccessList)
+@receiver(post_delete, sender=AccessList)
+@receiver(post_save, sender=Access)
+@receiver(post_delete, sender=Access)
+def on_access_change(sender, **kwargs):
+    expire_acl_snapshot()
+
+
+@receiver(m2m_changed, sender=AccessList.users.through)
+@receiver(m2m_changed, sender=AccessList.beamline.through)
+def on_access_members_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        expire_acl_snapshot()
@@ -0,0 +1,61 @@
+import calendar
+from collections import defaultdict
+
+from django.db.models import Sum, Min, Max
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import AccessUsage
+
+
+def usage_stats(objlist):
+    """
+    Connection hours per access list and period, from the daily usage rollup
+    :param objlist: Access queryset, the rollup is limited to its users, access lists and dates
+    :return: report section or None if there is no usage
+    """
+    limits = objlist.aggregate(start=Min('created'), end=Max('end'), latest=Max('created'))
+    if limits['start'] is None:
+        return None
+
+    end = max(limits['end'] or limits['latest'], limits['latest'])
+    usage = AccessUsage.objects.filter(
+        user__in=objlist.values('user'), userlist__in=objlist.values('userlist'),
+        date__gte=limits['start'].date(), date__lte=end.date()
+    )
+    years = sorted(usage.values_list('date__year', flat=True).distinct())
+    if not years:
+        return None
+
+    if len(years) == 1:
+        period, periods = 'month', list(range(1, 13))
+        labels = {month: calendar.month_abbr[month].title() for month in periods}
+        usage = usage.annotate(period=ExtractMonth('date'))
+    else:
+        period, periods = 'year', years
+        labels = {year: year for year in periods}
+        usage = usage.annotate(period=ExtractYear('date'))
+
+    hours = defaultdict(dict)
+    for per, name, total in usage.values_list('period', 'userlist__name').order_by('period').annotate(
+            total=Sum('hours')):
+        hours[per][name] = round(total, 1)
+    names = sorted({name for values in hours.values() for name in values})
+    return {
+        'title': 'Connection Hours{}'.format(len(years) == 1 and ' in {}'.format(years[0]) or ''),
+        'style': 'row',
+        'content': [
+            {
+                'title': 'Connection Hours by Access List',
+                'kind': 'columnchart',
+                'data': {
+                    'x-label': period.title(),
+                    'stack': [names],
+                    'data': [
+                        {period.title(): labels[per], **{name: hours[per].get(name, 0) for name in names}}
+                        for per in periods
+                    ],
+                },
+                'style': 'col-12',
+            },
+        ]
+    }
@@ -1,3 +1,84 @@
+from datetime import datetime, timedelta
+
 from django.test import TestCase
+from django.utils import timezone
+
+from basiclive.core.lims.models import Project
+from .models import Access, AccessList, AccessUsage
+from .usage import record_events
+
+
+class RecordEventsTests(TestCase):
+
+    def setUp(self):
+        self.user = Project.objects.create(username='user1', name='User')
+        self.list = AccessList.objects.create(name='remote', address='10.0.0.1')
+        self.start = timezone.make_aware(datetime(2026, 10, 1, 8, 0))
+
+    def event(self, status, hours, name='session'):
+        return {
+            'user': 'user1', 'list': 'remote', 'name': name, 'status': status,
+            'time': (self.start + timedelta(hours=hours)).isoformat(),
+        }
+
+    def spans(self):
+        return [
+            (access.status, access.created, access.end) for access in Access.objects.order_by('created')
+        ]
+
+    def total_hours(self):
+        return round(sum(AccessUsage.objects.values_list('hours', flat=True)), 6)
+
+    def test_session(self):
+        report = record_events([self.event('Connected', 0), self.event('Disconnected', 1)])
+        self.assertEqual((report['created'], report['updated']), (1, 0))
+        report = record_events([self.event('Finished', 2)])
+        self.assertEqual((report['created'], report['updated']), (0, 1))
+        self.assertEqual(self.spans(), [
+            ('Finished', self.start, self.start + timedelta(hours=2))
+        ])
+        self.assertEqual(self.total_hours(), 2)
+
+    def test_reused_name_starts_new_connection(self):
+        week = 24 * 7
+        record_events([self.event('Connected', 0), self.event('Finished', 2)])
+        report = record_events([self.event('Connected', week), self.event('Finished', week + 1)])
+        self.assertEqual((report['created'], report['updated']), (1, 0))
+        self.assertEqual(self.spans(), [
+            ('Finished', self.start, self.start + timedelta(hours=2)),
+            ('Finished', self.start + timedelta(hours=week), self.start + timedelta(hours=week + 1)),
+        ])
+        self.assertEqual(self.total_hours(), 3)
+
+    def test_reused_name_within_batch(self):
+        report = record_events([
+            self.event('Connected', 0), self.event('Finished', 2), self.event('Connected', 3),
+            self.event('Failed', 4), self.event('Connected', 5),
+        ])
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(self.spans(), [
+            ('Finished', self.start, self.start + timedelta(hours=2)),
+            ('Failed', self.start + timedelta(hours=3), self.start + timedelta(hours=4)),
+            ('Connected', self.start + timedelta(hours=5), None),
+        ])
+
+    def test_closed_connection_not_reopened(self):
+        record_events([self.event('Connected', 0), self.event('Finished', 2)])
+
+        # repeated batches and late events for a closed connection are ignored
+        report = record_events([self.event('Connected', 0), self.event('Disconnected', 1), self.event('Finished', 3)])
+        self.assertEqual((report['created'], report['updated']), (0, 0))
+        self.assertEqual(self.spans(), [
+            ('Finished', self.start, self.start + timedelta(hours=2))
+        ])
+        self.assertEqual(self.total_hours(), 2)
 
-# Create your tests here.
+    def test_malformed_events_rejected(self):
+        report = record_events([
+            {'user': ['user1'], 'list': 'remote', 'name': 'a', 'status': 'Connected'},
+            {'user': 'user1', 'list': {'name': 'remote'}, 'name': 'b', 'status': 'Connected'},
+            'Connected',
+            self.event('Connected', 0),
+        ])
+        self.assertEqual(report['rejected'], [0, 1, 2])
+        self.assertEqual(report['created'], 1)
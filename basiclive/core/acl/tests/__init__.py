@@ -1,8 +0,0 @@
-import unittest
-
-# add unit tests for the mxlive.staff module here
-
-def suite():
-    suite = unittest.TestSuite()
-    
-    return suite
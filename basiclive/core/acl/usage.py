@@ -0,0 +1,224 @@
+import copy
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import dateparse, timezone
+
+from .models import Access, AccessList, AccessUsage, expire_acl_snapshot
+
+ACTIVE_STATES = ('Connected', 'Disconnected')
+CLOSED_STATES = ('Finished', 'Failed')
+STATUS_NAMES = {name.lower(): name for name in ACTIVE_STATES + CLOSED_STATES}
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def day_hours(start, end):
+    """
+    Split a time span into local calendar days
+    :param start: start time
+    :param end: end time
+    :return: list of (date, hours) tuples
+    """
+    hours = []
+    day = timezone.localtime(start).date()
+    while True:
+        next_start = day_start(day + timedelta(days=1))
+        hours.append((day, max(0.0, (min(end, next_start) - max(start, day_start(day))).total_seconds() / 3600.)))
+        if next_start >= end:
+            break
+        day += timedelta(days=1)
+    return hours
+
+
+def connection_end(status, created, end, now):
+    """
+    End of a connection for usage accounting. Open connections count up to now, closed connections without an end
+    time count as zero hours.
+    """
+    return end or (now if status in ACTIVE_STATES else created)
+
+
+def event_names(events, field):
+    """
+    Distinct string values of a field in a list of events, ignoring malformed events and values
+    """
+    return {
+        event[field] for event in events if isinstance(event, dict) and isinstance(event.get(field), str)
+    }
+
+
+def parse_events(events):
+    """
+    Validate connection events and resolve their users and access lists
+    :param events: list of dictionaries with 'name', 'user', 'list', 'status' and optional ISO 'time' keys
+    :return: tuple (dictionary mapping (user pk, list pk, name) to a time ordered list of (time, status), rejected
+        event indices)
+    """
+    User = get_user_model()
+    now = timezone.now()
+    users = dict(User.objects.filter(username__in=event_names(events, 'user')).values_list('username', 'pk'))
+    lists = dict(AccessList.objects.filter(name__in=event_names(events, 'list')).values_list('name', 'pk'))
+
+    connections = defaultdict(list)
+    rejected = []
+    for i, event in enumerate(events):
+        try:
+            user, userlist = users[event['user']], lists[event['list']]
+            name = str(event['name'])[:48]
+            status = STATUS_NAMES[str(event['status']).lower()]
+            event_time = dateparse.parse_datetime(event['time']) if event.get('time') else now
+            if timezone.is_naive(event_time):
+                event_time = timezone.make_aware(event_time)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            rejected.append(i)
+            continue
+        connections[(user, userlist, name)].append((event_time, status))
+
+    for key in connections:
+        connections[key].sort(key=lambda entry: entry[0])
+    return connections, rejected
+
+
+def find_connections(keys):
+    """
+    Existing connections matching (user pk, list pk, name) keys, the latest one for duplicated keys
+    """
+    users, lists, names = (set(values) for values in zip(*keys)) if keys else (set(), set(), set())
+    queryset = Access.objects.filter(userlist__in=lists, user__in=users, name__in=names).order_by('pk')
+    return {
+        (access.user_id, access.userlist_id, access.name): access
+        for access in queryset if (access.user_id, access.userlist_id, access.name) in keys
+    }
+
+
+def record_events(events):
+    """
+    Apply a batch of connection events to Access rows, and update the daily usage rollup. Events update the latest
+    row for their (user, list, name) while it is active. A Connected event after that connection was closed starts a
+    new row, since gateways may reuse connection names for later sessions, and other events for closed connections
+    are ignored.
+    :param events: list of event dictionaries, see parse_events
+    :return: dictionary with the number of connections 'created' and 'updated', and the indices of 'rejected' events
+    """
+    connections, rejected = parse_events(events)
+    if not connections:
+        return {'created': 0, 'updated': 0, 'rejected': rejected}
+
+    keys = set(connections)
+    with transaction.atomic():
+        # serialize batches touching the same access lists so that connections are not created twice
+        list(AccessList.objects.select_for_update().filter(pk__in={key[1] for key in keys}).values_list('pk'))
+        existing = find_connections(keys)
+        new, changed, previous = [], [], []
+        for key, entries in connections.items():
+            access = existing.get(key)
+            if access is not None and access.is_active():
+                # days covered before this update also need their usage recomputed
+                previous.append(copy.copy(access))
+                changed.append(access)
+            for event_time, status in entries:
+                if access is None or (
+                    not access.is_active() and status == 'Connected' and event_time >= (access.end or access.created)
+                ):
+                    access = Access(user_id=key[0], userlist_id=key[1], name=key[2], created=event_time)
+                    new.append(access)
+                elif not access.is_active():
+                    continue
+                access.status = status
+                access.end = event_time if status in CLOSED_STATES else None
+
+        new = create_connections(new)
+        Access.objects.bulk_update(changed, ['status', 'end'])
+        rollup_usage(new + changed + previous)
+    expire_acl_snapshot()
+    return {'created': len(new), 'updated': len(changed), 'rejected': rejected}
+
+
+def create_connections(accesses):
+    """
+    Insert new connections, keeping the time of their first event as the creation time. Must be called while the
+    access lists of the connections are locked.
+    :param accesses: list of unsaved Access objects
+    :return: list of saved Access objects in the same order
+    """
+    if not accesses:
+        return []
+    created_times = [access.created for access in accesses]
+    last = Access.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    Access.objects.bulk_create(accesses)
+    if accesses[0].pk is None:
+        # primary keys are not returned by this backend. No other rows are inserted for these connections while their
+        # access lists are locked, so the rows after the previous last one are these, in insertion order
+        inserted = defaultdict(list)
+        for access in Access.objects.filter(
+            pk__gt=last, userlist__in={access.userlist_id for access in accesses}
+        ).order_by('pk'):
+            inserted[(access.user_id, access.userlist_id, access.name)].append(access)
+        accesses = [
+            inserted[(access.user_id, access.userlist_id, access.name)].pop(0) for access in accesses
+        ]
+
+    # creation times are overwritten by auto_now_add, restore the time of the first event
+    for access, created in zip(accesses, created_times):
+        access.created = created
+    Access.objects.bulk_update(accesses, ['created'])
+    return accesses
+
+
+def rollup_usage(accesses, now=None):
+    """
+    Recompute the daily usage rollup for the users, access lists and days spanned by the given connections
+    :param accesses: iterable of Access objects
+    :param now: end time of open connections, defaults to the current time
+    """
+    now = now or timezone.now()
+    cells = set()
+    for access in accesses:
+        end = connection_end(access.status, access.created, access.end, now)
+        cells.update(
+            (day, access.user_id, access.userlist_id) for day, hours in day_hours(access.created, end)
+        )
+    if not cells:
+        return
+
+    days = {cell[0] for cell in cells}
+    start, end = day_start(min(days)), day_start(max(days) + timedelta(days=1))
+    totals = defaultdict(lambda: [0.0, 0])
+    rows = Access.objects.filter(
+        user__in={cell[1] for cell in cells}, userlist__in={cell[2] for cell in cells}, created__lt=end
+    ).filter(Q(end__isnull=True) | Q(end__gte=start)).values_list('user', 'userlist', 'status', 'created', 'end')
+    for user, userlist, status, created, finished in rows:
+        for day, hours in day_hours(created, connection_end(status, created, finished, now)):
+            if (day, user, userlist) in cells:
+                totals[(day, user, userlist)][0] += hours
+                totals[(day, user, userlist)][1] += 1
+
+    with transaction.atomic():
+        existing = {
+            (usage.date, usage.user_id, usage.userlist_id): usage
+            for usage in AccessUsage.objects.select_for_update().filter(
+                date__in=days, user__in={cell[1] for cell in cells}, userlist__in={cell[2] for cell in cells}
+            )
+        }
+        new, changed, stale = [], [], []
+        for cell in cells:
+            hours, count = totals.get(cell, (0.0, 0))
+            usage = existing.get(cell)
+            if usage is None and count:
+                new.append(AccessUsage(
+                    date=cell[0], user_id=cell[1], userlist_id=cell[2], hours=hours, connections=count
+                ))
+            elif usage is not None and count:
+                usage.hours, usage.connections = hours, count
+                changed.append(usage)
+            elif usage is not None:
+                stale.append(usage.pk)
+        AccessUsage.objects.bulk_create(new)
+        AccessUsage.objects.bulk_update(changed, ['hours', 'connections'])
+        AccessUsage.objects.filter(pk__in=stale).delete()
@@ -9,20 +9,22 @@ from itemlist.views import ItemListView
 
 from .forms import AccessForm
 
+from basiclive.core.lims.views import ListViewMixin
 from basiclive.utils import filters
 from basiclive.utils.mixins import AsyncFormMixin, AdminRequiredMixin, PlotViewMixin
 
-from . import models
+from . import models, stats
 
 User = get_user_model()
 
 
 def format_beamlines(value, record):
-    return ', '.join(record.beamline.values_list('acronym', flat=True))
+    return ', '.join(beamline.acronym for beamline in record.beamline.all())
 
 
 class AccessListView(AdminRequiredMixin, ItemListView):
     model = models.AccessList
+    queryset = models.AccessList.objects.prefetch_related('users', 'beamline')
     list_filters = ['beamline', 'active']
     list_columns = ['name', 'description', 'current_users', 'allowed_users', 'address', 'beamlines', 'active']
     list_transforms = {'beamlines': format_beamlines}
@@ -54,8 +56,10 @@ class AccessEdit(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit.U
         return self.model.objects.get(address=self.kwargs.get('address'))
 
 
-class RemoteConnectionList(AdminRequiredMixin, ItemListView):
+class RemoteConnectionList(AdminRequiredMixin, ListViewMixin, ItemListView):
     model = models.Access
+    show_project = False
+    keyset_pagination = True
     list_columns = ['user', 'name', 'userlist', 'status', 'created', 'end']
     list_filters = ['created', filters.YearFilterFactory('created', reverse=True), 'userlist', 'status']
     list_search = ['user__username', 'name', 'status', 'userlist__name', 'created']
@@ -73,6 +77,13 @@ class RemoteConnectionStats(PlotViewMixin, RemoteConnectionList):
     date_field = 'created'
     list_url = reverse_lazy("connection-list")
 
+    def get_metrics(self):
+        metrics = super().get_metrics()
+        usage = stats.usage_stats(self.get_queryset())
+        if usage:
+            metrics.setdefault('details', []).append(usage)
+        return metrics
+
 
 class RemoteConnectionDetail(AdminRequiredMixin, detail.DetailView):
     model = models.Access
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from basiclive.utils.signing import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures API signature sign/verify throughput for each supported key type'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--kind', action='append', choices=['ed25519', 'ecdsa', 'rsa'])
+
+    def handle(self, *args, **options):
+        kinds = options.get('kind') or ['ed25519', 'ecdsa', 'rsa']
+        results = benchmark(kinds=kinds, count=options['count'])
+        print("{:<10} {:>12} {:>12}".format('KEY', 'SIGN/s', 'VERIFY/s'))
+        for kind, result in results.items():
+            print("{:<10} {:>12.0f} {:>12.0f}".format(kind, result['sign'], result['verify']))
@@ -14,5 +14,7 @@ urlpatterns = [
     keyed_url(r'^project/$', views.UpdateUserKey.as_view(), name='project-update'),
     keyed_url(r'^samples/(?P<beamline>[\w_-]+)/$', views.ProjectSamples.as_view(), name='project-samples'),
     keyed_url(r'^launch/(?P<beamline>[\w_-]+)/(?P<session>[\w_-]+)/$', views.LaunchSession.as_view(), name='session-launch'),
+    keyed_url(r'^access/$', views.AddConnections.as_view(), name='access-events'),
+    keyed_url(r'^access/snapshot/$', views.AccessSnapshot.as_view(), name='access-snapshot'),
     keyed_url(r'^close/(?P<beamline>[\w_-]+)/(?P<session>[\w_-]+)/$', views.CloseSession.as_view(), name='session-close'),
 ]
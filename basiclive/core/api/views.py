@@ -1,4 +1,6 @@
 import functools
+import hashlib
+import json
 import operator
 import os
 from datetime import timedelta
@@ -8,6 +10,7 @@ import requests
 from django import http
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.http import JsonResponse
 from django.urls import reverse_lazy
@@ -18,7 +21,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
 from basiclive.core.lims.models import ActivityLog, Beamline, Container, Automounter, Data, DataType
-from basiclive.core.lims.models import AnalysisReport, Project, Session
+from basiclive.core.lims.models import Project, Session
 from basiclive.core.lims.templatetags.converter import humanize_duration
 from basiclive.utils.data import parse_frames
 from basiclive.utils.signing import Signer, InvalidSignature
@@ -27,6 +30,11 @@ from basiclive.utils.signing import Signer, InvalidSignature
 if settings.LIMS_USE_SCHEDULE:
     HALF_SHIFT = int(getattr(settings, 'HOURS_PER_SHIFT', 8)/2)
 
+LIMS_USE_ACL = getattr(settings, 'LIMS_USE_ACL', False)
+if LIMS_USE_ACL:
+    from basiclive.core.acl.membership import get_snapshot
+    from basiclive.core.acl.usage import record_events
+
 PROXY_URL = getattr(settings, 'DOWNLOAD_PROXY_URL', '')
 MAX_CONTAINER_DEPTH = getattr(settings, 'MAX_CONTAINER_DEPTH', 2)
 
@@ -197,6 +205,78 @@ class CloseSession(VerificationMixin, View):
         return JsonResponse(session_info)
 
 
+class AddConnections(VerificationMixin, View):
+    """
+    Method for remote access gateways to report connection events in bulk. Only staff keys are accepted. Events of
+    the same connection are applied in time order, creating or updating one Access entry per user, access list and
+    connection name. The payload may be a single event or a list of events.
+
+    :param user: Project__username of the connected user
+    :param list: AccessList__name
+    :param name: str, connection name
+    :param status: one of 'Connected', 'Disconnected', 'Finished' or 'Failed'
+    :param time: ISO formatted time of the event, defaults to now
+
+    :Return: {'created': < new connections >, 'updated': < updated connections >, 'rejected': [< event indices >]}
+
+    :key: r'^(?P<signature>(?P<username>):.+)/access/$'
+    """
+
+    def post(self, request, *args, **kwargs):
+        if not LIMS_USE_ACL:
+            raise http.Http404("Remote access is not enabled.")
+        if not Project.objects.filter(username__exact=kwargs.get('username'), is_superuser=True).exists():
+            return http.HttpResponseForbidden()
+
+        try:
+            payload = msgpack.loads(request.body, raw=False)
+        except ValueError:
+            return http.HttpResponseBadRequest()
+        events = payload if isinstance(payload, list) else [payload]
+        return JsonResponse(record_events(events))
+
+
+class AccessSnapshot(VerificationMixin, View):
+    """
+    Resolved membership of access lists, for remote access gateways to poll. Only staff keys are accepted. Gateways
+    pass their address to receive only the access lists registered for it, all lists are returned otherwise. The
+    snapshot is encoded with msgpack if requested through the Accept header or `?format=msgpack`, and as JSON
+    otherwise. Unchanged snapshots are answered with 304 when the client sends the previous ETag.
+
+    :param address: optional AccessList__address
+
+    :Return: {'version': str, 'generated': < ISO time >, 'lists': [< access list membership >]}
+
+    :key: r'^(?P<signature>(?P<username>):.+)/access/snapshot/$'
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not LIMS_USE_ACL:
+            raise http.Http404("Remote access is not enabled.")
+        if not Project.objects.filter(username__exact=kwargs.get('username'), is_superuser=True).exists():
+            return http.HttpResponseForbidden()
+
+        snapshot = get_snapshot()
+        address = request.GET.get('address')
+        if address:
+            snapshot = dict(snapshot, lists=[entry for entry in snapshot['lists'] if entry['address'] == address])
+
+        if request.GET.get('format') == 'msgpack' or 'msgpack' in request.headers.get('Accept', ''):
+            content, content_type = msgpack.dumps(snapshot), 'application/msgpack'
+        else:
+            content, content_type = json.dumps(snapshot, separators=(',', ':')).encode('utf-8'), 'application/json'
+
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        if request.headers.get('If-None-Match') == etag:
+            response = http.HttpResponseNotModified()
+        else:
+            response = http.HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
 KEYS = {
     'container__name': 'container',
     'container__kind__name': 'container_type',
@@ -262,10 +342,21 @@ TRANSFORMS = {
 }
 
 
+def update_report(report, details):
+    """
+    Update the given fields of an existing report
+    :param report: AnalysisReport
+    :param details: dictionary of field values
+    """
+    for field, value in details.items():
+        setattr(report, field, value)
+    report.save(update_fields=list(details.keys()) + ['modified'])
+
 
 class AddReport(VerificationMixin, View):
     """
-    Method to add meta-data and JSON details about an AnalysisReport.
+    Method to add meta-data and JSON details about an AnalysisReport. The payload may be a single report
+    or a list of reports, in which case a list of results is returned in the same order.
 
     :param username: User__username
     :param data_id: Data objects referenced
@@ -274,6 +365,8 @@ class AddReport(VerificationMixin, View):
     :param details: JSON dict
     :param name: str
     :param beamline: Beamline__acronym
+    :param client_key: str, optional stable identifier for the report. Reports uploaded again with the
+        same key are updated instead of being duplicated.
 
     :Return: {'id': < Created AnalysisReport.pk >}
 
@@ -281,7 +374,7 @@ class AddReport(VerificationMixin, View):
     """
 
     def post(self, request, *args, **kwargs):
-        info = msgpack.loads(request.body, raw=False)
+        payload = msgpack.loads(request.body, raw=False)
 
         project_name = kwargs.get('username')
         try:
@@ -289,38 +382,73 @@ class AddReport(VerificationMixin, View):
         except Project.DoesNotExist:
             raise http.Http404("Project does not exist.")
 
-        try:
-            data = Data.objects.filter(pk__in=info.get('data_id'))
-        except:
-            raise http.Http404("Data does not exist")
-
-        # Download  key
-        try:
-            key = make_secure_path(info.get('directory'))
-        except ValueError:
-            return http.HttpResponseServerError("Unable to create SecurePath")
+        entries = payload if isinstance(payload, list) else [payload]
+        if not entries or not all(isinstance(info, dict) for info in entries):
+            return http.HttpResponseBadRequest()
 
+        # Download keys, resolved for all entries before anything is saved
+        paths = {}
+        for info in entries:
+            directory = info.get('directory')
+            if directory not in paths:
+                try:
+                    paths[directory] = make_secure_path(directory)
+                except ValueError:
+                    return http.HttpResponseServerError("Unable to create SecurePath")
+
+        with transaction.atomic():
+            reports = [self.save_report(project, info, paths[info.get('directory')]) for info in entries]
+            ActivityLog.objects.bulk_create([
+                ActivityLog.objects.make_entry(request, report, ActivityLog.TYPE.CREATE, "{} uploaded from {}".format(
+                    report.name, kwargs.get('beamline', 'beamline')))
+                for report in reports
+            ])
+        if isinstance(payload, list):
+            return JsonResponse([{'id': report.pk} for report in reports], safe=False)
+        return JsonResponse({'id': reports[0].pk})
+
+    @staticmethod
+    def save_report(project, info, key):
+        """
+        Create or update a single report and link it to its datasets
+        :param project: Project
+        :param info: report information
+        :param key: download key for the report directory
+        :return: AnalysisReport
+        """
         details = {
-            'project': project,
             'score': info.get('score') if info.get('score') else 0,
             'kind': info.get('kind', 'Data Analysis'),
             'details': info.get('details'),
             'name': info.get('title'),
             'url': key
         }
-        report = AnalysisReport.objects.filter(pk=info.get('id')).first()
-
-        if report:
-            project.reports.filter(pk=report.pk).update(**details)
-        else:
-            report, created = AnalysisReport.objects.get_or_create(**details)
+        client_key = info.get('client_key')
 
-        for d in data:
-            report.data.add(d)
-
-        ActivityLog.objects.log_activity(request, report, ActivityLog.TYPE.CREATE, "{} uploaded from {}".format(
-            report.name, kwargs.get('beamline', 'beamline')))
-        return JsonResponse({'id': report.pk})
+        with transaction.atomic():
+            if client_key:
+                try:
+                    with transaction.atomic():
+                        report, created = project.reports.update_or_create(client_key=client_key, defaults=details)
+                except IntegrityError:
+                    # created concurrently by another request with the same key
+                    report = project.reports.filter(client_key=client_key).first()
+                    if not report:
+                        raise
+                    update_report(report, details)
+            else:
+                report = project.reports.filter(pk=info.get('id')).first() if info.get('id') else None
+                if report is None:
+                    # reports uploaded again without a key are matched on their kind, name and download key
+                    report = project.reports.filter(kind=details['kind'], name=details['name'], url=key).first()
+                if report:
+                    update_report(report, details)
+                else:
+                    report = project.reports.create(**details)
+
+            data_ids = Data.objects.filter(pk__in=info.get('data_id') or []).values_list('pk', flat=True)
+            report.data.add(*data_ids)
+        return report
 
 
 class AddData(VerificationMixin, View):
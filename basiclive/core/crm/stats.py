@@ -1,17 +1,96 @@
 import calendar
+from collections import defaultdict
 from datetime import timedelta
 
-from django.db.models import Count, Sum, F, Case, When, IntegerField, Q, DateTimeField, ExpressionWrapper
+import numpy
+from django.conf import settings
+from django.db.models import Count, Sum, Case, When, IntegerField, Q, Min, Max
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Trunc
 from django.template.defaultfilters import linebreaksbr
 
 from basiclive.core.lims.models import Session
 from basiclive.core.lims.stats import js_epoch
-from .models import SupportArea, AreaFeedback, SupportRecord, LikertScale
+from .models import SupportArea, AreaFeedback, Feedback, SupportRecord
 
 
-def avg_diff(td):
-    diffs = [abs(td[i]['created'] - td[i - 1]['end']).total_seconds()/3600 for i in range(1, len(td))]
-    return len(td) > 1 and (sum(diffs)/(len(td) - 1)) or None
+TIMELINE_BUCKET_DAYS = getattr(settings, 'SUPPORT_TIMELINE_BUCKET_DAYS', 365)
+TIMELINE_BUCKETS = {
+    'week': timedelta(days=7),
+    'month': timedelta(days=30),
+}
+
+
+def avg_diff(starts, ends):
+    """
+    Mean interval in hours between the end of each failure and the start of the next
+    :param starts: array of failure start times in seconds
+    :param ends: array of failure end times in seconds
+    :return: mean interval or None if there are fewer than two failures
+    """
+    if len(starts) < 2:
+        return None
+    return float(numpy.abs(starts[1:] - ends[:-1]).mean() / 3600)
+
+
+def failure_intervals(fails):
+    """
+    Calculate the mean time between failures overall, for beamline areas and for each area, from a single query
+    :param fails: SupportRecord queryset of problems
+    :return: dictionary mapping 'Overall', 'Beamline Overall' and area names to MTBF in hours
+    """
+    rows = fails.values_list('pk', 'created', 'lost_time', 'areas__name', 'areas__external').order_by('created', 'pk')
+    records = {}
+    areas = defaultdict(list)
+    external = set()
+    for pk, created, lost_time, area, is_external in rows:
+        records[pk] = (created.timestamp(), created.timestamp() + 3600 * lost_time)
+        if area is not None:
+            areas[area].append(pk)
+        if is_external:
+            external.add(pk)
+
+    def mtbf(pks):
+        times = numpy.array([records[pk] for pk in pks], dtype=float).reshape(-1, 2)
+        return avg_diff(times[:, 0], times[:, 1])
+
+    return {
+        'Overall': mtbf(list(records)),
+        'Beamline Overall': mtbf([pk for pk in records if pk not in external]),
+        **{name: mtbf(pks) for name, pks in areas.items()}
+    }
+
+
+def support_timeline(objlist, bucket=None):
+    """
+    Timeline entries for support records
+    :param objlist: SupportRecord queryset
+    :param bucket: if 'week' or 'month', records are counted per kind and period instead of listed individually
+    :return: list of timeline entries
+    """
+    if bucket is None:
+        return [
+            {
+                "type": data['kind'],
+                "start": js_epoch(data['created']),
+                "end": js_epoch(data['created'] + timedelta(minutes=min(60 * data['lost_time'], 1))),
+                "label": "{}".format(data["kind"])
+            }
+            for data in objlist.values('created', 'lost_time', 'kind')
+        ]
+
+    rows = objlist.annotate(period=Trunc('created', bucket)).values_list('period', 'kind').order_by(
+        'period', 'kind'
+    ).annotate(count=Count('pk'), time_lost=Sum('lost_time'))
+    return [
+        {
+            "type": kind,
+            "start": js_epoch(period),
+            "end": js_epoch(period + TIMELINE_BUCKETS[bucket]),
+            "label": "{} {} ({:0.1f} h lost)".format(count, kind, time_lost or 0)
+        }
+        for period, kind, count, time_lost in rows
+    ]
 
 
 def supportrecord_stats(objlist, filters):
@@ -37,30 +116,15 @@ def supportrecord_stats(objlist, filters):
         } for i, area in enumerate(support_areas)
     ]
 
-    fails = objlist.filter(kind__iexact='problem').annotate(
-        end=ExpressionWrapper(F('created') + timedelta(hours=1) * F('lost_time'), output_field=DateTimeField())
-    )
-    mtbf_overall = avg_diff(list(fails.order_by('created').values('created', 'end')))
-    mtbf_beamline = avg_diff(list(fails.exclude(areas__external=True).order_by('created').values('created', 'end')))
-
-    mtbf = {
-        **{
-            'Overall': mtbf_overall,
-            'Beamline Overall': mtbf_beamline,
-        }, **{
-            a['name']: avg_diff(list(fails.filter(areas__name=a['name']).order_by('created').values('created', 'end')))
-            for a in support_areas
-        }
-    }
-    timeline_data = [
-        {
-            "type": data['kind'],
-            "start": js_epoch(data['created']),
-            "end": js_epoch(data['created'] + timedelta(minutes=min(60 * data['lost_time'], 1))),
-            "label": "{}".format(data["kind"])
-        }
-        for data in objlist.values('created', 'lost_time', 'kind')
-    ]
+    mtbf = failure_intervals(objlist.filter(kind__iexact='problem'))
+    for area in support_areas:
+        mtbf.setdefault(area['name'], None)
+
+    span = objlist.aggregate(first=Min('created'), last=Max('created'))
+    bucket = None
+    if span['first'] and span['last'] - span['first'] > timedelta(days=TIMELINE_BUCKET_DAYS):
+        bucket = 'month' if span['last'] - span['first'] > timedelta(days=4 * TIMELINE_BUCKET_DAYS) else 'week'
+    timeline_data = support_timeline(objlist, bucket)
     total_rows = []
     for name, sa in [('Overall', support_areas), ('Beamline Overall', [s for s in support_areas if not s['external']])]:
         total_rows.append([
@@ -206,18 +270,41 @@ def feedback_stats(objlist, filters):
         field = "created__{}".format(period)
 
     period_dict = {per: period == 'month' and calendar.month_abbr[per].title() or per for per in periods}
+
+    # sessions and responses per period in a single grouped query
+    session_counts = defaultdict(lambda: {'total': 0, 'responses': 0})
+    session_rows = sessions.annotate(
+        responded=Exists(Feedback.objects.filter(session=OuterRef('pk')))
+    ).values_list(field, 'responded').order_by(field).annotate(count=Count('pk'))
+    for per, responded, count in session_rows:
+        session_counts[per]['total'] += count
+        if responded:
+            session_counts[per]['responses'] += count
+
     response_rate = [{
         period.title(): name,
         "Response Rate (%)": round(
-            100. * sessions.filter(**{field: per}).filter(feedback__isnull=False).count() / max(1, sessions.filter(
-                **{field: per}).count()), 2),
-        "Sessions": sessions.filter(**{field: per}).count(),
-        "Responses": sessions.filter(**{field: per}).filter(feedback__isnull=False).count()
+            100. * session_counts[per]['responses'] / max(1, session_counts[per]['total']), 2),
+        "Sessions": session_counts[per]['total'],
+        "Responses": session_counts[per]['responses']
     } for per, name in period_dict.items()]
 
+    # ratings per area in a single grouped query, pivoted into one Likert matrix per scale
+    rating_counts = defaultdict(int)
+    scale_ratings = defaultdict(lambda: {'total': 0, 'count': 0})
+    rating_rows = area_feedback.values_list('area', 'area__scale', 'rating').order_by().annotate(count=Count('pk'))
+    for area, scale, rating, count in rating_rows:
+        rating_counts[(area, rating)] += count
+        if rating != 0:
+            scale_ratings[scale]['total'] += rating * count
+            scale_ratings[scale]['count'] += count
+
+    scale_areas = defaultdict(list)
+    for area in SupportArea.objects.filter(user_feedback=True, scale__isnull=False).select_related('scale').order_by('pk'):
+        scale_areas[area.scale].append(area)
+
     likerts = []
-    areas_pk = SupportArea.objects.filter(user_feedback=True).values_list('scale__pk', flat=True)
-    for scale in LikertScale.objects.filter(pk__in=areas_pk):
+    for scale in sorted(scale_areas, key=lambda s: s.pk):
         choices = list(scale.choices())[:-1]
         choices = [choices[1], choices[0]] + choices[2:]
         choice_colors = dict(zip([c[1] for c in choices], colors))
@@ -226,18 +313,18 @@ def feedback_stats(objlist, filters):
             {
                 **{'Area': area.name},
                 **{
-                    c[1]: area_feedback.filter(area=area, rating=c[0]).count() * (c[0] < 0 and -1 or 1)
+                    c[1]: rating_counts[(area.pk, c[0])] * (c[0] < 0 and -1 or 1)
                     for c in choices
                 }
-             } for area in SupportArea.objects.filter(user_feedback=True, scale=scale).order_by('pk')
+             } for area in scale_areas[scale]
         ]
 
-        scale_feedback = area_feedback.exclude(rating=0).filter(area__scale=scale)
+        scale_info = scale_ratings[scale.pk]
         likerts.append({
             'data': likert_data,
             'colors': choice_colors,
             'choices': choices,
-            'average': scale_feedback and sum([a.rating for a in scale_feedback])/scale_feedback.count() or 0,
+            'average': scale_info['count'] and scale_info['total'] / scale_info['count'] or 0,
             'avgs': {
                 e['Area']: sum([rating * abs(e[ch]) for rating, ch in choices]) / max(
                     sum([abs(e[ch]) for _, ch in choices]), 1)
@@ -210,6 +210,7 @@ class UnloadContainer(AdminRequiredMixin, View):
 
         models.LoadHistory.objects.filter(child=self.kwargs['pk']).active().update(end=timezone.now())
         models.Container.objects.filter(pk=container.pk).update(parent=None, location=None)
+        models.Container.objects.filter(pk=container.pk).update_ports()
 
         return JsonResponse(root.get_layout(), safe=False)
 
@@ -246,6 +247,7 @@ class CreateShipmentSamples(LoginRequiredMixin, View):
                 for i, details in enumerate(grouped_samples.get(group.pk, [])):
                     to_create.append(models.Sample(name='{}_{}'.format(group.name, i + 1), group=group, **details))
             shipment.project.samples.bulk_create(to_create)
+            models.Sample.objects.filter(container__shipment=shipment).update_ports()
             return JsonResponse({'url': shipment.get_absolute_url()}, safe=False)
         except models.Shipment.DoesNotExist:
             raise http.Http404('Shipment Not Found!')
@@ -293,6 +295,7 @@ class SaveContainerSamples(LoginRequiredMixin, View):
                     models.Sample.objects.filter(
                         project=container.project, location_id=sample['location'], container=container
                     ).delete()
+            container.samples.all().update_ports()
 
             return JsonResponse({'url': container.get_absolute_url()}, safe=False)
         except models.Container.DoesNotExist:
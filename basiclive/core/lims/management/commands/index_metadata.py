@@ -0,0 +1,63 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, DatabaseError
+
+from basiclive.core.lims.models import DataType, METADATA_TYPES
+from basiclive.utils.functions import numeric_cast_sql
+
+INDEX_PREFIX = 'lims_data_metakey_'
+SQL_TYPES = {
+    'float': 'double precision',
+    'int': 'integer',
+}
+
+
+def index_expression(key):
+    """
+    SQL expression matching the one generated by metadata_expression() for the key
+    """
+    value = "(\"meta_data\" ->> '{}')".format(key)
+    sql_type = SQL_TYPES.get(METADATA_TYPES.get(key))
+    return value if sql_type is None else numeric_cast_sql(value, sql_type)
+
+
+class Command(BaseCommand):
+    help = 'Creates expression indexes on Data.meta_data for all keys declared by data types (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop-stale', action='store_true', help='Drop indexes of keys no longer declared')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            print('Metadata indexes are only supported on PostgreSQL')
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'lims_data' AND indexname LIKE %s",
+                ['{}%'.format(INDEX_PREFIX.replace('_', r'\_'))]
+            )
+            existing = dict(cursor.fetchall())
+
+        keys = sorted(key for key in DataType.objects.metadata_keys() if re.match(r'^\w+$', key))
+        for key in keys:
+            name = '{}{}'.format(INDEX_PREFIX, key)
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        if METADATA_TYPES.get(key) in SQL_TYPES and 'CASE' not in existing.get(name, 'CASE'):
+                            # replace indexes built with an unguarded cast
+                            cursor.execute('DROP INDEX "{}"'.format(name))
+                        cursor.execute('CREATE INDEX IF NOT EXISTS "{}" ON "lims_data" (({}))'.format(
+                            name, index_expression(key)
+                        ))
+                print('Indexed: {}'.format(key))
+            except DatabaseError as e:
+                print('Failed: {} ({})'.format(key, e))
+
+        if options['drop_stale']:
+            with connection.cursor() as cursor:
+                for name in sorted(set(existing) - {'{}{}'.format(INDEX_PREFIX, key) for key in keys}):
+                    cursor.execute('DROP INDEX IF EXISTS "{}"'.format(name))
+                    print('Dropped: {}'.format(name))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from basiclive.core.lims.views import proxy_cache
+
+
+class Command(BaseCommand):
+    help = 'Reports hit/miss metrics and disk usage of the snapshot and frame image cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Remove all cached files and reset the metrics')
+        parser.add_argument('--evict', action='store_true', help='Evict least recently used files now, and re-measure the cache directory')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            proxy_cache.clear()
+            print('Cache cleared')
+        elif options['evict']:
+            proxy_cache.evict()
+
+        info = proxy_cache.stats()
+        print('Directory: {}'.format(proxy_cache.root or 'disabled'))
+        print('Usage: {:0.1f} of {:0.1f} MB'.format(info['bytes'] / 1024 ** 2, info['max_bytes'] / 1024 ** 2))
+        for event in ('hit', 'miss', 'revalidated', 'stale', 'error', 'evicted'):
+            print('{}: {}'.format(event.title(), info[event]))
+        print('Hit Ratio: {:0.1%}'.format(info['hit_ratio']))
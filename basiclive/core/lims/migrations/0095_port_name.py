@@ -0,0 +1,53 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Coalesce, Concat
+
+MAX_CONTAINER_DEPTH = getattr(settings, 'MAX_CONTAINER_DEPTH', 2)
+SAMPLE_PORT_FIELDS = [
+    "container{}__location__name".format("__".join([""] + (["parent"] * i)))
+    for i in reversed(range(MAX_CONTAINER_DEPTH))
+] + ['location__name']
+CONTAINER_PORT_FIELDS = [
+    "{}location__name".format("__".join((["parent"] * i) + [""]))
+    for i in reversed(range(MAX_CONTAINER_DEPTH))
+]
+
+
+def port_expression(fields):
+    parts = [Coalesce(field, Value('')) for field in fields]
+    return Concat(*parts, output_field=CharField()) if len(parts) > 1 else parts[0]
+
+
+def populate_ports(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for model_name, fields in (('Container', CONTAINER_PORT_FIELDS), ('Sample', SAMPLE_PORT_FIELDS)):
+        Model = apps.get_model('lims', model_name)
+        entries = Model.objects.using(db_alias).annotate(
+            port=port_expression(fields)
+        ).values_list('pk', 'port')
+        to_update = [Model(pk=pk, port_name=port) for pk, port in entries if port]
+        Model.objects.using(db_alias).bulk_update(to_update, ['port_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0094_requesttype_scope'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='container',
+            name='port_name',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='port_name',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(populate_ports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0095_port_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisreport',
+            name='client_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='analysisreport',
+            unique_together={('project', 'client_key')},
+        ),
+    ]
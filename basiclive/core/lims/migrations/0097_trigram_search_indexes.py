@@ -0,0 +1,56 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+from django.db import migrations
+
+# Trigram indexes serving case-insensitive substring searches (icontains) of list views on PostgreSQL.
+# Index expressions match the SQL generated by Django for icontains lookups: UPPER("column"::text)
+SEARCH_INDEXES = {
+    'lims_project': [
+        'username', 'name', 'contact_person', 'contact_phone', 'contact_email', 'city', 'province', 'country',
+        'department', 'organisation'
+    ],
+    'lims_data': ['name'],
+    'lims_sample': ['name', 'barcode', 'comments'],
+    'lims_container': ['name', 'comments'],
+    'lims_group': ['name', 'comments'],
+    'lims_shipment': ['name', 'comments'],
+    'lims_analysisreport': ['name'],
+    'lims_session': ['name'],
+    'lims_activitylog': ['description', 'ip_number'],
+}
+
+
+def index_name(table, column):
+    return '{}_{}_trgm'.format(table, column)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, columns in SEARCH_INDEXES.items():
+        for column in columns:
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" USING gin (UPPER("{column}"::text) gin_trgm_ops)'.format(
+                    name=index_name(table, column), table=table, column=column
+                )
+            )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, columns in SEARCH_INDEXES.items():
+        for column in columns:
+            schema_editor.execute('DROP INDEX IF EXISTS "{}"'.format(index_name(table, column)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0096_analysisreport_client_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:30
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS "lims_data_meta_data_gin" ON "lims_data" USING gin ("meta_data" jsonb_path_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS "lims_data_meta_data_gin"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lims', '0097_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
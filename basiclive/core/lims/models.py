@@ -10,11 +10,17 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.db.models import Q, F, Count, CharField, BooleanField, Value, Sum
-from django.db.models.functions import Coalesce, Concat
+from django.core.cache import cache
+from django.db import connections, models, transaction
+from django.db.models import Q, F, Count, CharField, BooleanField, Value, Sum, Min, Max, OuterRef, Subquery
+from django.db.models import ExpressionWrapper, FloatField, IntegerField, Window
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Coalesce, Concat, Lag
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.text import slugify
 from django.utils.translation import ugettext as _
 
 from memoize import memoize
@@ -23,14 +29,28 @@ from model_utils.models import TimeStampedModel
 
 from basiclive.utils.data import parse_frames, frame_ranges
 from basiclive.utils.encrypt import encrypt
-from basiclive.utils.functions import ShiftEnd, ShiftStart
+from basiclive.utils.functions import NumericCast, ShiftEnd, ShiftStart
+from basiclive.utils.pdf import renderer
 
 IDENTITY_FORMAT = '-%y%m'
 RESTRICT_DOWNLOADS = getattr(settings, 'RESTRICT_DOWNLOADS', False)
 SHIFT_HRS = getattr(settings, 'HOURS_PER_SHIFT', 8)
 SHIFT_SECONDS = SHIFT_HRS * 3600
+SESSION_SUMMARY_FIELDS = (
+    'first_start', 'last_start', 'last_end', 'open_stretches', 'duration', 'shift_duration',
+    'data_count', 'sample_count', 'group_count', 'orphan_count', 'report_count', 'last_record'
+)
+SESSION_SUMMARY_KEY = 'lims:session-summary:{}'
+SESSION_SUMMARY_TIMEOUT = 86400
+ACTIVE_SESSION_SUMMARY_TIMEOUT = 60
+SESSION_GAP = timedelta(minutes=getattr(settings, 'SESSION_GAP_MINUTES', 10))
+
+SHIPMENT_LABEL_TEMPLATES = ('lims/pdf/send_labels.html', 'lims/pdf/return_labels.html')
+PRERENDER_LABELS = getattr(settings, 'PDF_PRERENDER_LABELS', True)
 
 MAX_CONTAINER_DEPTH = getattr(settings, 'MAX_CONTAINER_DEPTH', 2)
+PORT_BATCH_SIZE = 500
+PORT_NAME_LENGTH = 64  # location names of up to 5 characters for containers nested up to 11 deep
 SAMPLE_PORT_FIELDS = [
                          "container{}__location__name".format("__".join([""] + (["parent"] * i)))
                          for i in reversed(range(MAX_CONTAINER_DEPTH))
@@ -41,6 +61,17 @@ CONTAINER_PORT_FIELDS = [
     for i in reversed(range(MAX_CONTAINER_DEPTH))
 ]
 
+METADATA_KEYS_KEY = 'lims:metadata-keys'
+METADATA_KEYS_TIMEOUT = 3600
+METADATA_TYPES = getattr(settings, 'LIMS_METADATA_TYPES', {
+    'delta_angle': 'float', 'start_angle': 'float', 'resolution': 'float', 'pixel_size': 'float',
+    'beam_x': 'float', 'beam_y': 'float', 'two_theta': 'float',
+})
+METADATA_FIELDS = {
+    'float': FloatField,
+    'int': IntegerField,
+}
+
 DRAFT = 0
 SENT = 1
 ON_SITE = 2
@@ -238,7 +269,51 @@ class StretchManager(models.Manager.from_queryset(StretchQuerySet)):
     use_for_related_fields = True
 
 
-class ProjectObjectManager(models.Manager):
+class ProjectObjectQuerySet(models.QuerySet):
+    def transition(self, status, request=None, description='', hooks=None):
+        """
+        Change the status of all objects in the queryset in bulk. Every current state is validated against the
+        TRANSITIONS of the model, and the change is then applied with a single UPDATE. Objects already in the target
+        state are left untouched.
+
+        :param status: target state
+        :param request: if provided, ActivityLog entries are created for all changed objects
+        :param description: description of the ActivityLog entries
+        :param hooks: if True, call change_status() on each object instead of updating in bulk, so that per-object
+            logic in save() is run. Defaults to the TRANSITION_HOOKS attribute of the model
+        :return: number of objects changed
+        """
+        model = self.model
+        hooks = model.TRANSITION_HOOKS if hooks is None else hooks
+        pending = self.exclude(status=status)
+        states = set(pending.order_by().values_list('status', flat=True).distinct())
+        invalid = [state for state in states if status not in model.TRANSITIONS.get(state, [])]
+        if invalid:
+            raise ValueError("Invalid transition on '{}':  '{}' -> '{}'".format(
+                model.__name__, ', '.join(str(model.STATES[state]) for state in invalid), model.STATES[status]
+            ))
+        if not states:
+            return 0
+
+        if hooks or request:
+            objects = list(pending)
+            if hooks:
+                for obj in objects:
+                    obj.change_status(status)
+            else:
+                model.objects.filter(pk__in=[obj.pk for obj in objects]).update(status=status, modified=timezone.now())
+            if request:
+                for obj in objects:
+                    obj.status = status
+                ActivityLog.objects.log_activities(
+                    request, objects, ActivityLog.TYPE.MODIFY,
+                    description or 'Status changed to {}'.format(model.STATES[status])
+                )
+            return len(objects)
+        return pending.update(status=status, modified=timezone.now())
+
+
+class ProjectObjectManager(models.Manager.from_queryset(ProjectObjectQuerySet)):
     def get_queryset(self):
         return super().get_queryset().select_related('project')
 
@@ -254,6 +329,51 @@ class SessionQuerySet(models.QuerySet):
             ),
         )
 
+    def with_summary(self):
+        """
+        Annotate sessions with the values used by the Session summary methods (duration, shifts, start, end,
+        activity and dataset, report, sample, group and orphan counts). Each value is a correlated subquery, so
+        the whole list is fetched in a single query without multiplying rows across relationships.
+        """
+        now = timezone.now()
+        stretches = Stretch.objects.filter(session=OuterRef('pk'))
+        datasets = Data.objects.filter(session=OuterRef('pk'))
+        reports = AnalysisReport.objects.filter(project=OuterRef('project'), data__session=OuterRef('pk'))
+
+        return self.annotate(
+            first_start=summary_subquery(stretches, 'session', Min('start')),
+            last_start=summary_subquery(stretches, 'session', Max('start')),
+            last_end=summary_subquery(stretches, 'session', Max('end')),
+            open_stretches=Coalesce(summary_subquery(stretches.filter(end__isnull=True), 'session', Count('pk')), 0),
+            duration=summary_subquery(stretches, 'session', Sum(Coalesce('end', now) - F('start'))),
+            shift_duration=summary_subquery(
+                stretches, 'session', Sum(ShiftEnd(Coalesce('end', now)) - ShiftStart('start'))
+            ),
+            data_count=Coalesce(summary_subquery(datasets, 'session', Count('pk')), 0),
+            sample_count=Coalesce(summary_subquery(
+                datasets.filter(sample__project=OuterRef('project')), 'session', Count('sample', distinct=True)
+            ), 0),
+            group_count=Coalesce(summary_subquery(
+                datasets.filter(sample__group__project=OuterRef('project')), 'session',
+                Count('sample__group', distinct=True)
+            ), 0),
+            orphan_count=Coalesce(summary_subquery(
+                datasets.filter(sample__isnull=True), 'session', Count('name', distinct=True)
+            ), 0),
+            report_count=Coalesce(summary_subquery(reports, 'project', Count('pk', distinct=True)), 0),
+            last_record=Subquery(datasets.order_by('-created').values('modified')[:1]),
+        )
+
+
+def summary_subquery(queryset, group_field, aggregate):
+    """
+    Correlated subquery returning a single aggregate value over a queryset filtered by an OuterRef
+    :param queryset: queryset filtered on an OuterRef of the enclosing query
+    :param group_field: field through which the queryset is related to the enclosing query
+    :param aggregate: aggregate expression
+    """
+    return Subquery(queryset.order_by().values(group_field).annotate(value=aggregate).values('value')[:1])
+
 
 class SessionManager(models.Manager.from_queryset(SessionQuerySet)):
     use_for_related_fields = True
@@ -288,14 +408,37 @@ class Session(models.Model):
         return encrypt("{user}:{name}".format(user=self.project.username, name=self.name))
 
     def launch(self):
-        Stretch.objects.active(extras={'session__beamline': self.beamline}).exclude(session=self).update(
-            end=timezone.now())
+        others = Stretch.objects.active(extras={'session__beamline': self.beamline}).exclude(session=self)
+        sessions = [self.pk, *others.values_list('session', flat=True)]
+        others.update(end=timezone.now())
         self.stretches.recent().update(end=None)
         stretch = self.stretches.active().last() or Stretch.objects.create(session=self, start=timezone.now())
+        # expire once the changes are visible, so that concurrent reads can not cache the summaries from before
+        transaction.on_commit(lambda: expire_session_summaries(*sessions))
         return stretch
 
     def close(self):
         self.stretches.active().update(end=timezone.now())
+        transaction.on_commit(lambda: expire_session_summaries(self.pk))
+
+    def summary(self):
+        """
+        Returns a dictionary of summary values for the session. Values annotated through
+        SessionQuerySet.with_summary() are used if present, otherwise the cached summary record is used,
+        which is refreshed when stretches or datasets of the session change.
+        """
+        if hasattr(self, SESSION_SUMMARY_FIELDS[0]):
+            return {field: getattr(self, field) for field in SESSION_SUMMARY_FIELDS}
+        if not hasattr(self, '_summary'):
+            key = SESSION_SUMMARY_KEY.format(self.pk)
+            self._summary = cache.get(key)
+            if self._summary is None:
+                self._summary = Session.objects.filter(pk=self.pk).with_summary().values(
+                    *SESSION_SUMMARY_FIELDS
+                ).first()
+                timeout = ACTIVE_SESSION_SUMMARY_TIMEOUT if self._summary['open_stretches'] else SESSION_SUMMARY_TIMEOUT
+                cache.set(key, self._summary, timeout)
+        return self._summary
 
     def groups(self):
         return Group.objects.filter(samples__datasets__session=self, project=self.project).distinct()
@@ -305,7 +448,7 @@ class Session(models.Model):
 
     def orphans(self):
         samples = defaultdict(OrphanSample)
-        for data in self.datasets.filter(sample__isnull=True).all():
+        for data in self.datasets.filter(sample__isnull=True).prefetch_related('reports'):
             samples[data.name].name = data.name
             samples[data.name].orphaned_datasets.append(data)
             samples[data.name].orphaned_reports.extend(data.reports.all())
@@ -313,29 +456,36 @@ class Session(models.Model):
         return list(samples.values())
 
     def num_datasets(self):
-        return self.datasets.count()
+        return self.summary()['data_count']
 
     num_datasets.short_description = _("Datasets")
 
     def num_reports(self):
-        return self.reports().count()
+        return self.summary()['report_count']
 
     num_reports.short_description = _("Reports")
 
+    def num_samples(self):
+        return self.summary()['sample_count']
+
+    def num_groups(self):
+        return self.summary()['group_count']
+
+    def num_orphans(self):
+        return self.summary()['orphan_count']
+
     def samples(self):
         return self.project.samples.filter(datasets__session=self).distinct()
 
-    @memoize(60)
     def is_active(self):
-        return self.stretches.active().exists()
+        return self.summary()['open_stretches'] > 0
 
-    @memoize(60)
     def is_recent(self):
         return self.end() >= (timezone.now() - timedelta(days=7))
 
     def shifts(self):
-        total = self.stretches.with_duration().aggregate(time=Sum('shift_duration'))
-        return total['time'].total_seconds() / SHIFT_SECONDS
+        duration = self.summary()['shift_duration']
+        return duration.total_seconds() / SHIFT_SECONDS if duration else 0
 
     def shift_parts(self):
         shifts = set()
@@ -351,44 +501,67 @@ class Session(models.Model):
                 shifts.add(st)
             return len(shifts)
 
-    @memoize(60)
     def total_time(self):
         """
         Returns total time the session was active, in hours
         """
-        total = self.stretches.with_duration().aggregate(time=Sum('duration'))
-
-        return total['time'].total_seconds() / 3600
+        duration = self.summary()['duration']
+        return duration.total_seconds() / 3600 if duration else 0
 
     total_time.short_description = _("Duration")
 
-    @memoize(60)
     def start(self):
-        return timezone.localtime(self.stretches.earliest('start').start)
+        return timezone.localtime(self.summary()['first_start'] or self.created)
 
-    @memoize(60)
     def end(self):
-        return timezone.localtime(self.stretches.latest('start').end or timezone.localtime())
+        summary = self.summary()
+        if summary['open_stretches'] or not summary['last_end']:
+            return timezone.localtime()
+        return timezone.localtime(summary['last_end'])
 
-    @memoize(60)
     def last_record_time(self):
-        last_data = self.datasets.last()
-        return last_data.modified if last_data else self.created
+        return self.summary()['last_record'] or self.created
 
-    def gaps(self):
-        data = list(self.datasets.order_by('start_time'))
-        max_gap = timedelta(minutes=10)
-
-        return [
-            (
-                timezone.localtime(first.end_time),
-                timezone.localtime(second.start_time),
-                (second.start_time - first.end_time)
+    def gaps(self, min_gap=SESSION_GAP):
+        """
+        Find periods without data collection within the session. Each dataset is compared to the previous one with
+        LAG(end_time) so that only the gaps, rather than all datasets, are loaded.
+        :param min_gap: minimum duration of a gap
+        :return: list of tuples (start, end, duration)
+        """
+        datasets = self.datasets.order_by().annotate(
+            previous_end=Window(Lag('end_time'), order_by=[F('start_time').asc(), F('pk').asc()])
+        ).values_list('previous_end', 'start_time')
+
+        connection = connections[datasets.db]
+        if connection.vendor == 'postgresql':
+            # window values can not be filtered directly, so filter on the wrapping query instead
+            sql, params = datasets.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT previous_end, start_time FROM ({}) AS intervals '
+                    'WHERE start_time - previous_end > %s ORDER BY start_time'.format(sql), params + (min_gap,)
+                )
+                rows = cursor.fetchall()
+        else:
+            rows = (
+                (end, start) for end, start in datasets.order_by('start_time').iterator()
+                if end and start and start - end > min_gap
             )
-            for first, second in zip(data[:-1], data[1:]) if (second.start_time - first.end_time) > max_gap
+        return [
+            (timezone.localtime(end), timezone.localtime(start), start - end)
+            for end, start in rows
         ]
 
 
+def expire_session_summaries(*pks):
+    """
+    Remove cached summary records for the given sessions
+    :param pks: session primary keys
+    """
+    cache.delete_many([SESSION_SUMMARY_KEY.format(pk) for pk in set(pks) if pk])
+
+
 class Stretch(models.Model):
     start = models.DateTimeField(null=False, blank=False)
     end = models.DateTimeField(null=True, blank=True)
@@ -409,6 +582,9 @@ class ProjectObjectMixin(models.Model):
 
     TRANSITIONS: a dict specifying valid state transitions. the keys are starting STATES and the
         values are lists of valid final STATES.
+
+    TRANSITION_HOOKS: whether bulk transitions (ProjectObjectQuerySet.transition) should call change_status on each
+        object instead of updating all objects with a single query.
      """
 
     STATES = GLOBAL_STATES
@@ -422,6 +598,7 @@ class ProjectObjectMixin(models.Model):
         STATES.PROCESSING: [STATES.COMPLETE, STATES.ARCHIVED],
         STATES.COMPLETE: [STATES.ACTIVE, STATES.PROCESSING, STATES.ARCHIVED],
     }
+    TRANSITION_HOOKS = False
 
     name = models.CharField(max_length=60)
     staff_comments = models.TextField(blank=True, null=True)
@@ -647,27 +824,41 @@ class Shipment(TransitStatusMixin):
     def receive(self, request=None):
         self.date_received = timezone.now()
         self.save()
-        for obj in self.containers.all():
-            obj.receive(request=request)
+        self.containers.all().transition(Container.STATES.ON_SITE, request=request)
         super(Shipment, self).receive(request=request)
 
     def send(self, request=None):
         if self.is_sendable():
             self.date_shipped = timezone.now()
             self.save()
-            for obj in self.containers.all():
-                obj.send(request=request)
+            self.containers.all().transition(Container.STATES.SENT, request=request)
             self.groups.all().update(status=Group.STATES.ACTIVE)
             self.requests().update(status=Request.STATUS_CHOICES.PENDING)
             super(Shipment, self).send(request=request)
+            if PRERENDER_LABELS:
+                transaction.on_commit(self.prerender_labels)
+
+    def label_context(self):
+        return {
+            'project': self.project,
+            'shipment': self,
+            'admin_project': Project.objects.filter(is_superuser=True).first()
+        }
+
+    def prerender_labels(self):
+        """
+        Render the shipping labels in the background so that they are served from the cache when downloaded
+        """
+        context = self.label_context()
+        for template_name in SHIPMENT_LABEL_TEMPLATES:
+            renderer.prerender(template_name, context, slugify(self.name))
 
     def unsend(self, request=None):
         if self.status == self.STATES.SENT:
             self.date_shipped = None
             self.status = self.STATES.DRAFT
             self.save()
-            for obj in self.containers.all():
-                obj.unsend()
+            self.containers.all().transition(Container.STATES.DRAFT)
             self.groups.all().update(status=Group.STATES.DRAFT)
             self.requests().update(status=Request.STATUS_CHOICES.DRAFT)
 
@@ -676,30 +867,27 @@ class Shipment(TransitStatusMixin):
             self.date_shipped = None
             self.status = self.STATES.ON_SITE
             self.save()
-            for obj in self.containers.all():
-                obj.unreturn()
+            self.containers.all().transition(Container.STATES.ON_SITE)
 
     def unreceive(self, request=None):
         if self.status == self.STATES.ON_SITE:
             self.date_received = None
             self.status = self.STATES.SENT
             self.save()
-            for obj in self.containers.all():
-                obj.unreceive()
+            self.containers.all().transition(Container.STATES.SENT)
 
     def returned(self, request=None):
         if self.is_returnable():
             self.date_returned = timezone.now()
             self.save()
-            self.containers.all().update(parent=None, location="")
+            self.containers.all().update(parent=None, location=None)
+            self.containers.all().update_ports()
             LoadHistory.objects.filter(child__in=self.containers.all()).active().update(end=timezone.now())
-            for obj in self.containers.all():
-                obj.returned(request=request)
+            self.containers.all().transition(Container.STATES.RETURNED, request=request)
             super(Shipment, self).returned(request=request)
 
     def archive(self, request=None):
-        for obj in self.containers.all():
-            obj.archive(request=request)
+        self.containers.filter(status=Container.STATES.RETURNED).transition(Container.STATES.ARCHIVED, request=request)
         super(Shipment, self).archive(request=request)
 
 
@@ -759,14 +947,49 @@ class ContainerLocation(models.Model):
         return self.name
 
 
-class ContainerQuerySet(models.QuerySet):
-    def with_port(self):
-        return self.annotate(port_name=Concat(*CONTAINER_PORT_FIELDS))
+def port_expression(fields):
+    """
+    Expression concatenating the location names along a chain of containers
+    :param fields: location name lookups, outermost first
+    """
+    parts = [Coalesce(field, Value('')) for field in fields]
+    return Concat(*parts, output_field=CharField()) if len(parts) > 1 else parts[0]
+
+
+def refresh_port_names(queryset, fields):
+    """
+    Recompute stored port names for all objects in the queryset, saving only those which have changed
+    :param queryset: Container or Sample queryset
+    :param fields: location name lookups from which the port name is composed
+    :return: number of objects updated
+    """
+    model = queryset.model
+    entries = queryset.order_by().annotate(port=port_expression(fields)).values_list('pk', 'port_name', 'port')
+    changed = [model(pk=pk, port_name=port) for pk, current, port in entries if port != current]
+    model.objects.bulk_update(changed, ['port_name'], batch_size=PORT_BATCH_SIZE)
+    return len(changed)
+
+
+class ContainerQuerySet(ProjectObjectQuerySet):
+    def update_ports(self):
+        """
+        Recompute stored port names of the containers, any containers nested within them and all their samples.
+        Should be called after containers are loaded, unloaded or returned through queryset updates.
+        """
+        pks = set(self.values_list('pk', flat=True))
+        level = pks
+        for i in range(MAX_CONTAINER_DEPTH - 1):
+            level = set(Container.objects.filter(parent__in=level).values_list('pk', flat=True)) - pks
+            if not level:
+                break
+            pks |= level
+        refresh_port_names(Container.objects.filter(pk__in=pks), CONTAINER_PORT_FIELDS)
+        refresh_port_names(Sample.objects.filter(container__in=pks), SAMPLE_PORT_FIELDS)
 
 
 class ContainerManager(models.Manager.from_queryset(ContainerQuerySet)):
     def get_queryset(self):
-        return super().get_queryset().select_related('kind', 'project', 'location').with_port()
+        return super().get_queryset().select_related('kind', 'project', 'location')
 
 
 class Container(TransitStatusMixin):
@@ -782,6 +1005,7 @@ class Container(TransitStatusMixin):
     parent = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True, related_name="children")
     location = models.ForeignKey(ContainerLocation, blank=True, null=True, on_delete=models.SET_NULL,
                                  related_name='contents')
+    port_name = models.CharField(max_length=PORT_NAME_LENGTH, blank=True, default='', editable=False, db_index=True)
     objects = ContainerManager()
 
     class Meta:
@@ -846,11 +1070,30 @@ class Container(TransitStatusMixin):
         return self.beamlines.filter(active=True).first() or self.parent and self.parent.automounter() or None
 
     def port(self):
-        if hasattr(self, 'port_name'):  # fetch from default annotation
-            return self.port_name
-        elif self.parent and self.location:
-            return "{}{}".format(self.parent.port(), self.location.name)
-        return ""
+        return self.port_name
+
+    def get_port_name(self):
+        """
+        Compose the port name from the locations of the container and its parents, up to MAX_CONTAINER_DEPTH
+        """
+        names = []
+        container = self
+        for i in range(MAX_CONTAINER_DEPTH):
+            if container is None:
+                break
+            names.insert(0, container.location.name if container.location_id else '')
+            container = container.parent if container.parent_id else None
+        return ''.join(names)
+
+    def save(self, *args, **kwargs):
+        port_name = self.get_port_name()
+        changed = self.pk and port_name != self.port_name
+        self.port_name = port_name
+        if changed and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'port_name'}
+        super().save(*args, **kwargs)
+        if changed:
+            Container.objects.filter(pk=self.pk).update_ports()
 
     def get_project(self):
         if self.children.count():
@@ -1156,9 +1399,9 @@ class Group(ProjectObjectMixin):
                self.status != self.STATES.ARCHIVED
 
     def archive(self, request=None):
-        for obj in self.samples.exclude(status__exact=Sample.STATES.ARCHIVED):
-            obj.archive(request=request)
-        super(Group, self).archive(request=request)
+        if self.status != self.STATES.ARCHIVED:
+            Group.objects.filter(pk=self.pk).transition(self.STATES.ARCHIVED, request=request)
+            self.status = self.STATES.ARCHIVED
 
 
 def get_sample_path(instance, filename):
@@ -1166,13 +1409,16 @@ def get_sample_path(instance, filename):
 
 
 class SampleQuerySet(models.QuerySet):
-    def with_port(self):
-        return self.annotate(port_name=Concat(*SAMPLE_PORT_FIELDS))
+    def update_ports(self):
+        """
+        Recompute stored port names of the samples
+        """
+        refresh_port_names(self, SAMPLE_PORT_FIELDS)
 
 
 class SampleManager(models.Manager.from_queryset(SampleQuerySet)):
     def get_queryset(self):
-        return super().get_queryset().select_related('group', 'location', 'container', 'project').with_port()
+        return super().get_queryset().select_related('group', 'location', 'container', 'project')
 
 
 class Sample(ProjectObjectMixin):
@@ -1189,6 +1435,7 @@ class Sample(ProjectObjectMixin):
     priority = models.IntegerField(null=True, blank=True)
     group = models.ForeignKey(Group, null=True, blank=True, on_delete=models.SET_NULL, related_name='samples')
     image = models.ImageField(blank=True, upload_to=get_sample_path)
+    port_name = models.CharField(max_length=PORT_NAME_LENGTH, blank=True, default='', editable=False, db_index=True)
 
     objects = SampleManager()
 
@@ -1214,11 +1461,19 @@ class Sample(ProjectObjectMixin):
         return list(self.requests.all()) + list(self.group.requests.all())
 
     def port(self):
-        if hasattr(self, 'port_name'):  # fetch from default annotation
-            return self.port_name
-        elif self.container and self.location:
-            return "{}{}".format(self.container.port(), self.location.name)
-        return ""
+        return self.port_name
+
+    def get_port_name(self):
+        return "{}{}".format(
+            self.container.port_name if self.container_id else '',
+            self.location.name if self.location_id else ''
+        )
+
+    def save(self, *args, **kwargs):
+        self.port_name = self.get_port_name()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'port_name'}
+        super().save(*args, **kwargs)
 
     def is_editable(self):
         return self.container.status == self.container.STATES.DRAFT
@@ -1265,6 +1520,17 @@ class DataTypeManager(models.Manager):
     def get_by_natural_key(self, acronym):
         return self.get(acronym=acronym)
 
+    def metadata_keys(self):
+        """
+        All meta_data keys declared by data types. The set is cached and expired whenever a data type changes.
+        :return: set of key names
+        """
+        keys = cache.get(METADATA_KEYS_KEY)
+        if keys is None:
+            keys = {key for metadata in self.values_list('metadata', flat=True) for key in metadata or []}
+            cache.set(METADATA_KEYS_KEY, keys, METADATA_KEYS_TIMEOUT)
+        return keys
+
 
 class DataType(models.Model):
     name = models.CharField(max_length=20)
@@ -1282,7 +1548,66 @@ class DataType(models.Model):
         return self.name
 
 
-class DataManager(models.Manager):
+def metadata_expression(key):
+    """
+    Database expression for the value of a key in Data.meta_data, cast to the type configured for the key in
+    LIMS_METADATA_TYPES. Keys without a configured type are compared as text. On PostgreSQL, values of typed keys
+    which are not numbers are NULL.
+    :param key: meta_data key
+    """
+    value = KeyTextTransform(key, 'meta_data')
+    field = METADATA_FIELDS.get(METADATA_TYPES.get(key))
+    return value if field is None else NumericCast(value, field())
+
+
+def total_angle_expression():
+    """
+    Database expression equivalent to Data.total_angle()
+    """
+    return ExpressionWrapper(
+        Coalesce(metadata_expression('delta_angle'), Value(0.0)) * F('num_frames'), output_field=FloatField()
+    )
+
+
+class DataQuerySet(ProjectObjectQuerySet):
+    def check_metadata(self, keys):
+        undeclared = set(keys) - DataType.objects.metadata_keys()
+        if undeclared:
+            raise ValueError("Undeclared meta_data keys: {}".format(', '.join(sorted(undeclared))))
+
+    def with_metadata(self, *keys):
+        """
+        Annotate each dataset with typed values of the given meta_data keys, named 'meta_<key>'
+        :param keys: meta_data keys declared by data types
+        """
+        self.check_metadata(keys)
+        return self.annotate(**{'meta_{}'.format(key): metadata_expression(key) for key in keys})
+
+    def filter_metadata(self, **lookups):
+        """
+        Filter datasets on typed meta_data values, e.g. filter_metadata(delta_angle__gte=0.5, detector='PILATUS').
+        On PostgreSQL, the expression indexes built by the index_metadata command serve these lookups.
+        :param lookups: <key>[__<lookup>] = value, where key is a meta_data key declared by data types
+        """
+        queryset = self.with_metadata(*{lookup.split('__')[0] for lookup in lookups})
+        return queryset.filter(**{'meta_{}'.format(lookup): value for lookup, value in lookups.items()})
+
+    def aggregate_metadata(self, **aggregates):
+        """
+        Aggregate typed meta_data values, e.g. aggregate_metadata(resolution=Min, delta_angle=Avg)
+        :param aggregates: key = aggregate class, where key is a meta_data key declared by data types
+        :return: dictionary mapping keys to aggregate values
+        """
+        self.check_metadata(aggregates)
+        return self.aggregate(**{
+            key: aggregate(metadata_expression(key)) for key, aggregate in aggregates.items()
+        })
+
+    def with_total_angle(self):
+        return self.annotate(total_oscillation=total_angle_expression())
+
+
+class DataManager(models.Manager.from_queryset(DataQuerySet)):
     def get_queryset(self):
         return super().get_queryset().select_related('kind', 'project')
 
@@ -1349,18 +1674,18 @@ class Data(ActiveStatusMixin):
         return self.reports.first()
 
     def total_angle(self):
+        if hasattr(self, 'total_oscillation'):
+            return self.total_oscillation
         return float(self.meta_data.get('delta_angle', 0)) * self.num_frames
 
     def archive(self, request=None):
-        for obj in self.reports.all():
-            if obj.status not in [GLOBAL_STATES.ARCHIVED, GLOBAL_STATES.TRASHED]:
-                obj.archive(request=request)
+        self.reports.exclude(status__in=[GLOBAL_STATES.ARCHIVED, GLOBAL_STATES.TRASHED]).transition(
+            GLOBAL_STATES.ARCHIVED, request=request
+        )
         super(Data, self).archive(request=request)
 
     def trash(self, request=None):
-        for obj in self.reports.all():
-            if obj.status not in [GLOBAL_STATES.TRASHED]:
-                obj.trash(request=request)
+        self.reports.exclude(status=GLOBAL_STATES.TRASHED).transition(GLOBAL_STATES.TRASHED, request=request)
         super(Data, self).trash(request=request)
 
 
@@ -1371,11 +1696,15 @@ class AnalysisReport(ActiveStatusMixin):
     data = models.ManyToManyField(Data, blank=True, related_name="reports")
     url = models.CharField(max_length=200)
     details = models.JSONField(default=list)
+    client_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     objects = ProjectObjectManager()
 
     class Meta:
         ordering = ['created', '-score']
+        unique_together = (
+            ("project", "client_key"),
+        )
 
     def download_url(self):
         dataset = self.data.first()
@@ -1407,6 +1736,20 @@ class AnalysisReport(ActiveStatusMixin):
 
 class ActivityLogManager(models.Manager):
     def log_activity(self, request, obj, action_type, description=''):
+        e = self.make_entry(request, obj, action_type, description)
+        e.save()
+
+    def log_activities(self, request, objects, action_type, description=''):
+        """
+        Create ActivityLog entries for several objects with a single query
+        :param request: request
+        :param objects: list of affected objects
+        :param action_type: ActivityLog.TYPE
+        :param description: description applied to all entries
+        """
+        self.bulk_create([self.make_entry(request, obj, action_type, description) for obj in objects])
+
+    def make_entry(self, request, obj, action_type, description=''):
         e = self.model()
         if obj is None:
             try:
@@ -1438,7 +1781,7 @@ class ActivityLogManager(models.Manager):
             e.object_repr = '%s: %s' % (obj.__class__.__name__.upper(), obj)
         else:
             e.object_repr = 'N/A'
-        e.save()
+        return e
 
     def last_login(self, request):
         logs = self.filter(user__exact=request.user, action_type__exact=ActivityLog.TYPE.LOGIN)
@@ -1529,3 +1872,27 @@ class Guide(TimeStampedModel):
 
     class Meta:
         ordering = ("-staff_only", "priority",)
+
+
+@receiver(post_save, sender=Stretch)
+@receiver(post_delete, sender=Stretch)
+@receiver(post_save, sender=Data)
+@receiver(post_delete, sender=Data)
+def on_session_change(sender, instance, **kwargs):
+    expire_session_summaries(instance.session_id)
+
+
+@receiver(post_save, sender=DataType)
+@receiver(post_delete, sender=DataType)
+def on_datatype_change(sender, instance, **kwargs):
+    cache.delete(METADATA_KEYS_KEY)
+
+
+@receiver(m2m_changed, sender=AnalysisReport.data.through)
+def on_report_data_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'pre_clear'):
+        if reverse:
+            expire_session_summaries(instance.session_id)
+        else:
+            datasets = Data.objects.filter(pk__in=pk_set) if pk_set else instance.data.all()
+            expire_session_summaries(*datasets.values_list('session', flat=True))
@@ -1,11 +1,14 @@
 import calendar
+import hashlib
+import itertools
 from collections import defaultdict
 from datetime import datetime, timedelta
 from math import ceil
 
 import numpy
 from django.conf import settings
-from django.db.models import Count, Sum, F, Avg, FloatField, Case, When, IntegerField, Q, DateTimeField, ExpressionWrapper
+from django.core.cache import cache
+from django.db.models import Count, Sum, F, Avg, Min, FloatField, Case, When, IntegerField, Q, DateTimeField, ExpressionWrapper
 from django.db.models.functions import Coalesce
 from django.template.defaultfilters import linebreaksbr
 from django.utils import timezone
@@ -13,6 +16,7 @@ from django.utils.timesince import timesince
 from memoize import memoize
 
 from basiclive.core.lims.models import Data, Sample, Session, Project, AnalysisReport, Container, Shipment, ProjectType, DataType
+from basiclive.core.lims.models import SESSION_GAP, total_angle_expression
 from basiclive.utils.functions import ShiftEnd, ShiftStart, ShiftIndex
 from basiclive.utils.misc import humanize_duration, natural_duration
 
@@ -20,6 +24,7 @@ HOUR_SECONDS = 3600
 SHIFT = getattr(settings, "HOURS_PER_SHIFT", 8)
 SHIFT_SECONDS = SHIFT * HOUR_SECONDS
 MAX_COLUMN_USERS = 30
+TIMELINE_RESOLUTION = timedelta(seconds=getattr(settings, 'LIMS_TIMELINE_RESOLUTION', 60))
 
 
 class ColorScheme(object):
@@ -35,6 +40,42 @@ def js_epoch(dt):
     return int("{:0.0f}000".format(dt.timestamp() if dt else datetime.now().timestamp()))
 
 
+def timeline_spans(datasets, resolution=TIMELINE_RESOLUTION):
+    """
+    Timeline entries for datasets, merging consecutive datasets of the same type into a single span when the
+    interval between them is shorter than the resolution. Datasets are streamed, so memory use and the number of
+    entries depend on the number of spans rather than the number of datasets.
+    :param datasets: Data queryset
+    :param resolution: maximum interval between merged datasets
+    :return: list of timeline entries
+    """
+    spans = []
+    span = None
+    rows = datasets.filter(start_time__isnull=False, end_time__isnull=False).order_by('start_time').values_list(
+        'start_time', 'end_time', 'kind__name', 'name'
+    )
+    for start, end, kind, name in rows.iterator():
+        if span and span['type'] == kind and start - span['end'] <= resolution:
+            span['end'] = max(span['end'], end)
+            span['last'] = name
+            span['count'] += 1
+        else:
+            span = {'type': kind, 'start': start, 'end': end, 'first': name, 'last': name, 'count': 1}
+            spans.append(span)
+
+    return [
+        {
+            "type": span['type'],
+            "start": js_epoch(span['start']),
+            "end": js_epoch(span['end']),
+            "label": "{}: {}".format(span['type'], span['first']) if span['count'] == 1 else "{}: {} - {} ({})".format(
+                span['type'], span['first'], span['last'], span['count']
+            )
+        }
+        for span in spans
+    ]
+
+
 @memoize(timeout=HOUR_SECONDS)
 def get_data_periods(period='year'):
     field = 'created__{}'.format(period)
@@ -529,14 +570,29 @@ PARAMETER_NAMES.update({
 PARAMETER_RANGES = {
     'exposure_time': (0.01, 20),
     'score': (0.01, 1),
-    'energy': (4., 18.)
+    'energy': (4., 18.),
+    'attenuation': (0., 100.),
+    'num_frames': (1, 3601),
 }
 
 PARAMETER_BINNING = {
     'energy': 8,
-    'attenuation': numpy.linspace(0, 100, 11)
+    'attenuation': 10,
 }
 
+# values above the range of these parameters are counted in the last bin
+PARAMETER_OVERFLOW = ('num_frames',)
+
+# Fixed bin edges so that histograms of different periods can be added together
+PARAMETER_EDGES = {
+    param: numpy.linspace(lo, hi, PARAMETER_BINNING.get(param, 20) + 1)
+    for param, (lo, hi) in PARAMETER_RANGES.items()
+}
+
+DATA_PARAMETERS = ('exposure_time', 'attenuation', 'energy', 'num_frames')
+PARAMETER_CHUNK_SIZE = 50000
+PARAMETER_CACHE_TIMEOUT = 30 * 24 * HOUR_SECONDS
+
 
 def get_histogram_points(data, range=None, bins='doane'):
     counts, edges = numpy.histogram(data, bins=bins, range=range)
@@ -544,25 +600,107 @@ def get_histogram_points(data, range=None, bins='doane'):
     return list(zip(centers, counts))
 
 
-def make_parameter_histogram(data_info, report_info):
+def parameter_rows(datasets, chunk_size=PARAMETER_CHUNK_SIZE):
+    """
+    Fetch dataset parameters and report scores for a Data queryset as structured arrays, one chunk at a time.
+    Each row holds one dataset-report pair, so datasets with several reports are repeated.
+    :param datasets: Data queryset
+    :param chunk_size: maximum number of rows per chunk
+    :return: generator of structured numpy arrays with fields 'dataset', 'report', 'score' and one for each parameter
+    """
+    names = ('dataset',) + DATA_PARAMETERS + ('report', 'score')
+    rows = datasets.order_by('pk').values_list(
+        'pk', *DATA_PARAMETERS, 'reports__pk', 'reports__score'
+    ).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        columns = numpy.array(chunk, dtype=object).astype(float).T
+        yield numpy.rec.fromarrays(columns, names=names)
+
+
+def parameter_counts(datasets, chunk_size=PARAMETER_CHUNK_SIZE, scores=True):
+    """
+    Count dataset parameters and report scores into the fixed PARAMETER_EDGES bins in a single pass
+    :param datasets: Data queryset
+    :param chunk_size: maximum number of rows fetched at a time
+    :param scores: whether to count report scores
+    :return: dictionary mapping parameter names to arrays of counts
     """
-    Create a histogram for parameters in the query results
-    :param data_info: Query result for data
-    :param report_info: Query result for reports
+    counts = {param: numpy.zeros(len(edges) - 1, dtype=int) for param, edges in PARAMETER_EDGES.items()}
+    last_data = numpy.nan
+    seen_reports = set()
+    for chunk in parameter_rows(datasets, chunk_size=chunk_size):
+        # rows are ordered by dataset, so repeated datasets are adjacent
+        dataset_ids = chunk['dataset']
+        first = numpy.ones(len(chunk), dtype=bool)
+        first[1:] = dataset_ids[1:] != dataset_ids[:-1]
+        first[0] = dataset_ids[0] != last_data
+        last_data = dataset_ids[-1]
+        for param in DATA_PARAMETERS:
+            values = chunk[param][first]
+            if param in PARAMETER_OVERFLOW:
+                values = numpy.minimum(values, PARAMETER_EDGES[param][-1])
+            counts[param] += numpy.histogram(values[~numpy.isnan(values)], bins=PARAMETER_EDGES[param])[0]
+
+        if not scores:
+            continue
+        reports = ~numpy.isnan(chunk['report']) & (chunk['score'] > -0.1)
+        report_ids, index = numpy.unique(chunk['report'][reports], return_index=True)
+        new_reports = numpy.array([pk not in seen_reports for pk in report_ids], dtype=bool)
+        seen_reports.update(report_ids.tolist())
+        scores = chunk['score'][reports][index[new_reports]]
+        counts['score'] += numpy.histogram(scores, bins=PARAMETER_EDGES['score'])[0]
+    return counts
+
+
+def yearly_report_scores(year, **filters):
+    """
+    Scores of analysis reports whose earliest matching dataset was created in a given year, so that reports linked
+    to datasets from several years are counted once when yearly counts are merged
+    :param year: year
+    :param filters: additional Data filters
+    :return: list of scores
+    """
+    start = timezone.make_aware(datetime(year, 1, 1))
+    end = timezone.make_aware(datetime(year + 1, 1, 1))
+    reports = AnalysisReport.objects.filter(
+        score__gt=-0.1, **{'data__{}'.format(field): value for field, value in filters.items()}
+    ).annotate(first_created=Min('data__created'))
+    return list(reports.filter(first_created__gte=start, first_created__lt=end).values_list('score', flat=True))
+
+
+def yearly_parameter_counts(year, **filters):
+    """
+    Parameter histogram counts for datasets created in a given year, cached since
+    data parameters do not change after collection
+    :param year: year
+    :param filters: additional Data filters
+    :return: dictionary mapping parameter names to arrays of counts
+    """
+    key = 'lims:parameter-counts:v2:{}'.format(
+        hashlib.md5(repr((year, sorted(filters.items()))).encode('utf-8')).hexdigest()
+    )
+    counts = cache.get(key)
+    if counts is None:
+        counts = parameter_counts(Data.objects.filter(created__year=year, **filters), scores=False)
+        counts['score'] += numpy.histogram(yearly_report_scores(year, **filters), bins=PARAMETER_EDGES['score'])[0]
+        timeout = HOUR_SECONDS if year >= timezone.localtime().year else PARAMETER_CACHE_TIMEOUT
+        cache.set(key, counts, timeout)
+    return counts
+
+
+def make_parameter_histogram(counts):
+    """
+    Create histogram points from binned parameter counts
+    :param counts: dictionary mapping parameter names to arrays of counts
     :return: histogram data
     """
-    histograms = {
-        field_name: get_histogram_points(
-            [float(d[field_name]) for d in data_info if d[field_name] is not None],
-            range=PARAMETER_RANGES.get(field_name), bins=PARAMETER_BINNING.get(field_name, 'doane')
-        )
-        for field_name in ('exposure_time', 'attenuation', 'energy', 'num_frames')
+    return {
+        param: list(zip(((edges[:-1] + edges[1:]) * 0.5).tolist(), counts[param].tolist()))
+        for param, edges in PARAMETER_EDGES.items()
     }
-    histograms['score'] = get_histogram_points(
-        [float(d['score']) for d in report_info if d['score'] > -0.1],
-        range=PARAMETER_RANGES.get('score')
-    )
-    return histograms
 
 
 def parameter_summary(**filters):
@@ -570,12 +708,16 @@ def parameter_summary(**filters):
         'beam_size').order_by('beam_size').annotate(
         count=Count('id')
     )
-    report_filters = {f.replace('beamline', 'data__beamline'): val for f, val in filters.items()}
 
-    report_info = AnalysisReport.objects.filter(**report_filters).values('score')
-    data_info = Data.objects.filter(**filters).values('exposure_time', 'attenuation', 'energy',
-                                                                         'num_frames')
-    param_histograms = make_parameter_histogram(data_info, report_info)
+    # merge per-year histograms
+    year = filters.get('created__year')
+    years = [int(year)] if year else get_data_periods('year')
+    data_filters = {f: val for f, val in filters.items() if f != 'created__year'}
+    param_counts = {param: numpy.zeros(len(edges) - 1, dtype=int) for param, edges in PARAMETER_EDGES.items()}
+    for yr in years:
+        for param, counts in yearly_parameter_counts(yr, **data_filters).items():
+            param_counts[param] += counts
+    param_histograms = make_parameter_histogram(param_counts)
 
     stats = {'details': [
         {
@@ -613,35 +755,28 @@ def parameter_summary(**filters):
 def session_stats(session):
     data_extras = session.datasets.values(key=F('kind__name')).order_by('key').annotate(
         count=Count('id'), time=Sum(F('exposure_time') * F('num_frames'), output_field=FloatField()),
-        frames=Sum('num_frames'),
+        frames=Sum('num_frames'), angle=Sum(total_angle_expression()),
     )
 
     data_stats = [
         ['Avg Frames/{}'.format(info['key']), round(info['frames'] / info['count'], 1)]
         for info in data_extras
+    ] + [
+        ['Total Angle/{}'.format(info['key']), '{:0.1f}°'.format(info['angle'])]
+        for info in data_extras if info['angle']
     ]
     data_counts = [
         [info['key'], round(info['count'], 1)]
         for info in data_extras
     ]
 
-    data_info = session.datasets.values('exposure_time', 'attenuation', 'energy', 'num_frames')
-    report_info = AnalysisReport.objects.filter(data__session=session).values('score')
-    param_histograms = make_parameter_histogram(data_info, report_info)
+    param_histograms = make_parameter_histogram(parameter_counts(session.datasets.all()))
 
     shutters = sum([info['time'] for info in data_extras]) / HOUR_SECONDS
     total_time = session.total_time()
     last_data = session.datasets.last()
 
-    timeline_data = [
-        {
-            "type": data['kind__name'],
-            "start": js_epoch(data['start_time']),
-            "end": js_epoch(data['end_time']),
-            "label": "{}: {}".format(data["kind__name"], data['name'])
-        }
-        for data in session.datasets.values('start_time', 'end_time', 'kind__name', 'name')
-    ]
+    timeline_data = timeline_spans(session.datasets.all())
     stats = {'details': [
         {
             'title': 'Session Parameters',
@@ -728,7 +863,9 @@ def session_stats(session):
                                 for i, gap in enumerate(session.gaps())
                             ],
                     'header': 'row',
-                    'notes': "Periods of possible inactivity while the session was open, greater than 10 minutes",
+                    'notes': "Periods of possible inactivity while the session was open, greater than {}".format(
+                        natural_duration(SESSION_GAP)
+                    ),
                     'style': 'col-12',
                 },
 
@@ -1,3 +1,42 @@
 from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from basiclive.utils import search
+from .models import Project, Shipment
+
+
+class SearchTests(TestCase):
+    fields = ['project__username', 'project__name', 'name', 'comments', 'status', 'id', 'created']
+
+    def setUp(self):
+        alpha = Project.objects.create(username='alpha', name='Alpha Lab')
+        beta = Project.objects.create(username='beta', name='Beta Lab')
+        self.dewar = Shipment.objects.create(project=alpha, name='dewar', comments='fragile')
+        self.crate = Shipment.objects.create(project=beta, name='crate', comments='')
+
+    def search(self, term):
+        queryset, distinct = search.search_queryset(Shipment.objects.all(), self.fields, term)
+        self.assertFalse(distinct)
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_text_fields(self):
+        self.assertEqual(self.search('DEW'), ['dewar'])
+        self.assertEqual(self.search('fragile crate'), ['crate', 'dewar'])
+        self.assertEqual(self.search('nothing'), [])
+
+    def test_related_fields(self):
+        self.assertEqual(self.search('beta'), ['crate'])
+        self.assertEqual(self.search('lab'), ['crate', 'dewar'])
+
+    def test_other_fields(self):
+        # numbers and dates are matched exactly, choices by their labels
+        self.assertEqual(self.search(str(self.crate.pk)), ['crate'])
+        self.assertEqual(self.search('Draft'), ['crate', 'dewar'])
+        self.assertEqual(self.search(timezone.localdate(self.dewar.created).isoformat()), ['crate', 'dewar'])
+        self.assertEqual(self.search('1999-01-01'), [])
+
+    def test_lookups(self):
+        text, others = search.search_lookups(Shipment, self.fields, ['dewar'])
+        self.assertIsNotNone(text)
+        # one subquery for both project fields, numbers and dates do not match the word
+        self.assertEqual(len(others), 1)
@@ -1,6 +1,8 @@
 import json
+from collections import defaultdict
 from datetime import timedelta
 import requests
+from requests.adapters import HTTPAdapter
 
 from django import http
 from django.conf import settings
@@ -9,24 +11,35 @@ from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db import transaction
-from django.db.models import Count, Q, Case, When, Value, BooleanField, Max
+from django.db.models import Count, Q, Case, When, Value, BooleanField
 from django.forms.models import model_to_dict
 from django.http import JsonResponse, Http404, HttpResponseRedirect, HttpResponseNotAllowed
 from django.urls import reverse, reverse_lazy
 from django.utils import dateformat, timezone
 from django.views.generic import edit, detail, View
 from formtools.wizard.views import SessionWizardView
-from itemlist.views import ItemListView
+from itemlist.views import ItemListView, ORDER_VAR
 from proxy.views import proxy_view
 
 
-from basiclive.utils import filters
+from basiclive.utils import filters, search
+from basiclive.utils.filecache import FileCache
 from basiclive.utils.mixins import AsyncFormMixin, AdminRequiredMixin, HTML2PdfMixin, PlotViewMixin
+from basiclive.utils.pagination import CURSOR_VAR, EstimatedCountPaginator, KeysetPaginator
 from . import forms, models, stats
 
 DOWNLOAD_PROXY_URL = getattr(settings, 'DOWNLOAD_PROXY_URL', "http://basiclive.core-data/download")
+DOWNLOAD_CHUNK_SIZE = getattr(settings, 'DOWNLOAD_PROXY_CHUNK_SIZE', 1024 * 1024)
+DOWNLOAD_POOL_SIZE = getattr(settings, 'DOWNLOAD_PROXY_POOL_SIZE', 10)
+DOWNLOAD_TIMEOUT = getattr(settings, 'DOWNLOAD_PROXY_TIMEOUT', (5, 60))  # (connect, read) in seconds
+DOWNLOAD_OFFLOAD = getattr(settings, 'DOWNLOAD_PROXY_OFFLOAD', False)  # hand archive transfers over to nginx
+DOWNLOAD_OFFLOAD_PREFIX = getattr(settings, 'DOWNLOAD_PROXY_OFFLOAD_PREFIX', '/internal-download')
+DOWNLOAD_REQUEST_HEADERS = ('Range', 'If-Range')
+DOWNLOAD_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+PROXY_CACHE_SECTIONS = getattr(settings, 'PROXY_CACHE_SECTIONS', ('snapshot', 'frame'))
 LIMS_USE_SCHEDULE = getattr(settings, 'LIMS_USE_SCHEDULE', False)
 LIMS_USE_ACL = getattr(settings, 'LIMS_USE_ACL', False)
+LIST_COUNT_ESTIMATE_THRESHOLD = getattr(settings, 'LIST_COUNT_ESTIMATE_THRESHOLD', 10000)
 
 if LIMS_USE_SCHEDULE:
     from basiclive.core.schedule.models import AccessType, BeamlineSupport, Beamtime
@@ -95,12 +108,9 @@ class ProjectDetail(UserPassesTestMixin, detail.DetailView):
 
         sessions = project.sessions.filter(
             created__gt=one_year_ago
-        ).annotate(
-            data_count=Count('datasets', distinct=True),
-            report_count=Count('datasets__reports', distinct=True),
-            last_record=Max('datasets__end_time'),
-            end=Max('stretches__end')
-        ).order_by('-end', 'last_record', '-created').with_duration().prefetch_related('project', 'beamline')[:7]
+        ).with_summary().order_by(
+            '-open_stretches', '-last_end', '-last_record', '-created'
+        ).prefetch_related('project', 'beamline')[:7]
 
         context.update(shipments=shipments, sessions=sessions)
         return context
@@ -150,25 +160,30 @@ class StaffDashboard(AdminRequiredMixin, detail.DetailView):
 
         beamlines = models.Beamline.objects.all().order_by('name')
 
-        active_sessions = models.Session.objects.filter(stretches__end__isnull=True).annotate(
-            data_count=Count('datasets', distinct=True),
-            report_count=Count('datasets__reports', distinct=True)).with_duration()
+        active_sessions = models.Session.objects.filter(
+            pk__in=models.Stretch.objects.active().values('session')
+        ).with_summary().select_related('project', 'beamline')
 
         access_info = []
         connections = []
         sessions = []
         active_access = LIMS_USE_ACL and Access.objects.filter(status__iexact=Access.STATES.CONNECTED) or []
+        beamline_acls = defaultdict(list)
+        if LIMS_USE_ACL:
+            for acl, beamline in AccessList.beamline.through.objects.values_list('accesslist', 'beamline'):
+                beamline_acls[beamline].append(acl)
         if LIMS_USE_SCHEDULE:
             context.update(access_types=AccessType.objects.all(),
                            support=BeamlineSupport.objects.filter(date=timezone.localtime().date()).first())
             # Find out who is scheduled to use the beamline
-            for bt in Beamtime.objects.filter(start__lte=now, end__gte=now).with_duration():
+            current_beamtime = Beamtime.objects.filter(start__lte=now, end__gte=now).with_duration()
+            for bt in current_beamtime.select_related('project', 'beamline'):
                 bt_sessions = models.Session.objects.filter(project=bt.project, beamline=bt.beamline).filter(
                     Q(stretches__end__isnull=True) | Q(stretches__end__gte=bt.start)).distinct()
                 sessions += bt_sessions
                 # Check if the scheduled project is currently connected
                 bt_conns = LIMS_USE_ACL and active_access.filter(
-                    user=bt.project, userlist__pk__in=bt.beamline.access_lists.values_list('pk', flat=True)) or []
+                    user=bt.project, userlist__pk__in=beamline_acls[bt.beamline_id]) or []
                 connections += bt_conns
 
                 access_info.append({
@@ -182,7 +197,7 @@ class StaffDashboard(AdminRequiredMixin, detail.DetailView):
         # Check who has an active session
         for session in active_sessions.exclude(pk__in=[s.pk for s in sessions]):
             ss_conns = LIMS_USE_ACL and active_access.filter(
-                user=session.project, userlist__pk__in=session.beamline.access_lists.values_list('pk', flat=True)) or []
+                user=session.project, userlist__pk__in=beamline_acls[session.beamline_id]) or []
             connections += ss_conns
             access_info.append({
                 'user': session.project,
@@ -311,10 +326,20 @@ class ProjectLabels(AdminRequiredMixin, HTML2PdfMixin, detail.DetailView):
 
 
 class ListViewMixin(LoginRequiredMixin):
+    """
+    Common behaviour of list views.
+
+    :param keyset_pagination: page through the list with seek cursors instead of page numbers, for large tables
+    :param count_estimate_threshold: use query planner estimates instead of exact counts for lists expected to be
+        larger than this many rows. Set to None to always count exactly.
+    """
     paginate_by = 25
+    paginator_class = EstimatedCountPaginator
     template_name = "lims/list.html"
     link_data = False
     show_project = True
+    keyset_pagination = False
+    count_estimate_threshold = LIST_COUNT_ESTIMATE_THRESHOLD
 
     def get_list_columns(self):
         columns = super().get_list_columns()
@@ -328,6 +353,30 @@ class ListViewMixin(LoginRequiredMixin):
             selector = {'project': self.request.user}
         return super().get_queryset().filter(**selector)
 
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        kwargs.setdefault('estimate_threshold', self.count_estimate_threshold)
+        return super().get_paginator(queryset, per_page, orphans, allow_empty_first_page, **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_pagination or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(
+            queryset, page_size, queryset.query.order_by or self.get_ordering(),
+            estimate_threshold=self.count_estimate_threshold
+        )
+        page = paginator.page(self.request.GET.get(CURSOR_VAR))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_query_string(self, new_params=None, remove=None):
+        remove = list(remove or []) + [CURSOR_VAR]
+        return super().get_query_string(new_params=new_params, remove=remove)
+
+    def get_search_results(self, queryset, search_term):
+        fields = self.get_list_search()
+        if not search.supports(queryset.model, fields):
+            return super().get_search_results(queryset, search_term)
+        return search.search_queryset(queryset, fields, search_term, rank=ORDER_VAR not in self.request.GET)
+
     def page_title(self):
         return self.model._meta.verbose_name_plural.title()
 
@@ -392,13 +441,7 @@ class ShipmentLabels(HTML2PdfMixin, ShipmentDetail):
         return template
 
     def get_template_context(self):
-        object = self.get_object()
-        context = {
-            'project': object.project,
-            'shipment': object,
-            'admin_project': models.Project.objects.filter(is_superuser=True).first()
-        }
-        return context
+        return self.get_object().label_context()
 
 
 class ShipmentEdit(OwnerRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit.UpdateView):
@@ -727,6 +770,7 @@ class ContainerLoad(AdminRequiredMixin, ContainerEdit):
             models.LoadHistory.objects.filter(child=self.object).active().update(end=timezone.now())
 
         models.Container.objects.filter(pk=self.object.pk).update(parent=parent, location=location)
+        models.Container.objects.filter(pk=self.object.pk).update_ports()
         return JsonResponse(self.root.get_layout(), safe=False)
 
 
@@ -755,6 +799,7 @@ class LocationLoad(AdminRequiredMixin, ContainerEdit):
         models.Container.objects.filter(pk=data['child'].pk).update(
             parent=self.object, location=data['location']
         )
+        models.Container.objects.filter(pk=data['child'].pk).update_ports()
         models.LoadHistory.objects.create(child=data['child'], parent=self.object, location=data['location'])
         return JsonResponse(self.root.get_layout(), safe=False)
 
@@ -786,7 +831,9 @@ class EmptyContainers(AdminRequiredMixin, edit.UpdateView):
         data = form.cleaned_data
         containers = self.object.containers.filter(parent=data.get('parent'))
         models.LoadHistory.objects.filter(child__in=containers).active().update(end=timezone.now())
+        unloaded = models.Container.objects.filter(pk__in=list(containers.values_list('pk', flat=True)))
         containers.update(**{'location': None, 'parent': None})
+        unloaded.update_ports()
         return JsonResponse(self.root.get_layout(), safe=False)
 
 
@@ -876,9 +923,10 @@ class GroupDelete(OwnerRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit.
 
 class DataList(ListViewMixin, ItemListView):
     model = models.Data
+    keyset_pagination = True
     list_filters = ['modified', filters.YearFilterFactory('modified'), 'kind', 'beamline']
     list_columns = ['id', 'name', 'sample', 'frame_sets', 'session__name', 'energy', 'beamline', 'kind', 'modified']
-    list_search = ['id', 'name', 'beamline__name', 'sample__name', 'frames', 'project__name', 'modified']
+    list_search = ['id', 'name', 'beamline__name', 'sample__name', 'project__name', 'modified']
     link_url = 'data-detail'
     link_field = 'name'
     link_attr = 'data-link'
@@ -936,6 +984,7 @@ def format_score(val, record):
 
 class ReportList(ListViewMixin, ItemListView):
     model = models.AnalysisReport
+    keyset_pagination = True
     list_filters = ['modified', 'kind']
     list_columns = ['id', 'name', 'kind', 'score', 'modified']
     list_search = ['project__username', 'name', 'data__name']
@@ -1194,6 +1243,7 @@ class SessionReportList(ShipmentReportList):
 
 class ActivityLogList(ListViewMixin, ItemListView):
     model = models.ActivityLog
+    keyset_pagination = True
     list_filters = ['created', 'action_type']
     list_columns = ['created', 'action_type', 'user_description', 'ip_number', 'object_repr', 'description']
     list_search = ['description', 'ip_number', 'content_type__name', 'action_type']
@@ -1211,6 +1261,7 @@ def format_total_time(val, record):
 
 class SessionList(ListViewMixin, ItemListView):
     model = models.Session
+    keyset_pagination = True
     list_filters = [
         'beamline',
         filters.YearFilterFactory('created', reverse=True),
@@ -1229,6 +1280,9 @@ class SessionList(ListViewMixin, ItemListView):
     }
     link_url = 'session-detail'
 
+    def get_queryset(self):
+        return super().get_queryset().with_summary()
+
 
 class SessionDetail(OwnerRequiredMixin, detail.DetailView):
     model = models.Session
@@ -1327,6 +1381,7 @@ class ShipmentCreate(LoginRequiredMixin, SessionWizardView):
                             for location in container.kind.locations.all()
                         ]
                         models.Sample.objects.bulk_create(group_samples)
+                        container.samples.all().update_ports()
                 else:
                     for i, name in enumerate(form.cleaned_data['name_set']):
                         if name:
@@ -1468,6 +1523,7 @@ class ContainerSpreadsheet(LoginRequiredMixin, AsyncFormMixin, detail.DetailView
                     models.Sample.objects.filter(
                         project=container.project, location_id=sample['location'], container=container
                     ).delete()
+            container.samples.all().update_ports()
 
             return JsonResponse({'url': container.get_absolute_url()}, safe=False)
         except models.Container.DoesNotExist:
@@ -1563,27 +1619,84 @@ class GuideDelete(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit.
         return context
 
 
+# Shared upstream session, so that connections to the download proxy are pooled across requests
+download_session = requests.Session()
+download_session.mount('http://', HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE))
+download_session.mount('https://', HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE))
+
+# Snapshots and frame images are immutable once written, so repeated views are served from local disk
+proxy_cache = FileCache(session=download_session)
+
+
 class ProxyView(View):
     def get(self, request, *args, **kwargs):
         remote_url = DOWNLOAD_PROXY_URL + request.path
         if kwargs.get('section') == 'archive':
             return fetch_archive(request, remote_url)
+        if kwargs.get('section') in PROXY_CACHE_SECTIONS and proxy_cache.enabled:
+            return proxy_cache.serve(request, DOWNLOAD_PROXY_URL + request.get_full_path())
         return proxy_view(request, remote_url)
 
 
+def stream_archive(response):
+    try:
+        yield from response.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False)
+    finally:
+        response.close()
+
+
 def fetch_archive(request, url):
-    r = requests.get(url, stream=True)
-    if r.status_code == 200:
-        resp = http.StreamingHttpResponse(r, content_type='application/x-gzip')
-        resp['Content-Disposition'] = r.headers.get('Content-Disposition', 'attachment; filename=archive.tar.gz')
+    """
+    Stream an archive from the download proxy. Range requests are passed through so that interrupted downloads can
+    be resumed.
+
+    If DOWNLOAD_PROXY_OFFLOAD is set, the transfer is handed over to nginx with an X-Accel-Redirect to the url below
+    DOWNLOAD_PROXY_OFFLOAD_PREFIX. Archives live on the download proxy, so nginx needs an internal location there
+    which proxies to DOWNLOAD_PROXY_URL, e.g. for the default settings:
+
+        location /internal-download/ {
+            internal;
+            proxy_pass http://basiclive.core-data/download/;
+            proxy_buffering off;
+        }
+
+    :param request: client request
+    :param url: archive url on the download proxy
+    """
+    disposition = 'attachment; filename=archive.tar.gz'
+    if DOWNLOAD_OFFLOAD and url.startswith(DOWNLOAD_PROXY_URL + '/'):
+        resp = http.HttpResponse(content_type='application/x-gzip')
+        resp['X-Accel-Redirect'] = DOWNLOAD_OFFLOAD_PREFIX + url[len(DOWNLOAD_PROXY_URL):]
+        resp['Content-Disposition'] = disposition
+        return resp
+
+    headers = {name: request.headers[name] for name in DOWNLOAD_REQUEST_HEADERS if name in request.headers}
+    try:
+        r = download_session.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    except requests.RequestException:
+        return http.HttpResponse(status=502)
+
+    if r.status_code in (200, 206):
+        resp = http.StreamingHttpResponse(stream_archive(r), status=r.status_code, content_type='application/x-gzip')
+        for name in DOWNLOAD_RESPONSE_HEADERS:
+            if name in r.headers:
+                resp[name] = r.headers[name]
+        resp['Content-Disposition'] = r.headers.get('Content-Disposition', disposition)
+        return resp
+
+    r.close()
+    if r.status_code == 416:
+        resp = http.HttpResponse(status=416)
+        if 'Content-Range' in r.headers:
+            resp['Content-Range'] = r.headers['Content-Range']
         return resp
-    else:
-        return http.HttpResponseNotFound()
+    return http.HttpResponseNotFound()
 
 
-class ProjectList(AdminRequiredMixin, ItemListView):
+class ProjectList(AdminRequiredMixin, ListViewMixin, ItemListView):
     model = models.Project
     paginate_by = 25
+    show_project = False
     template_name = "lims/user-list.html"
     list_filters = ['created', 'modified', 'kind', 'designation']
     list_columns = ['username', 'contact_person', 'contact_phone', 'contact_email', 'kind']
@@ -1,9 +1,19 @@
 from django.core.management.base import BaseCommand
+from django.utils import dateparse
 
 from basiclive.core.publications.utils import fetch_and_update_depositions
 
 class Command(BaseCommand):
     help = 'Fetches PDB depositions from source defined in PDB_SEARCH_URL'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only fetch entries released or revised since the last sync')
+        parser.add_argument('--since', type=dateparse.parse_date,
+                            help='Only fetch entries released or revised on or after this date (YYYY-MM-DD)')
+
     def handle(self, *args, **options):
-        fetch_and_update_depositions()
+        report = fetch_and_update_depositions(incremental=options['incremental'], since=options['since'])
+        timings = report.pop('timings')
+        print("SYNCED DEPOSITIONS: {}".format(report))
+        print("TIMINGS: {}".format({k: round(v, 2) for k, v in timings.items()}))
@@ -0,0 +1,56 @@
+# Generated by Django 3.1.4 on 2021-02-15 10:12
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def name_tokens(text):
+    """
+    Copy of publications.models.name_tokens at the time of this migration
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return [
+        token for token in re.split(r'[\W_]+', text)
+        if len(token) > 1 and not token.isdigit()
+    ]
+
+
+def index_authors(apps, schema_editor):
+    """
+    Build the author index for existing publications
+    """
+    Publication = apps.get_model('publications', 'Publication')
+    AuthorToken = apps.get_model('publications', 'AuthorToken')
+    db_alias = schema_editor.connection.alias
+    to_create = [
+        AuthorToken(name=name, publication_id=pk)
+        for pk, authors in Publication.objects.using(db_alias).values_list('pk', 'authors')
+        for name in set(name_tokens(authors))
+    ]
+    AuthorToken.objects.using(db_alias).bulk_create(to_create)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publications', '0013_auto_20200128_1103'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('publication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='author_tokens', to='publications.publication')),
+            ],
+            options={
+                'unique_together': {('name', 'publication')},
+            },
+        ),
+        migrations.RunPython(index_authors, migrations.RunPython.noop),
+    ]
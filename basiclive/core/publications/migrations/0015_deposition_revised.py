@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2021-02-16 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publications', '0014_authortoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposition',
+            name='revised',
+            field=models.DateField(null=True),
+        ),
+    ]
@@ -1,10 +1,58 @@
-from django.db import models
+import re
+import unicodedata
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 from model_utils.models import TimeStampedModel
 from model_utils import Choices
 from basiclive.utils import fields
 from basiclive.utils import temporal
 
+METRICS_VERSION_KEY = 'publications:metrics-version'
+
+
+def name_tokens(text):
+    """
+    Split a free-text author list or person name into normalized name tokens. Accents are stripped, text is
+    lower-cased and initials are dropped, so "Müller, J.-P.; O'Brien, S." gives ['muller', 'brien'].
+    :param text: author list or name
+    :return: list of tokens in order of appearance
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return [
+        token for token in re.split(r'[\W_]+', text)
+        if len(token) > 1 and not token.isdigit()
+    ]
+
+
+def surname_token(last_name):
+    """
+    Return the index token used to look up publications for a person's last name, the final word of the name
+    :param last_name: last name
+    :return: token string or None
+    """
+    tokens = name_tokens(last_name)
+    return tokens[-1] if tokens else None
+
+
+def metrics_version():
+    """
+    Current version of publication metrics, used to key cached values derived from citations
+    """
+    return cache.get_or_set(METRICS_VERSION_KEY, lambda: timezone.now().timestamp(), None)
+
+
+def expire_metrics():
+    """
+    Invalidate all cached values derived from publication metrics
+    """
+    cache.set(METRICS_VERSION_KEY, timezone.now().timestamp(), None)
+
 
 class SubjectArea(TimeStampedModel):
     name = models.CharField(max_length=255, unique=True)
@@ -104,6 +152,42 @@ class Publication(TimeStampedModel):
         return f"{self.authors} ({self.published.year}) {self.title}. {self.journal and self.journal.short_name or ''}. {self.code}"
 
 
+class AuthorTokenManager(models.Manager):
+    def index(self, publications):
+        """
+        Rebuild the author index for the given publications
+        :param publications: queryset or list of publications
+        :return: number of tokens created
+        """
+        publications = [pub for pub in publications if pub.pk]
+        to_create = [
+            self.model(name=name, publication=pub)
+            for pub in publications
+            for name in set(name_tokens(pub.authors))
+        ]
+        with transaction.atomic():
+            self.filter(publication__in=publications).delete()
+            self.bulk_create(to_create)
+        return len(to_create)
+
+
+class AuthorToken(models.Model):
+    """
+    Normalized author name tokens for each publication, used for matching people to publications without
+    scanning the full author text of every publication.
+    """
+    name = models.CharField(max_length=100, db_index=True)
+    publication = models.ForeignKey(Publication, on_delete=models.CASCADE, related_name='author_tokens')
+
+    objects = AuthorTokenManager()
+
+    class Meta:
+        unique_together = (('name', 'publication'),)
+
+    def __str__(self):
+        return self.name
+
+
 class Metric(temporal.TemporalProfile):
     owner = models.ForeignKey(Publication, null=True, on_delete=models.CASCADE, related_name='all_metrics')
     citations = models.IntegerField(default=0)
@@ -123,9 +207,21 @@ class Deposition(TimeStampedModel):
     released = models.DateField()
     deposited = models.DateField()
     collected = models.DateField(null=True)
+    revised = models.DateField(null=True)
     tags = models.ManyToManyField(Tag, related_name='depositions', verbose_name='Tags')
     reference = models.ForeignKey(Publication, related_name='depositions', null=True, on_delete=models.SET_NULL)
     citation = models.CharField(max_length=255, null=True, blank=True)
 
     def __str__(self):
-        return self.code
\ No newline at end of file
+        return self.code
+
+
+@receiver(post_save, sender=Publication)
+def on_publication_save(sender, instance, **kwargs):
+    AuthorToken.objects.index([instance])
+    expire_metrics()
+
+
+@receiver(post_save, sender=Metric)
+def on_metric_save(sender, instance, **kwargs):
+    expire_metrics()
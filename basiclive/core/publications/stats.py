@@ -1,12 +1,17 @@
 import calendar
 from datetime import datetime
 
+import numpy
+from django.core.cache import cache
 from django.db.models import Count, Sum, F, Avg, FloatField, Q
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 
-from .models import Publication, Journal, SubjectArea, Deposition, Metric
+from .models import Publication, Journal, SubjectArea, Deposition, Metric, AuthorToken
+from .models import metrics_version, surname_token
+
+H_INDEX_CACHE_TIMEOUT = 86400
 
 
 class ColorScheme(object):
@@ -211,10 +216,52 @@ def publication_stats(period='year', year=None, tag=None):
     return stats
 
 
+def author_h_indices(tokens):
+    """
+    Calculate the h-index for each author token from the citations of the indexed publications, using a single
+    query and a grouped computation over all tokens.
+    :param tokens: collection of author tokens
+    :return: dictionary mapping each token to its h-index
+    """
+    rows = list(
+        AuthorToken.objects.filter(
+            name__in=tokens, publication__metrics__citations__isnull=False
+        ).values_list('name', 'publication__metrics__citations')
+    )
+    h_values = dict.fromkeys(tokens, 0)
+    if rows:
+        names, citations = zip(*rows)
+        labels, groups = numpy.unique(numpy.array(names), return_inverse=True)
+        citations = numpy.array(citations, dtype=int)
+
+        # sort by token, then by decreasing citations and rank the citations within each token
+        order = numpy.lexsort((-citations, groups))
+        groups, citations = groups[order], citations[order]
+        starts = numpy.searchsorted(groups, numpy.arange(len(labels)))
+        ranks = numpy.arange(len(groups)) - starts[groups] + 1
+        counts = numpy.bincount(groups, weights=(citations >= ranks), minlength=len(labels))
+        h_values.update(zip(labels.tolist(), counts.astype(int).tolist()))
+    return h_values
+
+
 def h_indices(users):
-    h_indices = {}
-    for user in users:
-        publications = Publication.objects.filter(metrics__citations__isnull=False, authors__icontains=user.last_name)
-        citations = publications.order_by('-metrics__citations').values_list('metrics__citations', flat=True)
-        h_indices[user.username] = len([c for i, c in enumerate(citations) if c >= (i + 1)])
-    return h_indices
+    """
+    Calculate h-indices for a list of users, matched to publications by last name. Results are cached until
+    publication metrics change.
+    :param users: iterable of users
+    :return: dictionary mapping usernames to h-index
+    """
+    user_tokens = {user.username: surname_token(user.last_name) for user in users}
+    version = metrics_version()
+    keys = {
+        token: 'publications:h-index:{}:{}'.format(version, token)
+        for token in set(user_tokens.values()) if token
+    }
+    cached = cache.get_many(keys.values())
+    h_values = {token: cached[key] for token, key in keys.items() if key in cached}
+    pending = set(keys.keys()) - set(h_values.keys())
+    if pending:
+        computed = author_h_indices(pending)
+        cache.set_many({keys[token]: value for token, value in computed.items()}, timeout=H_INDEX_CACHE_TIMEOUT)
+        h_values.update(computed)
+    return {username: h_values.get(token, 0) for username, token in user_tokens.items()}
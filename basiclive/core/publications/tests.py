@@ -1,3 +1,186 @@
+import json
+import re
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from . import models, utils
+
+
+def pdb_entry(code, beamline='08ID-1', released='2020-01-15', revised=None, citation=None, site='CLSI'):
+    """
+    A PDB report entry as returned by the RCSB GraphQL API
+    """
+    return {
+        'rcsb_id': code,
+        'struct': {'title': 'Structure of {}'.format(code)},
+        'rcsb_accession_info': {
+            'initial_release_date': '{}T12:00:00+0000'.format(released),
+            'revision_date': revised and '{}T12:00:00+0000'.format(revised),
+        },
+        'pdbx_vrpt_summary': {'PDB_deposition_date': '2019-11-01T12:00:00+0000', 'PDB_resolution': 1.8},
+        'diffrn_detector': [
+            {'pdbx_collection_date': '2019-06-01T12:00:00+0000'},
+            {'pdbx_collection_date': '2019-10-01T12:00:00+0000'},
+        ],
+        'diffrn_source': [
+            {'pdbx_synchrotron_beamline': 'X06SA', 'pdbx_synchrotron_site': 'SLS'},
+            {'pdbx_synchrotron_beamline': 'CMCF {}'.format(beamline), 'pdbx_synchrotron_site': site},
+        ],
+        'rcsb_primary_citation': {
+            'rcsb_authors': ['Smith, J.', 'Doe, A.'],
+            'pdbx_database_id_DOI': citation,
+            'year': 2020,
+        },
+    }
+
+
+class FakeRCSB(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the RCSB search and data (GraphQL) APIs
+    """
+    entries = {}
+    searches = []
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, content=None):
+        body = json.dumps(content).encode('utf-8') if content is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path == '/search':
+            self.searches.append(query)
+            since = re.findall(r'"greater_or_equal", "value": "([\d-]+)"', json.dumps(query))
+            codes = [
+                code for code, entry in sorted(self.entries.items())
+                if not since or max(filter(None, [
+                    entry['rcsb_accession_info']['initial_release_date'],
+                    entry['rcsb_accession_info']['revision_date']
+                ]))[:10] >= since[0]
+            ]
+            if codes:
+                self.reply(200, {'result_set': [{'identifier': code} for code in codes]})
+            else:
+                self.reply(204)
+        elif self.path == '/graphql':
+            codes = re.findall(r'"(\w+)"', query['query'])
+            self.reply(200, {'data': {'entries': [self.entries[code] for code in codes if code in self.entries]}})
+        else:
+            self.reply(404)
+
+
+class DepositionTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRCSB)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        base = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+        cls.patches = [
+            mock.patch.object(utils, 'PDB_SEARCH_URL', base + '/search'),
+            mock.patch.object(utils, 'PDB_REPORT_URL', base + '/graphql'),
+            mock.patch.object(utils, 'PDB_REPORT_BATCH_SIZE', 2),
+            mock.patch.object(utils, 'CROSSREF_THROTTLE', 0),
+            mock.patch.object(utils, 'create_publications', return_value={'publications': 0}),
+        ]
+        for patch in cls.patches:
+            patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeRCSB.entries = {
+            '1ABC': pdb_entry('1ABC', released='2020-01-15'),
+            '2DEF': pdb_entry('2DEF', released='2020-03-01', citation='10.1000/xyz'),
+            '3GHI': pdb_entry('3GHI', released='2020-05-20', beamline='08B1-1'),
+        }
+        FakeRCSB.searches = []
+
+    def test_parse_deposition(self):
+        record = utils.parse_deposition(pdb_entry('1ABC', citation='10.1000/xyz'))
+        info = record.dict()
+        self.assertEqual(info['code'], '1ABC')
+        self.assertEqual(info['doi'], '10.2210/pdb1ABC/pdb')
+        self.assertEqual(info['authors'], 'Smith, J., Doe, A.')
+        self.assertEqual(info['citation'], 'DOI:10.1000/xyz')
+        self.assertEqual(info['collected'].date(), date(2019, 10, 1))
+        self.assertIsNone(info['revised'])
+        self.assertEqual(record['tags'], ['08ID-1'])
+
+    def test_full_sync(self):
+        report = utils.fetch_and_update_depositions()
+        self.assertEqual(report['codes'], 3)
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(report['tag_links'], 3)
+        self.assertEqual(
+            set(models.Deposition.objects.values_list('code', flat=True)), {'1ABC', '2DEF', '3GHI'}
+        )
+        self.assertEqual(
+            list(models.Deposition.objects.get(code='3GHI').tags.values_list('name', flat=True)), ['08B1-1']
+        )
+
+        # a second sync with unchanged entries does not modify anything
+        report = utils.fetch_and_update_depositions()
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (0, 0, 3))
+        self.assertEqual((report['tag_links'], report['stale_tag_links']), (0, 0))
+
+    def test_incremental_sync(self):
+        utils.fetch_and_update_depositions()
+
+        # a revised entry and a new entry since the last sync
+        FakeRCSB.entries['1ABC'] = pdb_entry('1ABC', released='2020-01-15', revised='2020-06-01', beamline='08B1-1')
+        FakeRCSB.entries['4JKL'] = pdb_entry('4JKL', released='2020-06-10')
+        report = utils.fetch_and_update_depositions(incremental=True)
+
+        self.assertEqual(report['since'], date(2020, 5, 20))
+        self.assertIn('greater_or_equal', json.dumps(FakeRCSB.searches[-1]))
+        # the bound is inclusive, so the latest entry from the previous sync is fetched again
+        self.assertEqual(report['codes'], 3)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (1, 1, 1))
+
+        deposition = models.Deposition.objects.get(code='1ABC')
+        self.assertEqual(deposition.revised, date(2020, 6, 1))
+        self.assertEqual(list(deposition.tags.values_list('name', flat=True)), ['08B1-1'])
+        self.assertEqual(report['stale_tag_links'], 1)
+        self.assertEqual(models.Deposition.objects.count(), 4)
+
+    def test_since_without_matches(self):
+        report = utils.fetch_and_update_depositions(since=date(2021, 1, 1))
+        self.assertEqual((report['codes'], report['created']), (0, 0))
+        self.assertFalse(models.Deposition.objects.exists())
+
+    def test_link_references(self):
+        publication = models.Publication.objects.create(
+            code='DOI:10.1000/xyz', title='A paper', authors='Smith, J.', published=date(2020, 4, 1)
+        )
+        report = utils.fetch_and_update_depositions()
+        self.assertEqual(report['references'], 1)
+        self.assertEqual(models.Deposition.objects.get(code='2DEF').reference, publication)
+        self.assertEqual(models.Deposition.objects.filter(reference__isnull=True).count(), 2)
+
+        # a changed citation clears the reference until it is resolved again
+        FakeRCSB.entries['2DEF'] = pdb_entry('2DEF', released='2020-03-01', citation='10.1000/other')
+        report = utils.fetch_and_update_depositions()
+        self.assertEqual(report['references'], 0)
+        deposition = models.Deposition.objects.get(code='2DEF')
+        self.assertEqual(deposition.citation, 'DOI:10.1000/other')
+        self.assertIsNone(deposition.reference)
@@ -9,13 +9,15 @@ import re
 import itertools
 from functools import reduce
 import codecs
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from dateutil import parser
 from collections import defaultdict
 from django.conf import settings
 from django.utils import dateparse, timezone
 from django.db import transaction
-from django.db.models import Subquery, OuterRef
+from django.db.models import Subquery, OuterRef, Max
 
 from habanero import Crossref
 from .multidict import MultiKeyDict
@@ -27,6 +29,9 @@ CROSSREF_API_KEY =  getattr(settings, 'CROSSREF_API_KEY', None)
 CROSSREF_THROTTLE = getattr(settings, 'CROSSREF_THROTTLE', 1)  # time delay between crossref calls
 CROSSREF_BATCH_SIZE = getattr(settings, 'CROSSREF_THROTTLE', 10)
 GOOGLE_API_KEY = getattr(settings, 'GOOGLE_API_KEY', None)
+PDB_REPORT_BATCH_SIZE = getattr(settings, 'PDB_REPORT_BATCH_SIZE', 100)  # number of codes per report request
+PDB_REPORT_WORKERS = getattr(settings, 'PDB_REPORT_WORKERS', 4)  # maximum number of parallel report requests
+PDB_REPORT_TIMEOUT = getattr(settings, 'PDB_REPORT_TIMEOUT', 60)
 
 
 CROSSREF_EVENTS_URL = "https://api.eventdata.crossref.org/v1/events/distinct"
@@ -61,6 +66,7 @@ REPORT_QUERY = """{{
     }}
     rcsb_accession_info {{
       initial_release_date
+      revision_date
     }}
     pdbx_vrpt_summary {{
       PDB_deposition_date
@@ -186,7 +192,7 @@ class PDBParser(ObjectParser):
     """
     FIELDS = [
         'code', 'title', 'authors', 'doi', 'resolution',
-        'released', 'deposited', 'collected', 'citation'
+        'released', 'deposited', 'collected', 'revised', 'citation'
     ]
     KEY_MAPS = {
         'code': 'rcsb_id',
@@ -205,6 +211,10 @@ class PDBParser(ObjectParser):
     def get_deposited(self):
         return parser.isoparse(self._entry['pdbx_vrpt_summary.PDB_deposition_date'])
 
+    def get_revised(self):
+        if self._entry.get('rcsb_accession_info.revision_date'):
+            return parser.isoparse(self._entry['rcsb_accession_info.revision_date'])
+
     def get_collected(self):
         if self._entry.get('diffrn_detector.pdbx_collection_date'):
             return parser.isoparse(self._entry['diffrn_detector.pdbx_collection_date'])
@@ -431,14 +441,54 @@ class SCIMagoParser(ObjectParser):
         })
 
 
-def fetch_deposition_codes():
+def search_query(since=None):
+    """
+    Build the RCSB search query for the facility's PDB entries
+    :param since: if given, only match entries released or revised on or after this date
+    :return: dictionary
+    """
+    if not since:
+        return SEARCH_JSON
+
+    query = copy.deepcopy(SEARCH_JSON)
+    query['query'] = {
+        "type": "group",
+        "logical_operator": "and",
+        "nodes": [
+            SEARCH_JSON['query'],
+            {
+                "type": "group",
+                "logical_operator": "or",
+                "nodes": [
+                    {
+                        "type": "terminal",
+                        "service": "text",
+                        "parameters": {
+                            "operator": "greater_or_equal",
+                            "value": since.isoformat(),
+                            "attribute": attribute
+                        }
+                    }
+                    for attribute in ['rcsb_accession_info.initial_release_date', 'rcsb_accession_info.revision_date']
+                ]
+            }
+        ]
+    }
+    return query
+
+
+def fetch_deposition_codes(since=None):
     """
     Retrieve all PDB Codes for the facility as a list of strings
+    :param since: if given, only fetch codes for entries released or revised on or after this date
     """
-    response = requests.post(PDB_SEARCH_URL, json=SEARCH_JSON)
+    response = requests.post(PDB_SEARCH_URL, json=search_query(since))
 
     if response.status_code == 200:
         return [entry['identifier'] for entry in response.json()['result_set']]
+    elif response.status_code == 204:
+        # no matching entries
+        return []
     else:
         response.raise_for_status()
 
@@ -453,7 +503,7 @@ def fetch_depositions(codes):
     params = REPORT_QUERY
     params = params.format(', '.join(['"{}"'.format(pdb) for pdb in codes]))
 
-    response = requests.post(PDB_REPORT_URL, json={'query': params})
+    response = requests.post(PDB_REPORT_URL, json={'query': params}, timeout=PDB_REPORT_TIMEOUT)
 
     if response.status_code == 200:
         return response.json()['data']['entries']
@@ -461,67 +511,128 @@ def fetch_depositions(codes):
         response.raise_for_status()
 
 
+def fetch_deposition_batches(codes, batch_size=PDB_REPORT_BATCH_SIZE, workers=PDB_REPORT_WORKERS):
+    """
+    Fetch reports for PDB codes in batches, with at most `workers` requests in flight at any time
+    :param codes: list of strings representing pdbcodes
+    :param batch_size: number of codes per request
+    :param workers: maximum number of parallel requests
+    :return: a list of dictionaries one for each entry
+    """
+    batches = [list(chunk) for chunk in chunker(codes, batch_size)]
+    if not batches:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+        return list(itertools.chain.from_iterable(executor.map(fetch_depositions, batches)))
+
+
+def parse_deposition(entry):
+    """
+    Select the facility's source and detector details from a PDB report entry and parse it
+    :param entry: dictionary returned from the PDB report query
+    :return: PDBParser instance
+    """
+    i = 0
+    for i, src in enumerate(entry['diffrn_source']):
+        if src['pdbx_synchrotron_site'] == PDB_FACILITY_ACRONYM:
+            break
+    for k in ['diffrn_source', 'diffrn_detector']:
+        entry[k] = entry.get(k) and entry.get(k, [])[i] or None
+    return PDBParser(flatten(entry))
+
+
 def create_depositions(entries):
     """
-    Create database entries for PDB results
+    Create or update database entries for PDB results. Depositions, and their tags are upserted
+    with bulk operations.
     :param entries: list of dictionaries returned from PDB search reports
-    :return: a dictionary representing the numbers of entries created or updated
+    :return: a dictionary representing the numbers of entries created, updated or unchanged
     """
 
-    no_refs = {
-        obj.code: obj
-        for obj in models.Deposition.objects.filter(reference__isnull=True, citation__isnull=True)
-    }
-    old_entries = models.Deposition.objects.values_list('code', flat=True)
-    new_entries = {}
+    records = {}
+    entry_tags = defaultdict(set)  # a set of tag names for each pdb code
+    for entry in entries:
+        record = parse_deposition(entry)
+        info = record.dict()
+        entry_tags[info['code']].update(record['tags'])
+        records.setdefault(info['code'], info)   # entry will exist already for multi-beamline entries
+
+    # compare with existing entries, converting parsed values to database values
+    existing = models.Deposition.objects.in_bulk(records.keys(), field_name='code')
+    new_entries = []
     updated_entries = []
+    updated_fields = set()
+    for code, info in records.items():
+        values = {
+            field: models.Deposition._meta.get_field(field).to_python(value)
+            for field, value in info.items()
+        }
+        if code not in existing:
+            new_entries.append(models.Deposition(**values))
+            continue
 
-    entry_tags = defaultdict(list)  # a list of tag names for each pdb code
+        deposition = existing[code]
+        changes = {field: value for field, value in values.items() if getattr(deposition, field) != value}
+        if 'citation' in changes:
+            # the reference must be resolved again for a changed citation
+            changes['reference'] = None
+        if changes:
+            for field, value in changes.items():
+                setattr(deposition, field, value)
+            updated_entries.append(deposition)
+            updated_fields.update(changes.keys())
 
-    for entry in entries:
-        for i, src in enumerate(entry['diffrn_source']):
-            if src['pdbx_synchrotron_site'] == PDB_FACILITY_ACRONYM:
-                break
-        for k in ['diffrn_source', 'diffrn_detector']:
-            entry[k] = entry.get(k) and entry.get(k, [])[i] or None
-        entry = flatten(entry)
-        record = PDBParser(entry)
-        info = record.dict()
-        if info['code'] in old_entries:
-            # Update citation parameter if citation has changed
-            if info['code'] in no_refs and info['citation'] and not no_refs[info['code']].citation:
-                no_refs[info['code']].citation = info['citation']
-                updated_entries.append(no_refs[info['code']])
-        else:
-            # New entries
-            entry_tags[info['code']].extend(record['tags'])
-            if not info['code'] in new_entries:   # entry will exist already for multi-beamline entries
-                new_entries[info['code']] = models.Deposition(**info)
-
-    # update old entries if any changes have happened
-    if updated_entries:
-        models.Deposition.objects.bulk_update(updated_entries, fields=['citation'])
-
-    # create new entries if any
-    if new_entries:
-        models.Deposition.objects.bulk_create(new_entries.values())
-
-    # now update tags
-    name_tags = models.Tag.objects.in_bulk(field_name='name')    # maps tag names to tag
-    all_tags = set(itertools.chain.from_iterable(entry_tags.values()))
-    new_tags = all_tags - set(name_tags.keys())
-    create_tags = [models.Tag(name=name) for name in new_tags]
-    models.Tag.objects.bulk_create(create_tags)
-
-    # Add new entries to name_tags
-    name_tags.update(models.Tag.objects.in_bulk(new_tags, field_name='name'))
-
-    # finally, add tag relationships to newly created deposition_entries:
     with transaction.atomic():
-        for code, deposition in models.Deposition.objects.in_bulk(entry_tags.keys(), field_name='code').items():
-            deposition.tags.set([name_tags[name] for name in entry_tags[code]])
+        if updated_entries:
+            models.Deposition.objects.bulk_update(updated_entries, fields=sorted(updated_fields))
+        if new_entries:
+            models.Deposition.objects.bulk_create(new_entries)
+
+        # now create missing tags
+        name_tags = models.Tag.objects.in_bulk(field_name='name')  # maps tag names to tag
+        all_tags = set(itertools.chain.from_iterable(entry_tags.values()))
+        new_tags = all_tags - set(name_tags.keys())
+        models.Tag.objects.bulk_create([models.Tag(name=name) for name in new_tags])
+        name_tags.update(models.Tag.objects.in_bulk(new_tags, field_name='name'))
+
+        # finally, set tag relationships, adding missing links and removing stale ones
+        TagLink = models.Deposition.tags.through
+        depositions = models.Deposition.objects.in_bulk(entry_tags.keys(), field_name='code')
+        existing_links = {
+            (deposition_id, tag_id): pk
+            for pk, deposition_id, tag_id in TagLink.objects.filter(
+                deposition__in=depositions.values()
+            ).values_list('pk', 'deposition_id', 'tag_id')
+        }
+        links = {
+            (depositions[code].pk, name_tags[name].pk)
+            for code, names in entry_tags.items()
+            for name in names
+        }
+        new_links = [
+            TagLink(deposition_id=deposition_id, tag_id=tag_id)
+            for deposition_id, tag_id in links if (deposition_id, tag_id) not in existing_links
+        ]
+        stale_links = [pk for link, pk in existing_links.items() if link not in links]
+        TagLink.objects.bulk_create(new_links)
+        TagLink.objects.filter(pk__in=stale_links).delete()
+
+    return {
+        'created': len(new_entries),
+        'updated': len(updated_entries),
+        'unchanged': len(existing) - len(updated_entries),
+        'tags': len(new_tags),
+        'tag_links': len(new_links),
+        'stale_tag_links': len(stale_links),
+    }
+
 
-    return {'created': len(new_entries), 'updated': len(updated_entries)}
+def latest_deposition_date():
+    """
+    Return the most recent release or revision date of depositions in the database
+    """
+    dates = models.Deposition.objects.aggregate(released=Max('released'), revised=Max('revised'))
+    return max(filter(None, dates.values()), default=None)
 
 
 def fetch_book(isbn_list):
@@ -660,22 +771,56 @@ def create_publications(doi_list):
             for details in new_publications.values()
         ]
         models.Publication.objects.bulk_create(to_create)
+        models.AuthorToken.objects.index(models.Publication.objects.filter(code__in=new_publications.keys()))
 
     return {'journals': len(new_journals), 'publications': len(new_publications)}
 
 
-def fetch_and_update_depositions():
+def link_references(pending_depositions):
+    """
+    Link depositions to the publications matching their citations
+    :param pending_depositions: dictionary mapping citation codes to a list of depositions
+    :return: number of depositions linked
+    """
+    publications = models.Publication.objects.in_bulk(pending_depositions.keys(), field_name='code')
+
+    to_update = []
+    for code, depositions in pending_depositions.items():
+        if code in publications:
+            for deposition in depositions:
+                deposition.reference = publications[code]
+                to_update.append(deposition)
+
+    models.Deposition.objects.bulk_update(to_update, fields=['reference'])
+    return len(to_update)
+
+
+def fetch_and_update_depositions(incremental=False, since=None):
     """
     Fetch PDB Codes from RCSB, Create new entries, Update entries, create related
     Publication records and Journals, link everything together
+
+    :param incremental: only fetch entries released or revised since the latest date in the database
+    :param since: only fetch entries released or revised on or after this date, overrides incremental
+    :return: a dictionary summarizing the numbers of entries processed and the time taken for each step
     """
 
-    now = timezone.now()
+    timings = {}
+    if incremental and not since:
+        since = latest_deposition_date()
 
-    # create PDB depositions
-    codes = fetch_deposition_codes()
-    entries = fetch_depositions(codes)
-    create_depositions(entries)
+    # create or update PDB depositions
+    start_time = time.time()
+    codes = fetch_deposition_codes(since=since)
+    timings['search'] = time.time() - start_time
+
+    start_time = time.time()
+    entries = fetch_deposition_batches(codes)
+    timings['reports'] = time.time() - start_time
+
+    start_time = time.time()
+    report = create_depositions(entries)
+    timings['depositions'] = time.time() - start_time
 
     # update Publication information creating new ones if necessary
     pending_depositions = defaultdict(list)
@@ -688,29 +833,19 @@ def fetch_and_update_depositions():
     )
 
     # process dois in chunks of CROSSREF_BATCH_SIZE, to avoid issues with CrossRef rate limits
-    count = 0
+    start_time = time.time()
+    report['publications'] = 0
     for chunk in chunker(dois_pending, CROSSREF_BATCH_SIZE):
         doi_list = list(chunk)
-        count += len(doi_list)
-        print('CREATING PUBLICATIONS: {}'.format(count))
-        print(doi_list)
-        create_publications(doi_list)
+        report['publications'] += create_publications(doi_list)['publications']
         time.sleep(CROSSREF_THROTTLE)
 
     # Update references
-    added_references = models.Publication.objects.filter(created__gt=now).in_bulk(
-            pending_depositions.keys(), field_name='code'
-    )
-
-    for code, depositions in pending_depositions.items():
-        for deposition in depositions:
-            deposition.reference = added_references.get(code)
+    report['references'] = link_references(pending_depositions)
+    timings['publications'] = time.time() - start_time
 
-    models.Deposition.objects.bulk_update([
-        deposition
-        for depositions in pending_depositions.values()
-        for deposition in depositions
-    ], fields=['reference'])
+    report.update(since=since, codes=len(codes), entries=len(entries), timings=timings)
+    return report
 
 
 def fetch_journal_metrics(year=None):
@@ -826,6 +961,7 @@ def update_publication_metrics(year=None):
     # Update publication to point to most recent metrics
     newest = models.Metric.objects.filter(owner=OuterRef('pk')).order_by('-effective')
     models.Publication.objects.update(metrics_id=Subquery(newest.values('pk')[:1]))
+    models.expire_metrics()
 
     return {'created': len(to_create)}
 
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .models import Beamtime, Downtime, EmailNotification, SCHEDULE_FEED_VERSION_KEY
+
+SCHEDULE_FEED_TIMEOUT = getattr(settings, 'SCHEDULE_FEED_TIMEOUT', 600)
+SCHEDULE_FEED_KEY = 'schedule:feed:{version}:{kind}:{start}:{end}:{detailed}'
+ENTRY_SEPARATOR = '\x1e'
+
+
+def feed_key(kind, start, end, detailed=False):
+    version = cache.get(SCHEDULE_FEED_VERSION_KEY, 0)
+    return SCHEDULE_FEED_KEY.format(
+        version=version, kind=kind, start=start and start.isoformat() or '', end=end and end.isoformat() or '',
+        detailed=int(bool(detailed))
+    )
+
+
+def in_range(queryset, start=None, end=None):
+    """
+    Filter a queryset of time framed objects to those overlapping the range
+    :param queryset: Beamtime or Downtime queryset
+    :param start: start of range or None
+    :param end: end of range or None
+    """
+    if start and end:
+        queryset = queryset.filter(start__lt=end, end__gt=start)
+    elif start:
+        queryset = queryset.filter(start__gte=start)
+    elif end:
+        queryset = queryset.filter(end__lte=end)
+    return queryset
+
+
+def render_beamtimes(beamtimes, detailed=False):
+    """
+    Render the display text of all beamtimes in a single template pass
+    :param beamtimes: list of Beamtime objects
+    :param detailed: include staff tools and details
+    :return: list of rendered strings, one per beamtime
+    """
+    if not beamtimes:
+        return []
+    text = render_to_string('schedule/beamtime-feed.html', {
+        'beamtimes': beamtimes, 'detailed': detailed, 'separator': ENTRY_SEPARATOR
+    })
+    return [entry.strip() for entry in text.split(ENTRY_SEPARATOR)]
+
+
+def beamtime_feed(start=None, end=None, detailed=False):
+    """
+    Schedule entries for beamtime in the range. Entries are cached until beamtime, downtime or notifications change.
+    :param start: start of range or None
+    :param end: end of range or None
+    :param detailed: include staff tools and details
+    :return: list of dictionaries
+    """
+    key = feed_key('beamtime', start, end, detailed)
+    entries = cache.get(key)
+    if entries is None:
+        queryset = in_range(Beamtime.objects.all(), start, end).select_related('beamline', 'access', 'project')
+        if detailed:
+            queryset = queryset.prefetch_related(
+                Prefetch('notifications', queryset=EmailNotification.objects.select_related(
+                    'beamtime__project'
+                ).order_by('pk'))
+            )
+        beamtimes = list(queryset)
+        titles = render_beamtimes(beamtimes, detailed)
+        entries = [
+            {
+                "id": bt.pk,
+                "title": title,
+                "comments": bt.comments,
+                "beamline": bt.beamline.acronym,
+                "url": '',
+                "css_class": "{} {}".format(bt.access and bt.access.name or "", bt.cancelled and 'cancelled' or ''),
+                "starts": bt.start_times,
+                "end": bt.end_time
+            }
+            for bt, title in zip(beamtimes, titles)
+        ]
+        cache.set(key, entries, SCHEDULE_FEED_TIMEOUT)
+    return entries
+
+
+def downtime_feed(start=None, end=None):
+    """
+    Schedule entries for downtime in the range. Entries are cached until beamtime or downtime change.
+    :param start: start of range or None
+    :param end: end of range or None
+    :return: list of dictionaries
+    """
+    key = feed_key('downtime', start, end)
+    entries = cache.get(key)
+    if entries is None:
+        entries = [
+            {
+                "id": dt.pk,
+                "beamline": dt.beamline.acronym,
+                "style": dt.get_scope_display().replace(' ', ''),
+                "comments": dt.comments,
+                "url": reverse('downtime-edit', kwargs={'pk': dt.pk}),
+                "starts": dt.start_times,
+                "end": dt.end_time
+            }
+            for dt in in_range(Downtime.objects.all(), start, end).select_related('beamline')
+        ]
+        cache.set(key, entries, SCHEDULE_FEED_TIMEOUT)
+    return entries
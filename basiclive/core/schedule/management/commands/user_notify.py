@@ -1,21 +1,50 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
 from django.core import mail
+from django.db import connections
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
 
-from basiclive.core.schedule.models import EmailNotification
+from basiclive.core.schedule.models import EmailNotification, expire_schedule_feeds
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_WORKERS = getattr(settings, 'NOTIFY_WORKERS', 1)
 
 
 class Command(BaseCommand):
     help = 'Notifies users of upcoming beamtime'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=NOTIFY_WORKERS,
+            help='Number of mail server connections used in parallel'
+        )
+
     def handle(self, *args, **options):
         self.from_email = getattr(settings, 'FROM_EMAIL', "sender@no-reply.ca")
         now = timezone.now() - timedelta(hours=1)
 
-        for notification in EmailNotification.objects.filter(sent=False, beamtime__cancelled=False).filter(send_time__range=[now, now + timedelta(hours=2)]):
-            self.save(notification)
+        notifications = EmailNotification.objects.filter(sent=False, beamtime__cancelled=False).filter(
+            send_time__range=[now, now + timedelta(hours=2)]
+        ).select_related('beamtime__project')
+        messages = [(notification.pk, self.get_message(notification)) for notification in notifications]
+        if not messages:
+            return
+
+        workers = max(1, min(options['workers'], len(messages)))
+        if workers == 1:
+            sent = self.send(messages)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                batches = executor.map(self.send_batch, [messages[i::workers] for i in range(workers)])
+                sent = [pk for batch in batches for pk in batch]
+
+        expire_schedule_feeds()
+        print("{} of {} notifications sent".format(len(sent), len(messages)))
 
     def get_message_dict(self, notification):
 
@@ -27,15 +56,37 @@ class Command(BaseCommand):
             'body': notification.email_body,
         }
         return message_dict
-    
-    def save(self, notification=None, fail_silently=False):
+
+    def get_message(self, notification):
+        return mail.EmailMessage(**self.get_message_dict(notification))
+
+    def send_batch(self, messages):
         """
-        Build and send the email message.
-        
+        Send messages from a worker thread, closing the thread's database connections when done
         """
-        message_dict = self.get_message_dict(notification)
-        email = mail.EmailMessage(**message_dict)
-        email.send(fail_silently=fail_silently)
+        try:
+            return self.send(messages)
+        finally:
+            connections.close_all()
 
-        notification.sent = True
-        notification.save()
+    def send(self, messages, fail_silently=False):
+        """
+        Send messages over a single mail server connection. A failed message does not prevent the rest from being
+        sent. Each notification is marked as sent as soon as its message has been sent, so an interrupted run does
+        not send it again.
+
+        :param messages: list of (notification pk, EmailMessage) tuples
+        :return: list of primary keys of notifications sent
+        """
+        sent = []
+        connection = mail.get_connection(fail_silently=fail_silently)
+        with connection:
+            for pk, message in messages:
+                try:
+                    connection.send_messages([message])
+                except Exception as e:
+                    logger.error('Unable to send notification {}: {}'.format(pk, e))
+                else:
+                    EmailNotification.objects.filter(pk=pk).update(sent=True)
+                    sent.append(pk)
+        return sent
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.4 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0004_accesstype_remote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationTimezone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(blank=True, default='', max_length=180)),
+                ('province', models.CharField(blank=True, default='', max_length=180)),
+                ('country', models.CharField(blank=True, default='', max_length=180)),
+                ('timezone', models.CharField(blank=True, max_length=64, null=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('city', 'province', 'country')},
+            },
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.template.loader import render_to_string
@@ -13,14 +16,14 @@ from datetime import datetime, timedelta
 
 from basiclive.core.lims.models import Project, Beamline, Stretch
 
-from geopy import geocoders
-import timezonefinder, pytz
+import pytz
 
-tf = timezonefinder.TimezoneFinder()
+from .timezones import location_key, resolver
 
 MIN_SUPPORT_HOUR = getattr(settings, 'MIN_SUPPORT_HOUR', 0)
 MAX_SUPPORT_HOUR = getattr(settings, 'MAX_SUPPORT_HOUR', 24)
 APP_NAME = getattr(settings, 'APP_NAME', 'basiclive')
+SCHEDULE_FEED_VERSION_KEY = 'schedule:feed-version'
 
 class AccessType(models.Model):
     name = models.CharField(blank=True, max_length=30)
@@ -109,7 +112,8 @@ class Beamtime(models.Model):
         return render_to_string('schedule/templates/schedule/beamtime.html', {'bt': self, 'detailed': detailed})
 
     def notification(self):
-        return self.notifications.first()
+        # iterate instead of first() so that prefetched notifications are used
+        return next(iter(self.notifications.all()), None)
 
     def sessions(self):
         return self.project.sessions.filter(beamline=self.beamline).filter(
@@ -176,6 +180,40 @@ class Downtime(TimeFramedModel):
         return start_times
 
 
+class LocationTimezone(models.Model):
+    city = models.CharField(max_length=180, blank=True, default='')
+    province = models.CharField(max_length=180, blank=True, default='')
+    country = models.CharField(max_length=180, blank=True, default='')
+    timezone = models.CharField(max_length=64, null=True, blank=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (
+            ("city", "province", "country"),
+        )
+
+    def __str__(self):
+        return "{}: {}".format(', '.join(v for v in (self.city, self.province, self.country) if v), self.timezone)
+
+
+class EmailNotificationManager(models.Manager):
+    def reschedule(self, key, previous, usertz):
+        """
+        Update the send time of pending notifications for users at a location whose timezone has been resolved.
+        Notifications whose send time has been changed manually are left untouched.
+        :param key: location key (city, province, country)
+        :param previous: timezone previously used for the location, or None for the default
+        :param usertz: new timezone
+        """
+        pending = self.filter(sent=False, send_time__gt=timezone.now()).select_related('beamtime__project')
+        for notification in pending:
+            project = notification.beamtime.project
+            if project and location_key(project.city, project.province, project.country) == key:
+                if notification.send_time == notification.default_send_time(previous):
+                    notification.send_time = notification.default_send_time(usertz)
+                    notification.save(update_fields=['send_time'])
+
+
 class EmailNotification(models.Model):
     beamtime = models.ForeignKey(Beamtime, related_name="notifications", on_delete=models.CASCADE)
     email_subject = models.CharField(max_length=100, verbose_name=_('Email Subject'))
@@ -183,6 +221,8 @@ class EmailNotification(models.Model):
     send_time = models.DateTimeField(verbose_name=_('Send Time'), null=True)
     sent = models.BooleanField(default=False)
 
+    objects = EmailNotificationManager()
+
     def recipient_list(self):
         return list(set([e for e in [self.beamtime.project.email, self.beamtime.project.contact_email] if e]))
 
@@ -191,19 +231,43 @@ class EmailNotification(models.Model):
         empty = not self.recipient_list()
         return not self.sent and any([late, empty, self.beamtime.cancelled])
 
+    def default_send_time(self, usertz=None):
+        """
+        Default send time of the notification, 10 AM in the user's timezone a week before the beamtime
+        :param usertz: timezone name, defaults to TIME_ZONE
+        """
+        t = self.beamtime.start - timedelta(days=7 + (self.beamtime.start.weekday() > 4 and self.beamtime.start.weekday() - 4 or 0))
+        return pytz.timezone(usertz or settings.TIME_ZONE).localize(datetime(year=t.year, month=t.month, day=t.day, hour=10))
+
     def save(self, *args, **kwargs):
-        # Get user's local timezone
         if not self.pk:
-            try:
-                locator = geocoders.Nominatim(user_agent=APP_NAME)
-                address = "{user.city}, {user.province}, {user.country}".format(user=self.beamtime.project)
-                _, (latitude, longitude) = locator.geocode(address)
-                usertz = tf.certain_timezone_at(lat=latitude, lng=longitude) or settings.TIME_ZONE
-            except:
-                usertz = settings.TIME_ZONE
-            t = self.beamtime.start - timedelta(days=7 + (self.beamtime.start.weekday() > 4 and self.beamtime.start.weekday() - 4 or 0))
-            self.send_time = pytz.timezone(usertz).localize(datetime(year=t.year, month=t.month, day=t.day, hour=10))
+            # Use the user's local timezone if already known, it is resolved in the background otherwise
+            project = self.beamtime.project
+            usertz = project and resolver.resolve(project.city, project.province, project.country)
+            self.send_time = self.default_send_time(usertz)
             self.email_subject = self.beamtime.info_subject()
             self.email_body = self.beamtime.info_body()
 
         super().save(*args, **kwargs)
+
+
+def expire_schedule_feeds():
+    """
+    Invalidate all cached schedule feeds by changing the version included in their cache keys
+    """
+    try:
+        cache.incr(SCHEDULE_FEED_VERSION_KEY)
+    except ValueError:
+        cache.set(SCHEDULE_FEED_VERSION_KEY, 1, None)
+
+
+@receiver(post_save, sender=Beamtime)
+@receiver(post_delete, sender=Beamtime)
+@receiver(post_save, sender=Downtime)
+@receiver(post_delete, sender=Downtime)
+@receiver(post_save, sender=EmailNotification)
+@receiver(post_delete, sender=EmailNotification)
+@receiver(post_save, sender=AccessType)
+@receiver(post_delete, sender=AccessType)
+def on_schedule_change(sender, **kwargs):
+    expire_schedule_feeds()
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FACILITY_MODES = getattr(settings, 'FACILITY_MODES', None)
+FACILITY_MODES_TIMEOUT = getattr(settings, 'FACILITY_MODES_TIMEOUT', 2)
+FACILITY_MODES_MAX_AGE = getattr(settings, 'FACILITY_MODES_MAX_AGE', 300)
+FACILITY_MODES_STALE_AGE = getattr(settings, 'FACILITY_MODES_STALE_AGE', 86400)
+FACILITY_MODES_RETRY = getattr(settings, 'FACILITY_MODES_RETRY', 60)
+FACILITY_MODES_KEY = 'schedule:facility-modes:{start}:{end}'
+
+
+class FacilityModeProvider(object):
+    """
+    Fetches facility beam modes for a date range from the FACILITY_MODES server.
+
+    Results are cached for up to `stale_age` seconds. Entries older than `max_age` are still served, while a
+    background thread refreshes them (stale-while-revalidate). Only a cold cache blocks the caller, and then for no
+    longer than `timeout` seconds. Failed fetches are not retried for `retry` seconds, so an unreachable server does
+    not delay every page.
+
+    :param url: facility mode server url
+    :param timeout: request timeout in seconds
+    :param max_age: age in seconds after which cached modes are refreshed
+    :param stale_age: age in seconds after which cached modes are discarded
+    :param retry: seconds to wait before retrying a failed fetch
+    """
+
+    def __init__(self, url=FACILITY_MODES, timeout=FACILITY_MODES_TIMEOUT, max_age=FACILITY_MODES_MAX_AGE,
+                 stale_age=FACILITY_MODES_STALE_AGE, retry=FACILITY_MODES_RETRY):
+        self.url = url
+        self.timeout = timeout
+        self.max_age = max_age
+        self.stale_age = stale_age
+        self.retry = retry
+        self.session = requests.Session()
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def fetch(self, start, end):
+        """
+        Fetch modes from the server
+        :return: list of modes, or None if the modes could not be fetched
+        """
+        try:
+            r = self.session.get(self.url, params={'start': start, 'end': end}, timeout=self.timeout)
+            r.raise_for_status()
+            return r.json()
+        except requests.exceptions.MissingSchema:
+            logger.warning("FACILITY_MODES must start with 'http://' or 'https://'.")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning("Couldn't fetch beam modes from {}: {}".format(self.url, e))
+
+    def refresh(self, key, start, end):
+        """
+        Fetch modes and update the cache entry. Failures keep serving the existing entry until it expires.
+        :return: cache entry
+        """
+        modes = self.fetch(start, end)
+        entry = cache.get(key)
+        now = time.time()
+        if modes is not None:
+            entry = {'modes': modes, 'time': now, 'checked': now}
+        elif entry is not None:
+            entry['checked'] = now
+        else:
+            entry = {'modes': [], 'time': None, 'checked': now}
+        cache.set(key, entry, self.stale_age)
+        return entry
+
+    def background_refresh(self, key, start, end):
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+
+        def worker():
+            try:
+                self.refresh(key, start, end)
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def get_modes(self, start, end):
+        """
+        Facility modes for a date range
+        :param start: start date
+        :param end: end date
+        :return: list of dictionaries with 'start', 'end' and 'kind' keys
+        """
+        if not self.url:
+            return []
+
+        key = FACILITY_MODES_KEY.format(start=start, end=end)
+        entry = cache.get(key)
+        if entry is None:
+            entry = self.refresh(key, start, end)
+        else:
+            now = time.time()
+            expired = entry['time'] is None or now - entry['time'] > self.max_age
+            if expired and now - entry['checked'] > self.retry:
+                self.background_refresh(key, start, end)
+        return entry['modes']
+
+
+provider = FacilityModeProvider()
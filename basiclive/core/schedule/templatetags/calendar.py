@@ -3,13 +3,11 @@ from django.conf import settings
 from django.utils import timezone
 
 from basiclive.core.schedule.models import BeamlineSupport
+from basiclive.core.schedule.modes import provider
 
 from datetime import datetime, date, timedelta, time
 import pytz
 import calendar
-import requests
-
-import warnings
 
 import logging
 logger = logging.getLogger(__name__)
@@ -44,13 +42,16 @@ def calendar_view(year, week):
     dates = month[i*7:i*7+7]
     start = dates[0]
     end = dates[-1] + timedelta(days=1)
+    support = {}
+    for entry in BeamlineSupport.objects.filter(date__gte=start, date__lt=end).select_related('staff').order_by('pk'):
+        support.setdefault(entry.date, entry)
     info = {
         'week': {
             datetime.strftime(d, '%Y-%m-%d'): {
                 'name': nm,
                 'date': d,
                 'modes': shifts.copy(),
-                'support': BeamlineSupport.objects.filter(date=d).first() }
+                'support': support.get(d) }
             for nm, d in zip(names, dates)
         },
         'shifts': shift_count,
@@ -58,27 +59,20 @@ def calendar_view(year, week):
         'end': datetime.strftime(end, '%Y-%m-%d'),
     }
 
-    """Could be moved to AJAX request if Access-Control-Allow-Origin header added to api resource"""
-
-    if getattr(settings, "FACILITY_MODES", False):
+    for mode in provider.get_modes(start, end):
         try:
-            url = "{}?start={}&end={}".format(settings.FACILITY_MODES, start, end)
-            r = requests.get(url)
-            if r.status_code == 200:
-                for mode in r.json():
-                    st = datetime.strptime(mode['start'], '%Y-%m-%dT%H:%M:%SZ')
-                    while st < datetime.strptime(mode['end'], '%Y-%m-%dT%H:%M:%SZ'):
-                        dt = format_localdate(st)
-                        hr = format_localhour(st)
-                        st += timedelta(hours=slot)
-                        if dt in info['week'].keys():
-                            info['week'][dt]['modes'][hr] = {
-                                'kind': str(mode['kind'])
-                            }
-        except requests.exceptions.ConnectionError:
-            warnings.warn("Couldn't fetch beam modes from {}.".format(settings.FACILITY_MODES))
-        except requests.exceptions.MissingSchema:
-            warnings.warn("FACILITY_MODE must start with 'http://' or 'https://'.")
+            st = datetime.strptime(mode['start'], '%Y-%m-%dT%H:%M:%SZ')
+            mode_end = datetime.strptime(mode['end'], '%Y-%m-%dT%H:%M:%SZ')
+        except (KeyError, TypeError, ValueError):
+            continue
+        while st < mode_end:
+            dt = format_localdate(st)
+            hr = format_localhour(st)
+            st += timedelta(hours=slot)
+            if dt in info['week'].keys():
+                info['week'][dt]['modes'][hr] = {
+                    'kind': str(mode['kind'])
+                }
 
     return info
 
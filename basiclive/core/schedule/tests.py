@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from basiclive.core.lims.models import Beamline, Project
+from .models import AccessType, Beamtime, EmailNotification
+from .modes import FacilityModeProvider
+
+
+class FakeModeServer(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the FACILITY_MODES server. Closes connections without a response while `down` is set.
+    """
+    kind = 'Normal'
+    delay = 0
+    down = False
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        FakeModeServer.requests += 1
+        time.sleep(self.delay)
+        if self.down:
+            self.close_connection = True
+            return
+        body = json.dumps([
+            {'start': '2026-10-20T08:00:00Z', 'end': '2026-10-20T16:00:00Z', 'kind': self.kind}
+        ]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FacilityModeProviderTests(SimpleTestCase):
+    START, END = '2026-10-19', '2026-10-26'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeModeServer)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:{}/modes/'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        FakeModeServer.kind = 'Normal'
+        FakeModeServer.delay = 0
+        FakeModeServer.down = False
+        FakeModeServer.requests = 0
+        self.provider = FacilityModeProvider(url=self.url, timeout=0.5, max_age=0.2, retry=0.1)
+
+    def get_kinds(self):
+        return [mode['kind'] for mode in self.provider.get_modes(self.START, self.END)]
+
+    def wait_for_refresh(self, timeout=5):
+        end = time.time() + timeout
+        while self.provider.pending and time.time() < end:
+            time.sleep(0.01)
+        self.assertFalse(self.provider.pending)
+
+    def test_fresh_modes_are_cached(self):
+        self.assertEqual(self.get_kinds(), ['Normal'])
+        self.assertEqual(self.get_kinds(), ['Normal'])
+        self.assertEqual(FakeModeServer.requests, 1)
+
+    def test_stale_modes_are_served_while_refreshing(self):
+        self.assertEqual(self.get_kinds(), ['Normal'])
+        time.sleep(0.3)
+        FakeModeServer.kind = 'Shutdown'
+        FakeModeServer.delay = 0.3
+
+        start = time.time()
+        self.assertEqual(self.get_kinds(), ['Normal'])
+        self.assertLess(time.time() - start, 0.2)
+
+        self.wait_for_refresh()
+        self.assertEqual(self.get_kinds(), ['Shutdown'])
+        self.assertEqual(FakeModeServer.requests, 2)
+
+    def test_upstream_down(self):
+        FakeModeServer.down = True
+        self.assertEqual(self.get_kinds(), [])
+
+        # failures are not retried until the retry interval has passed
+        self.assertEqual(self.get_kinds(), [])
+        self.assertEqual(FakeModeServer.requests, 1)
+
+        # modes fetched once the server is back are kept when it goes down again
+        FakeModeServer.down = False
+        time.sleep(0.15)
+        self.get_kinds()
+        self.wait_for_refresh()
+        self.assertEqual(self.get_kinds(), ['Normal'])
+
+        FakeModeServer.down = True
+        time.sleep(0.3)
+        self.get_kinds()
+        self.wait_for_refresh()
+        self.assertEqual(self.get_kinds(), ['Normal'])
+        self.assertEqual(FakeModeServer.requests, 3)
+
+    def test_unreachable_server_does_not_block(self):
+        provider = FacilityModeProvider(url='http://127.0.0.1:1/modes/', timeout=0.5)
+        start = time.time()
+        self.assertEqual(provider.get_modes(self.START, self.END), [])
+        self.assertLess(time.time() - start, 1)
+
+    def test_disabled(self):
+        self.assertEqual(FacilityModeProvider(url=None).get_modes(self.START, self.END), [])
+
+
+class InterruptedBackend(EmailBackend):
+    """
+    Mail backend which stops the process after sending one message
+    """
+    def send_messages(self, messages):
+        if mail.outbox:
+            raise KeyboardInterrupt
+        return super().send_messages(messages)
+
+
+class FailingBackend(EmailBackend):
+    """
+    Mail backend which rejects messages to one recipient
+    """
+    def send_messages(self, messages):
+        if any('fail@example.com' in message.to for message in messages):
+            raise ConnectionError('Rejected')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class UserNotifyTests(TransactionTestCase):
+
+    def setUp(self):
+        beamline = Beamline.objects.create(name='Beamline', acronym='BL1')
+        access = AccessType.objects.create(name='Remote', email_subject='Beamtime', email_body='Details')
+        for i, email in enumerate(['one@example.com', 'two@example.com', 'fail@example.com', 'four@example.com']):
+            project = Project.objects.create(username='user{}'.format(i), email=email)
+            start = timezone.now() + timedelta(days=7)
+            beamtime = Beamtime.objects.create(
+                project=project, beamline=beamline, access=access, start=start, end=start + timedelta(hours=8)
+            )
+            EmailNotification.objects.create(beamtime=beamtime)
+        EmailNotification.objects.update(send_time=timezone.now())
+
+    def sent(self):
+        return sorted(EmailNotification.objects.filter(sent=True).values_list('beamtime__project__email', flat=True))
+
+    def test_notifications_sent(self):
+        call_command('user_notify', workers=2)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(len(self.sent()), 4)
+
+        # notifications are only sent once
+        call_command('user_notify', workers=2)
+        self.assertEqual(len(mail.outbox), 4)
+
+    @override_settings(EMAIL_BACKEND='basiclive.core.schedule.tests.FailingBackend')
+    def test_failed_notification_does_not_stop_others(self):
+        call_command('user_notify', workers=2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertNotIn('fail@example.com', self.sent())
+        self.assertEqual(len(self.sent()), 3)
+
+    @override_settings(EMAIL_BACKEND='basiclive.core.schedule.tests.InterruptedBackend')
+    def test_sent_notifications_are_marked_immediately(self):
+        with self.assertRaises(KeyboardInterrupt):
+            call_command('user_notify', workers=1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.sent(), mail.outbox[0].to)
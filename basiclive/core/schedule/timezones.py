@@ -0,0 +1,167 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+APP_NAME = getattr(settings, 'APP_NAME', 'basiclive')
+TIMEZONE_OFFLINE = getattr(settings, 'SCHEDULE_TIMEZONE_OFFLINE', False)
+TIMEZONE_GEOCODE_TIMEOUT = getattr(settings, 'SCHEDULE_TIMEZONE_GEOCODE_TIMEOUT', 5)
+TIMEZONE_REFRESH_DAYS = getattr(settings, 'SCHEDULE_TIMEZONE_REFRESH_DAYS', 90)
+TIMEZONE_RETRY_HOURS = getattr(settings, 'SCHEDULE_TIMEZONE_RETRY_HOURS', 6)
+
+# Bundled lookup table used in offline mode, and as a fallback when geocoding fails. Keys are lower case province
+# or country names.
+TIMEZONE_TABLE = {
+    'british columbia': 'America/Vancouver', 'bc': 'America/Vancouver',
+    'alberta': 'America/Edmonton', 'ab': 'America/Edmonton',
+    'saskatchewan': 'America/Regina', 'sk': 'America/Regina',
+    'manitoba': 'America/Winnipeg', 'mb': 'America/Winnipeg',
+    'ontario': 'America/Toronto', 'on': 'America/Toronto',
+    'quebec': 'America/Toronto', 'québec': 'America/Toronto', 'qc': 'America/Toronto',
+    'new brunswick': 'America/Moncton', 'nb': 'America/Moncton',
+    'nova scotia': 'America/Halifax', 'ns': 'America/Halifax',
+    'prince edward island': 'America/Halifax', 'pe': 'America/Halifax',
+    'newfoundland and labrador': 'America/St_Johns', 'nl': 'America/St_Johns',
+    'yukon': 'America/Whitehorse', 'yt': 'America/Whitehorse',
+    'northwest territories': 'America/Yellowknife', 'nt': 'America/Yellowknife',
+    'united kingdom': 'Europe/London', 'uk': 'Europe/London',
+    'ireland': 'Europe/Dublin',
+    'france': 'Europe/Paris',
+    'germany': 'Europe/Berlin',
+    'switzerland': 'Europe/Zurich',
+    'italy': 'Europe/Rome',
+    'spain': 'Europe/Madrid',
+    'netherlands': 'Europe/Amsterdam',
+    'sweden': 'Europe/Stockholm',
+    'india': 'Asia/Kolkata',
+    'china': 'Asia/Shanghai',
+    'japan': 'Asia/Tokyo',
+    'south korea': 'Asia/Seoul',
+    'new zealand': 'Pacific/Auckland',
+    **getattr(settings, 'SCHEDULE_TIMEZONE_TABLE', {})
+}
+
+
+def location_key(city, province, country):
+    return tuple((value or '').strip().lower() for value in (city, province, country))
+
+
+def table_timezone(key):
+    """
+    Find the timezone of a location in the bundled lookup table
+    :param key: location key (city, province, country)
+    :return: timezone name or None
+    """
+    city, province, country = key
+    return TIMEZONE_TABLE.get(province) or TIMEZONE_TABLE.get(country)
+
+
+class TimezoneResolver(object):
+    """
+    Resolves the timezone of a (city, province, country) location. Resolved locations are stored in the
+    LocationTimezone table. Unknown or outdated locations are geocoded in a background thread, so resolve() never
+    waits for the network. The geocoder and timezone finder are only created when first needed.
+
+    :param offline: if True, only the bundled lookup table is used
+    """
+
+    def __init__(self, offline=TIMEZONE_OFFLINE):
+        self.offline = offline
+        self.pending = set()
+        self.lock = threading.Lock()
+        self._finder = None
+        self._locator = None
+
+    @property
+    def finder(self):
+        with self.lock:
+            if self._finder is None:
+                import timezonefinder
+                self._finder = timezonefinder.TimezoneFinder()
+        return self._finder
+
+    @property
+    def locator(self):
+        with self.lock:
+            if self._locator is None:
+                from geopy import geocoders
+                self._locator = geocoders.Nominatim(user_agent=APP_NAME, timeout=TIMEZONE_GEOCODE_TIMEOUT)
+        return self._locator
+
+    def resolve(self, city, province, country):
+        """
+        Timezone of a location, if known
+        :return: timezone name, or None if the location has not been resolved yet
+        """
+        from .models import LocationTimezone
+
+        key = location_key(city, province, country)
+        if not any(key):
+            return None
+        if self.offline:
+            return table_timezone(key)
+
+        entry, created = LocationTimezone.objects.get_or_create(city=key[0], province=key[1], country=key[2])
+        age = timezone.now() - entry.modified
+        retry = entry.timezone is None and age > timedelta(hours=TIMEZONE_RETRY_HOURS)
+        if created or retry or age > timedelta(days=TIMEZONE_REFRESH_DAYS):
+            transaction.on_commit(lambda: self.refresh_later(key))
+        return entry.timezone
+
+    def lookup(self, key):
+        """
+        Geocode the location and find its timezone, falling back to the bundled lookup table
+        :param key: location key (city, province, country)
+        :return: timezone name or None
+        """
+        try:
+            location = self.locator.geocode(', '.join(value for value in key if value))
+            if location:
+                usertz = self.finder.certain_timezone_at(lat=location.latitude, lng=location.longitude)
+                if usertz:
+                    return usertz
+        except Exception as e:
+            logger.warning('Unable to geocode {}: {}'.format(', '.join(key), e))
+        return table_timezone(key)
+
+    def refresh(self, key):
+        """
+        Resolve the location and reschedule pending notifications of users at that location
+        :param key: location key (city, province, country)
+        """
+        from .models import LocationTimezone, EmailNotification
+
+        entry = LocationTimezone.objects.filter(city=key[0], province=key[1], country=key[2]).first()
+        previous = entry and entry.timezone
+        usertz = self.lookup(key) or previous
+        LocationTimezone.objects.update_or_create(
+            city=key[0], province=key[1], country=key[2], defaults={'timezone': usertz}
+        )
+        if usertz and usertz != previous:
+            EmailNotification.objects.reschedule(key, previous, usertz)
+
+    def refresh_later(self, key):
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+
+        def worker():
+            try:
+                self.refresh(key)
+            except Exception as e:
+                logger.error('Unable to resolve timezone for {}: {}'.format(', '.join(key), e))
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                connections.close_all()
+
+        threading.Thread(target=worker, daemon=True).start()
+
+
+resolver = TimezoneResolver()
@@ -131,6 +131,7 @@ class BeamtimeCreate(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, ed
 
         if form.cleaned_data['notify']:
             models.EmailNotification.objects.create(beamtime=self.object)
+        models.expire_schedule_feeds()
 
         success_url = self.get_success_url()
         return JsonResponse({'url': success_url})
@@ -168,6 +169,7 @@ class BeamtimeEdit(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit
             Q(start__gte=obj.start) & Q(start__lt=obj.end)) | (
             Q(end__lte=obj.end) & Q(end__gt=obj.start)) | (
             Q(start__gte=obj.start) & Q(end__lte=obj.end))).exclude(pk=obj.pk).delete()
+        models.expire_schedule_feeds()
 
         success_url = self.get_success_url()
         return JsonResponse({'url': success_url})
@@ -310,6 +312,7 @@ class DowntimeCreate(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, ed
         split_visits(obj, obj.start, obj.end)
         models.Beamtime.objects.filter(beamline=obj.beamline).filter(
             (Q(start__gte=obj.start) & Q(end__lte=obj.end))).update(cancelled=True)
+        models.expire_schedule_feeds()
 
         success_url = self.get_success_url()
         return JsonResponse({'url': success_url})
@@ -345,6 +348,7 @@ class DowntimeEdit(AdminRequiredMixin, SuccessMessageMixin, AsyncFormMixin, edit
                 split_visits(obj, start, end)
                 models.Beamtime.objects.filter(beamline=obj.beamline).filter(
                     (Q(start__gte=start) & Q(end__lte=end))).update(cancelled=True)
+        models.expire_schedule_feeds()
 
         return fv
 
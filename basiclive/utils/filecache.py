@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from django import http
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = getattr(settings, 'PROXY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'basiclive-proxy-cache'))
+CACHE_MAX_BYTES = getattr(settings, 'PROXY_CACHE_MAX_BYTES', 1024 ** 3)  # 1 GB
+CACHE_MAX_FILE_BYTES = getattr(settings, 'PROXY_CACHE_MAX_FILE_BYTES', 16 * 1024 ** 2)  # 16 MB
+CACHE_MAX_AGE = getattr(settings, 'PROXY_CACHE_MAX_AGE', 86400)  # revalidate entries older than 1 day
+CACHE_TIMEOUT = getattr(settings, 'PROXY_CACHE_TIMEOUT', (5, 30))  # (connect, read) in seconds
+CACHE_CHUNK_SIZE = 64 * 1024
+CACHE_LOW_WATERMARK = 0.9  # fraction of the byte budget kept after eviction
+CACHE_RESCAN_INTERVAL = getattr(settings, 'PROXY_CACHE_RESCAN_INTERVAL', 3600)  # re-measure the directory hourly
+CACHE_METRICS_KEY = 'proxy-cache:{}'
+CACHE_BYTES_KEY = 'proxy-cache:bytes'
+CACHE_EVICT_LOCK = 'proxy-cache:evicting'
+CACHE_EVICT_TIMEOUT = 300
+# errors while fetching a file or writing it to the cache
+FETCH_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, OSError)
+CACHE_EVENTS = ('hit', 'miss', 'revalidated', 'stale', 'error', 'evicted')
+
+
+def record(event, count=1):
+    key = CACHE_METRICS_KEY.format(event)
+    if not cache.add(key, count, None):
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, None)
+
+
+class FileCache(object):
+    """
+    Local disk cache of files fetched from an upstream server, for immutable content such as snapshots and frame
+    images. Files are keyed by URL and served with FileResponse, so the WSGI server can use sendfile. Entries older
+    than `max_age` are revalidated upstream with If-None-Match/If-Modified-Since, and served stale if the upstream
+    server is unavailable. When the cache exceeds `max_bytes`, the least recently used files are evicted.
+
+    The size of the cache directory is tracked in the Django cache, so that all processes sharing the directory
+    share the byte budget. This requires a cache backend shared by those processes. The size is measured again from
+    the directory every `CACHE_RESCAN_INTERVAL` seconds.
+
+    :param root: cache directory, caching is disabled if empty
+    :param max_bytes: byte budget for the cache directory
+    :param max_file_bytes: larger files are streamed through but not cached
+    :param max_age: age in seconds after which entries are revalidated
+    :param session: requests session used for upstream requests
+    :param timeout: upstream request timeout
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_file_bytes=CACHE_MAX_FILE_BYTES,
+                 max_age=CACHE_MAX_AGE, session=None, timeout=CACHE_TIMEOUT):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_age = max_age
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def paths(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        folder = os.path.join(self.root, digest[:2])
+        return os.path.join(folder, digest), os.path.join(folder, '{}.json'.format(digest))
+
+    def entries(self):
+        """
+        Cached files, least recently used first
+        :return: list of (access time, size, path) tuples
+        """
+        entries = []
+        for folder, dirs, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.json') or name.startswith('.'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def usage(self):
+        """
+        Bytes used by the cache directory, measured from the directory if not known to the Django cache
+        """
+        size = cache.get(CACHE_BYTES_KEY)
+        if size is None:
+            size = sum(size for mtime, size, path in self.entries())
+            cache.set(CACHE_BYTES_KEY, size, CACHE_RESCAN_INTERVAL)
+        return size
+
+    def grow(self, size):
+        """
+        Add newly cached bytes to the shared usage counter
+        :return: updated usage in bytes
+        """
+        try:
+            return cache.incr(CACHE_BYTES_KEY, size)
+        except ValueError:
+            # counter expired, measuring the directory includes the new file
+            return self.usage()
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache is within its byte budget. Only one process evicts at a
+        time, others skip eviction while it is in progress.
+        """
+        if not cache.add(CACHE_EVICT_LOCK, True, CACHE_EVICT_TIMEOUT):
+            return
+        try:
+            entries = self.entries()
+            total = sum(size for mtime, size, path in entries)
+            target = self.max_bytes * CACHE_LOW_WATERMARK
+            evicted = 0
+            for mtime, size, path in entries:
+                if total <= target:
+                    break
+                for name in (path, '{}.json'.format(path)):
+                    try:
+                        os.remove(name)
+                    except OSError:
+                        pass
+                total -= size
+                evicted += 1
+            cache.set(CACHE_BYTES_KEY, total, CACHE_RESCAN_INTERVAL)
+        finally:
+            cache.delete(CACHE_EVICT_LOCK)
+        if evicted:
+            record('evicted', evicted)
+
+    def load(self, url):
+        """
+        Metadata of a cached file
+        :return: dictionary or None if the url is not cached
+        """
+        path, meta_path = self.paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(path) else None
+
+    def save(self, url, meta):
+        path, meta_path = self.paths(url)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(meta_path), prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def store(self, url, response):
+        """
+        Write an upstream response to the cache
+        :param url: upstream url
+        :param response: streamed requests response
+        :return: tuple (metadata, open file) where the file is only given for uncached responses too large to keep
+        :raises: one of FETCH_ERRORS if the response could not be read or written
+        """
+        path, meta_path = self.paths(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        response.raw.decode_content = True
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, CACHE_CHUNK_SIZE)
+                size = f.tell()
+        except FETCH_ERRORS:
+            # temporary files are not counted as cache entries, so they would never be evicted
+            os.remove(tmp)
+            raise
+        meta = {
+            'url': url,
+            'size': size,
+            'checked': time.time(),
+            'content_type': response.headers.get('Content-Type', 'application/octet-stream'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if size > self.max_file_bytes:
+            handle = os.fdopen(os.open(tmp, os.O_RDONLY), 'rb')
+            os.remove(tmp)
+            return meta, handle
+
+        os.replace(tmp, path)
+        self.save(url, meta)
+        if self.grow(size) > self.max_bytes:
+            self.evict()
+        return meta, None
+
+    def validators(self, meta):
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def respond(self, request, meta, status, handle=None):
+        path, meta_path = self.paths(meta['url'])
+        if meta.get('etag') and request.headers.get('If-None-Match') == meta['etag']:
+            response = http.HttpResponseNotModified()
+            if handle is not None:
+                handle.close()
+        else:
+            if handle is None:
+                handle = open(path, 'rb')
+            filename = os.path.basename(urlparse(meta['url']).path)
+            response = http.FileResponse(handle, content_type=meta['content_type'], filename=filename)
+            response['Content-Length'] = meta['size']
+        for header, field in (('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+            if meta.get(field):
+                response[header] = meta[field]
+        response['X-Cache'] = status.upper()
+        return response
+
+    def serve(self, request, url):
+        """
+        Serve an upstream url from the cache, fetching or revalidating it as needed
+        :param request: client request
+        :param url: upstream url
+        :return: HttpResponse
+        """
+        meta = self.load(url)
+        status = 'hit'
+        if meta is None or time.time() - meta['checked'] > self.max_age:
+            try:
+                r = self.session.get(url, stream=True, headers=self.validators(meta), timeout=self.timeout)
+                with r:
+                    if r.status_code == 304 and meta is not None:
+                        status = 'revalidated'
+                        meta['checked'] = time.time()
+                        self.save(url, meta)
+                    elif r.status_code == 200:
+                        status = 'miss'
+                        meta, handle = self.store(url, r)
+                        if handle is not None:
+                            record(status)
+                            return self.respond(request, meta, status, handle)
+                    else:
+                        return http.HttpResponse(
+                            r.content, status=r.status_code, content_type=r.headers.get('Content-Type')
+                        )
+            except FETCH_ERRORS as e:
+                logger.warning('Unable to fetch {}: {}'.format(url, e))
+                if meta is None:
+                    record('error')
+                    return http.HttpResponse(status=502)
+                status = 'stale'
+        try:
+            path, meta_path = self.paths(url)
+            os.utime(path)  # mark as recently used
+            response = self.respond(request, meta, status)
+        except OSError:
+            # evicted by another process in the meantime
+            record('error')
+            return http.HttpResponseNotFound()
+        record(status)
+        return response
+
+    def stats(self):
+        """
+        Cache metrics, shared by all processes using the same Django cache
+        :return: dictionary
+        """
+        info = cache.get_many([CACHE_METRICS_KEY.format(event) for event in CACHE_EVENTS])
+        info = {event: info.get(CACHE_METRICS_KEY.format(event), 0) for event in CACHE_EVENTS}
+        requests_total = info['hit'] + info['miss'] + info['revalidated'] + info['stale']
+        info['hit_ratio'] = requests_total and (info['hit'] + info['revalidated'] + info['stale']) / requests_total
+        info['bytes'] = self.usage() if self.enabled and os.path.isdir(self.root) else 0
+        info['max_bytes'] = self.max_bytes
+        return info
+
+    def clear(self):
+        if self.enabled:
+            shutil.rmtree(self.root, ignore_errors=True)
+        cache.delete_many([CACHE_METRICS_KEY.format(event) for event in CACHE_EVENTS] + [CACHE_BYTES_KEY])
@@ -1,11 +1,13 @@
 from django.db import models
 from django.db.models import fields, FloatField, Aggregate
+from django.db.models.functions import Cast
 from django.conf import settings
 from django.utils import timezone
 from datetime import datetime
 
 SHIFT = getattr(settings, "HOURS_PER_SHIFT", 8)
 SHIFT_DURATION = '{:d} hour'.format(SHIFT)
+NUMBER_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
 OFFSET = -timezone.make_aware(datetime.now(), timezone.get_default_timezone()).utcoffset().total_seconds()
 
 
@@ -118,6 +120,27 @@ class ListLength(models.Func):
         )
 
 
+def numeric_cast_sql(value, db_type):
+    """
+    SQL casting a text expression to a numeric type, giving NULL for text which is not a number (PostgreSQL). The
+    expression is immutable, so it can be indexed.
+    :param value: SQL of the text expression
+    :param db_type: numeric database type
+    """
+    sql = "(CASE WHEN {0} ~ '{1}' THEN ({0})::double precision END)".format(value, NUMBER_PATTERN)
+    return sql if db_type == 'double precision' else '({})::{}'.format(sql, db_type)
+
+
+class NumericCast(Cast):
+    """
+    Cast text to a numeric field. On PostgreSQL, text which is not a number gives NULL instead of failing the cast.
+    """
+    def as_postgresql(self, compiler, connection, **extra_context):
+        value, params = compiler.compile(self.source_expressions[0])
+        sql = numeric_cast_sql(value, self.output_field.cast_db_type(connection))
+        return sql, params * 2
+
+
 class ShiftIndex(models.Func):
     function = 'floor'
     template = '%(function)s(%(expressions)s)'
@@ -1,24 +1,13 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.http import JsonResponse, HttpResponse
-from django.template.loader import get_template
-from django.conf import settings
-from django.core.files.base import ContentFile
 from django.utils.text import slugify
 
-import os
-import shutil
-import subprocess
-from tempfile import mkdtemp
 from urllib import parse
 
+from ..utils.pdf import renderer, PDFRenderError
 from ..utils.stats import generic_stats
 
 
-TEMP_PREFIX = getattr(settings, 'PDF_TEMP_PREFIX', 'render_pdf-')
-CACHE_PREFIX = getattr(settings, 'PDF_CACHE_PREFIX', 'render-pdf')
-CACHE_TIMEOUT = getattr(settings, 'PDF_CACHE_TIMEOUT', 30), # 86400)  # 1 day
-
-
 class AdminRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     """
     Mixin to allow access through a view only if the user is a superuser.
@@ -63,28 +52,14 @@ class HTML2PdfMixin(object):
         name = slugify(object.name)
         context = self.get_template_context()
         context['request'] = request
-        template = get_template(self.get_template_name())
-
-        rendered_tpl = template.render(context).encode('utf-8')
-
-        tmp = mkdtemp(prefix=TEMP_PREFIX)
-        html_file = os.path.join(tmp, '{}.html'.format(name))
-        f = open(html_file, 'w')
-        f.write(rendered_tpl.decode())
-        f.close()
-        pdf_filename = "{}/{}.pdf".format(tmp, name)
         try:
-            cmd = 'xvfb-run wkhtmltopdf -L 25mm -R 25mm -T 20mm -B 20mm -s Letter {0}.html {0}.pdf'.format(name)
-            subprocess.call(cmd.split(), cwd=tmp)
-            pdf = open(pdf_filename, 'rb').read()
-
-        finally:
-            shutil.rmtree(tmp)
+            pdf = renderer.render(self.get_template_name(), context, name)
+        except PDFRenderError as e:
+            return HttpResponse(str(e), status=503, content_type='text/plain')
 
-        pdf_file = ContentFile(pdf)
-        res = HttpResponse(pdf_file, "application/pdf")
-        res['Content-Length'] = pdf_file.size
-        res['Content-Disposition'] = 'attachment; filename="{}"'.format(os.path.basename(pdf_filename))
+        res = HttpResponse(pdf, "application/pdf")
+        res['Content-Length'] = len(pdf)
+        res['Content-Disposition'] = 'attachment; filename="{}.pdf"'.format(name)
         return res
 
 
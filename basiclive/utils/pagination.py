@@ -0,0 +1,202 @@
+import datetime
+import decimal
+import functools
+import json
+import operator
+import uuid
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'cursor'
+CURSOR_SALT = 'basiclive.pagination.cursor'
+
+
+def estimate_count(queryset):
+    """
+    Fetch the number of rows the database query planner expects the queryset to return. Only available on PostgreSQL.
+    :param queryset: queryset
+    :return: estimated row count or None if no estimate is available
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def cursor_value(value):
+    """
+    Convert an ordering value to a JSON compatible value without losing precision
+    """
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which uses the query planner estimate instead of an exact COUNT(*) for querysets expected to be larger
+    than estimate_threshold rows.
+    """
+
+    def __init__(self, *args, estimate_threshold=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate_threshold = estimate_threshold
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        if self.estimate_threshold is not None and hasattr(self.object_list, 'query'):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                self.estimated = True
+                return estimate
+        return super().count
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, number, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Page {}>'.format(self.number)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+    """
+    Seek ("keyset") paginator. Instead of an OFFSET, each page is fetched by filtering on the ordering values of the
+    boundary row of the neighbouring page, so the cost of a page does not depend on its depth. Ordering fields which
+    cannot be compared safely (nullable columns, relations, methods) fall back to OFFSET slicing.
+
+    :param object_list: ordered queryset
+    :param per_page: number of rows per page
+    :param ordering: list of ordering fields, which must end with a unique field such as 'pk'
+    :param estimate_threshold: use the query planner estimate as the count for querysets expected to be larger than
+        this many rows, see EstimatedCountPaginator
+    """
+
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering, estimate_threshold=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = [str(name) for name in ordering]
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        self.estimate_threshold = estimate_threshold
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        if self.estimate_threshold is not None:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                self.estimated = True
+                return estimate
+        return self.object_list.count()
+
+    @cached_property
+    def seekable(self):
+        opts = self.object_list.model._meta
+        if not self.fields or self.fields[-1][0] not in ('pk', opts.pk.name):
+            return False
+        for name, descending in self.fields:
+            if name == 'pk':
+                continue
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return False
+            if field.is_relation or field.null:
+                return False
+        return True
+
+    def boundary(self, obj):
+        return [cursor_value(getattr(obj, name)) for name, descending in self.fields]
+
+    def make_cursor(self, obj, offset, backwards=False):
+        info = {'f': self.ordering, 'o': offset, 'd': 'prev' if backwards else 'next'}
+        if self.seekable:
+            info['v'] = self.boundary(obj)
+        return signing.dumps(info, salt=CURSOR_SALT, compress=True)
+
+    def read_cursor(self, cursor):
+        try:
+            info = signing.loads(cursor, salt=CURSOR_SALT) if cursor else {}
+        except signing.BadSignature:
+            info = {}
+        if info.get('f') != self.ordering:
+            # ordering changed since the cursor was created, start from the beginning
+            info = {}
+        return info
+
+    def seek(self, values, backwards):
+        clauses = []
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = '{}__{}'.format(name, 'lt' if descending != backwards else 'gt')
+            clause = Q(**{lookup: values[i]})
+            for (prev_name, prev_descending), value in zip(self.fields[:i], values[:i]):
+                clause &= Q(**{prev_name: value})
+            clauses.append(clause)
+        return functools.reduce(operator.or_, clauses)
+
+    def page(self, cursor=None):
+        info = self.read_cursor(cursor)
+        offset = max(0, info.get('o', 0))
+        backwards = info.get('d') == 'prev'
+        values = info.get('v')
+
+        if values is not None and self.seekable:
+            if backwards:
+                reverse = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+                queryset = self.object_list.filter(self.seek(values, True)).order_by(*reverse)
+                rows = list(queryset[:self.per_page])[::-1]
+                has_next = True
+            else:
+                queryset = self.object_list.filter(self.seek(values, False))
+                rows = list(queryset[:self.per_page + 1])
+                has_next = len(rows) > self.per_page
+                rows = rows[:self.per_page]
+        else:
+            rows = list(self.object_list[offset:offset + self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+
+        next_cursor = self.make_cursor(rows[-1], offset + self.per_page) if has_next and rows else None
+        previous_cursor = None
+        if offset > 0 and rows:
+            previous_cursor = self.make_cursor(rows[0], max(0, offset - self.per_page), backwards=True)
+        return KeysetPage(rows, offset // self.per_page + 1, self, next_cursor, previous_cursor)
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent import futures
+from tempfile import mkdtemp
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = getattr(settings, 'PDF_TEMP_PREFIX', 'render_pdf-')
+CACHE_PREFIX = getattr(settings, 'PDF_CACHE_PREFIX', 'render-pdf')
+CACHE_TIMEOUT = getattr(settings, 'PDF_CACHE_TIMEOUT', 86400)  # 1 day
+RENDER_WORKERS = getattr(settings, 'PDF_RENDER_WORKERS', 2)
+RENDER_TIMEOUT = getattr(settings, 'PDF_RENDER_TIMEOUT', 60)
+RENDER_COMMAND = 'xvfb-run wkhtmltopdf -L 25mm -R 25mm -T 20mm -B 20mm -s Letter {0}.html {0}.pdf'
+
+
+class PDFRenderError(Exception):
+    pass
+
+
+def html_to_pdf(html, name):
+    """
+    Convert an HTML document to PDF with wkhtmltopdf
+    :param html: HTML text
+    :param name: base name of the temporary files
+    :return: PDF bytes
+    """
+    tmp = mkdtemp(prefix=TEMP_PREFIX)
+    try:
+        with open(os.path.join(tmp, '{}.html'.format(name)), 'w') as f:
+            f.write(html)
+        # wkhtmltopdf exits with an error for non-fatal problems such as missing resources, so only a missing or
+        # empty document counts as a failure
+        result = subprocess.run(RENDER_COMMAND.format(name).split(), cwd=tmp, timeout=RENDER_TIMEOUT)
+        path = os.path.join(tmp, '{}.pdf'.format(name))
+        if not (os.path.exists(path) and os.path.getsize(path)):
+            raise PDFRenderError('Unable to render {}.pdf: no output (exit status {})'.format(name, result.returncode))
+        if result.returncode:
+            logger.warning('Rendered {}.pdf with exit status {}'.format(name, result.returncode))
+        with open(path, 'rb') as f:
+            return f.read()
+    except (OSError, subprocess.SubprocessError) as e:
+        raise PDFRenderError('Unable to render {}.pdf: {}'.format(name, e))
+    finally:
+        shutil.rmtree(tmp)
+
+
+class PDFRenderer(object):
+    """
+    Renders templates to PDF on a bounded pool of worker threads, so that at most `workers` wkhtmltopdf processes
+    run at a time. Documents are cached by template name and a hash of the rendered HTML, so unchanged documents
+    are only converted once, and identical requests arriving together share a single conversion.
+
+    :param workers: maximum number of concurrent conversions
+    :param timeout: maximum time in seconds to wait for a conversion
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, timeout=RENDER_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.pending = {}
+        self._executor = None
+
+    @property
+    def executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='render-pdf')
+        return self._executor
+
+    def cache_key(self, template_name, html):
+        digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        return '{}:{}:{}'.format(CACHE_PREFIX, template_name, digest)
+
+    def convert(self, key, html, name):
+        try:
+            pdf = html_to_pdf(html, name)
+            cache.set(key, pdf, CACHE_TIMEOUT)
+            return pdf
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def submit(self, template_name, context, name):
+        """
+        Start rendering a template to PDF unless it is already cached or being rendered
+        :param template_name: template name
+        :param context: template context
+        :param name: document name
+        :return: tuple (key, pdf or None, future or None)
+        """
+        html = get_template(template_name).render(context)
+        key = self.cache_key(template_name, html)
+        pdf = cache.get(key)
+        if pdf is not None:
+            return key, pdf, None
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = self.executor.submit(self.convert, key, html, name)
+        return key, None, future
+
+    def render(self, template_name, context, name):
+        """
+        Render a template to PDF
+        :param template_name: template name
+        :param context: template context
+        :param name: document name
+        :return: PDF bytes
+        :raises: PDFRenderError if the document could not be rendered in time
+        """
+        key, pdf, future = self.submit(template_name, context, name)
+        if pdf is None:
+            try:
+                pdf = future.result(timeout=self.timeout)
+            except futures.TimeoutError:
+                raise PDFRenderError('Timed out rendering {}.pdf'.format(name))
+        return pdf
+
+    def prerender(self, template_name, context, name):
+        """
+        Render a template to PDF in the background so that later requests are served from the cache
+        """
+        key, pdf, future = self.submit(template_name, context, name)
+        if future is not None:
+            future.add_done_callback(self.log_failure)
+
+    @staticmethod
+    def log_failure(future):
+        if future.exception():
+            logger.error(future.exception())
+
+
+renderer = PDFRenderer()
@@ -0,0 +1,139 @@
+import functools
+import operator
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.contrib.admin.utils import get_fields_from_path
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections, models
+from django.db.models.functions import Greatest
+from django.utils import dateparse, timezone
+
+TEXT_FIELDS = (models.CharField, models.TextField)
+NUMBER_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField)
+
+
+def any_of(lookups):
+    lookups = [lookup for lookup in lookups if lookup is not None]
+    return functools.reduce(operator.or_, lookups) if lookups else None
+
+
+def word_lookup(field, word):
+    """
+    Filter matching a word in a field of the model the field belongs to. Text fields contain the word, fields with
+    choices have a label containing it, and other fields are matched exactly if the word can be parsed as a value.
+    :param field: model field
+    :param word: search word
+    :return: Q object or None if the word can not match the field
+    """
+    if field.choices:
+        values = [value for value, label in field.flatchoices if word.lower() in str(label).lower()]
+        return models.Q(**{'{}__in'.format(field.name): values}) if values else None
+    elif isinstance(field, TEXT_FIELDS):
+        return models.Q(**{'{}__icontains'.format(field.name): word})
+    elif isinstance(field, models.DateField):
+        day = dateparse.parse_date(word)
+        if day is None:
+            return None
+        elif isinstance(field, models.DateTimeField):
+            start = timezone.make_aware(datetime.combine(day, time.min))
+            return models.Q(**{
+                '{}__gte'.format(field.name): start, '{}__lt'.format(field.name): start + timedelta(days=1)
+            })
+        return models.Q(**{field.name: day})
+    elif isinstance(field, NUMBER_FIELDS):
+        try:
+            return models.Q(**{field.name: field.to_python(word)})
+        except ValidationError:
+            return None
+    return None
+
+
+def search_lookups(model, fields, words):
+    """
+    Build the search filters for any word in any field, split so that each filter can be served by its own index.
+    Substring filters on the model's own text columns are combined into one filter, which PostgreSQL answers from the
+    trigram indexes. Other fields of the model get one filter each, and fields of related models are matched in a
+    subquery on the related table, one per relation.
+
+    :param model: model to search
+    :param fields: list of field lookups
+    :param words: list of words
+    :return: tuple (Q object for the model's text columns or None, list of other Q objects)
+    """
+    text, others, related = [], [], defaultdict(list)
+    for path in fields:
+        field = get_fields_from_path(model, path)[-1]
+        lookup = any_of([word_lookup(field, word) for word in words])
+        if lookup is None:
+            continue
+        elif '__' in path:
+            related[(path.rsplit('__', 1)[0], field.model)].append(lookup)
+        elif isinstance(field, TEXT_FIELDS) and not field.choices:
+            text.append(lookup)
+        else:
+            others.append(lookup)
+    others.extend(
+        models.Q(**{'{}__in'.format(prefix): related_model._base_manager.filter(any_of(lookups)).values('pk')})
+        for (prefix, related_model), lookups in related.items()
+    )
+    return any_of(text), others
+
+
+def search_queryset(queryset, fields, search_term, rank=True):
+    """
+    Filter a queryset to objects containing any of the words of the search term in any of the fields.
+
+    The filters are combined as a union of primary keys (see search_lookups), since a single OR over joined or
+    non-text columns can not use the indexes of any of them. On PostgreSQL, substring filters on the model's own text
+    columns are served by trigram indexes and, if rank is True, results are ordered by their trigram similarity to
+    the search term.
+
+    :param queryset: queryset to search
+    :param fields: list of field lookups
+    :param search_term: search text
+    :param rank: order results by relevance before the existing ordering
+    :return: tuple (queryset, distinct), distinct will be True if queryset is likely to contain duplicates
+    """
+    words = search_term.split()
+    if not (fields and words):
+        return queryset, False
+
+    model = queryset.model
+    text, others = search_lookups(model, fields, words)
+    if text is None and not others:
+        return queryset.none(), False
+    elif not others:
+        queryset = queryset.filter(text)
+    elif text is None and len(others) == 1:
+        queryset = queryset.filter(others[0])
+    else:
+        matches = [
+            model._base_manager.filter(lookup).order_by().values('pk') for lookup in [text] + others if lookup
+        ]
+        queryset = queryset.filter(pk__in=matches[0].union(*matches[1:]))
+
+    local_fields = [
+        field for field in fields if '__' not in field and isinstance(model._meta.get_field(field), TEXT_FIELDS)
+    ]
+    if connections[queryset.db].vendor == 'postgresql' and rank and local_fields:
+        from django.contrib.postgres.search import TrigramSimilarity
+        scores = [TrigramSimilarity(field, search_term) for field in local_fields]
+        queryset = queryset.annotate(
+            search_rank=Greatest(*scores) if len(scores) > 1 else scores[0]
+        ).order_by('-search_rank', *queryset.query.order_by)
+    return queryset, False
+
+
+def supports(model, fields):
+    """
+    Check whether the search fields can be handled by search_queryset, i.e. they are all plain substring lookups
+    """
+    try:
+        for field in fields:
+            if field[:1] in ('^', '=', '@'):
+                return False
+            get_fields_from_path(model, field)
+    except FieldDoesNotExist:
+        return False
+    return True
@@ -1,10 +1,12 @@
 import base64
+import functools
 import time
 
 from cryptography.hazmat.primitives import hashes
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed25519, padding, rsa
 
 try:
     from django.utils import baseconv
@@ -12,11 +14,81 @@ except ImportError:
     import baseconv
 
 
+KEY_TYPES = {
+    ed25519.Ed25519PrivateKey: 'ed25519',
+    ed25519.Ed25519PublicKey: 'ed25519',
+    ec.EllipticCurvePrivateKey: 'ecdsa',
+    ec.EllipticCurvePublicKey: 'ecdsa',
+    rsa.RSAPrivateKey: 'rsa',
+    rsa.RSAPublicKey: 'rsa',
+    dsa.DSAPrivateKey: 'dsa',
+    dsa.DSAPublicKey: 'dsa',
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def load_public_key(public):
+    """
+    Parse an OpenSSH public key. Parsed keys are cached since the same project keys are verified repeatedly.
+    :param public: OpenSSH formatted public key text (ssh-ed25519, ecdsa-sha2-nistp256, ssh-rsa or ssh-dss)
+    :return: public key object
+    """
+    return serialization.load_ssh_public_key(public.encode('utf-8'), default_backend())
+
+
+def key_type(key):
+    """
+    Determine the kind of a private or public key
+    :param key: key object
+    :return: one of 'ed25519', 'ecdsa', 'rsa' or 'dsa'
+    """
+    for cls, kind in KEY_TYPES.items():
+        if isinstance(key, cls):
+            return kind
+    raise ValueError('Unsupported key type: {}'.format(key.__class__.__name__))
+
+
+def sign_bytes(private_key, data):
+    """
+    Sign data using the primitive matching the type of the private key
+    :param private_key: private key object
+    :param data: bytes to sign
+    :return: signature bytes
+    """
+    kind = key_type(private_key)
+    if kind == 'ed25519':
+        return private_key.sign(data)
+    elif kind == 'ecdsa':
+        return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+    elif kind == 'rsa':
+        return private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+    return private_key.sign(data, hashes.SHA256())
+
+
+def verify_bytes(public_key, signature, data):
+    """
+    Verify a signature using the primitive matching the type of the public key
+    :param public_key: public key object
+    :param signature: signature bytes
+    :param data: signed bytes
+    :raises: InvalidSignature if the signature does not match
+    """
+    kind = key_type(public_key)
+    if kind == 'ed25519':
+        public_key.verify(signature, data)
+    elif kind == 'ecdsa':
+        public_key.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+    elif kind == 'rsa':
+        public_key.verify(signature, data, padding.PKCS1v15(), hashes.SHA256())
+    else:
+        public_key.verify(signature, data, hashes.SHA256())
+
+
 class Signer(object):
     def __init__(self, public=None, private=None, sep=':', salt=None, max_delta=60):
         assert public or private, "Must provide either a public key or a private key, or both."
         self.private_key = None if not private else serialization.load_der_private_key(private, None, default_backend())
-        self.public_key = None if not public else serialization.load_ssh_public_key(public.encode('utf-8'), default_backend())
+        self.public_key = None if not public else load_public_key(public)
         self.sep = sep
         self.salt = salt or 'ca.clsi.cmcf'
         self.max_delta = max_delta
@@ -25,11 +97,10 @@ class Signer(object):
         return baseconv.base62.encode(int(time.time()))
 
     def signature(self, value):
-        signature = self.private_key.sign(
-            '{salt}{sep}{value}'.format(salt=self.salt, value=value, sep=self.sep),
-            hashes.SHA256()
+        signature = sign_bytes(
+            self.private_key, '{salt}{sep}{value}'.format(salt=self.salt, value=value, sep=self.sep).encode('utf-8')
         )
-        return base64.urlsafe_b64encode(signature)
+        return base64.urlsafe_b64encode(signature).decode('ascii')
 
     def sign(self, value):
         assert self.private_key is not None, "Needs private key in order to sign."
@@ -45,7 +116,7 @@ class Signer(object):
         signature_time = baseconv.base62.decode(b62_time)
         now = time.time()
         verify_value = '{salt}{sep}{value}'.format(salt=self.salt, value=timed_value, sep=self.sep)
-        self.public_key.verify(signature, verify_value.encode('utf-8'), hashes.SHA256())
+        verify_bytes(self.public_key, signature, verify_value.encode('utf-8'))
 
         if now - signature_time > self.max_delta:
             raise InvalidSignature('Signature is too old.')
@@ -53,4 +124,53 @@ class Signer(object):
         return value
 
 
-__all__ = ['Signer', 'InvalidSignature']
\ No newline at end of file
+def generate_keys(kind='ed25519'):
+    """
+    Generate a new key pair in the formats accepted by Signer
+    :param kind: one of 'ed25519', 'ecdsa', 'rsa'
+    :return: tuple (public, private) of OpenSSH public key text and DER private key bytes
+    """
+    if kind == 'ed25519':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    elif kind == 'ecdsa':
+        private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    elif kind == 'rsa':
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    else:
+        raise ValueError('Unsupported key type: {}'.format(kind))
+
+    private = private_key.private_bytes(
+        serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public = private_key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH
+    ).decode('utf-8')
+    return public, private
+
+
+def benchmark(kinds=('ed25519', 'ecdsa', 'rsa'), count=1000):
+    """
+    Measure sign and verify throughput of Signer for each key type
+    :param kinds: key types to test
+    :param count: number of operations per measurement
+    :return: dictionary mapping key type to {'sign': ops/sec, 'verify': ops/sec}
+    """
+    results = {}
+    for kind in kinds:
+        public, private = generate_keys(kind)
+        signer = Signer(public=public, private=private, max_delta=3600)
+
+        start = time.perf_counter()
+        signatures = [signer.sign('benchmark') for i in range(count)]
+        sign_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for signature in signatures:
+            Signer(public=public).unsign(signature)
+        verify_time = time.perf_counter() - start
+
+        results[kind] = {'sign': count / sign_time, 'verify': count / verify_time}
+    return results
+
+
+__all__ = ['Signer', 'InvalidSignature', 'generate_keys', 'benchmark']
@@ -10,14 +10,51 @@ def get_histogram_points(data, range=None, bins='doane'):
     return list(zip(centers, counts))
 
 
+def get_field_values(objlist, fld):
+    """
+    Fetch the non-null values of a numeric field as a float array
+    :param objlist: queryset
+    :param fld: field name or lookup
+    :return: numpy array
+    """
+    values = objlist.filter(**{'{}__isnull'.format(fld): False}).order_by().values_list(fld, flat=True)
+    return numpy.fromiter((float(value) for value in values.iterator()), dtype=float)
+
+
+def get_period_counts(objlist, field, fld, periods):
+    """
+    Count objects for each combination of period and field value using a single grouped query
+    :param objlist: queryset
+    :param field: period lookup, e.g. 'created__year'
+    :param fld: field to count values of
+    :param periods: list of periods
+    :return: tuple of (options, counts) where options is a list of string values of fld and counts is a
+        2D array of counts, with one row per period and one column per option
+    """
+    entries = list(objlist.values_list(field, fld).order_by(field, fld).annotate(count=Count('id')))
+    options = sorted({str(value) for per, value, count in entries})
+    period_index = {per: i for i, per in enumerate(periods)}
+    option_index = {opt: i for i, opt in enumerate(options)}
+
+    counts = numpy.zeros((len(periods), len(options)), dtype=int)
+    entries = [(per, value, count) for per, value, count in entries if per in period_index]
+    if entries:
+        pers, values, totals = zip(*entries)
+        rows = numpy.array([period_index[per] for per in pers], dtype=int)
+        cols = numpy.array([option_index[str(value)] for value in values], dtype=int)
+        numpy.add.at(counts, (rows, cols), totals)
+    return options, counts
+
+
 def generic_stats(objlist, fields, date_field=None):
     stats = {}
-    if objlist:
-        model = objlist.first()._meta.verbose_name_plural
+    if objlist.exists():
+        model = objlist.model._meta.verbose_name_plural
         content = []
         data = {}
         options = {}
         period, year = (None, None)
+        periods, field = (None, None)
 
         for fld in fields:
             kind = fields.get(fld, {}).get('kind', 'columnchart')
@@ -32,7 +69,7 @@ def generic_stats(objlist, fields, date_field=None):
                 }
             elif kind == 'histogram':
                 histo = get_histogram_points(
-                    [ float(datum[fld]) for datum in objlist.values(fld) if datum[fld] is not None ],
+                    get_field_values(objlist, fld),
                     range=fields.get(fld, {}).get('range'), bins=fields.get(fld, {}).get('bins', 'doane')
                 )
                 data[fld] = {
@@ -42,33 +79,30 @@ def generic_stats(objlist, fields, date_field=None):
                 }
             elif kind == 'columnchart':
                 if date_field:
-                    period = 'year'
-                    field = "{}__{}".format(date_field, period)
-                    periods = sorted(objlist.values_list(field, flat=True).order_by(field).distinct())
-                    if len(periods) == 1:
-                        year = periods[0]
-                        period = 'month'
-                        periods = [i for i in range(1, 13)]
+                    if periods is None:
+                        period = 'year'
                         field = "{}__{}".format(date_field, period)
+                        periods = sorted(objlist.values_list(field, flat=True).order_by(field).distinct())
+                        if len(periods) == 1:
+                            year = periods[0]
+                            period = 'month'
+                            periods = [i for i in range(1, 13)]
+                            field = "{}__{}".format(date_field, period)
                     period_dict = {per: period == 'year' and per or calendar.month_abbr[per].title() for per in periods}
+                    field_options, counts = get_period_counts(objlist, field, fld, periods)
                     period_data = [
-                            {
-                                **{period.title(): period_dict[per]},
-                                **{str(k[fld]): k['count']
-                                   for k in
-                                   objlist.filter(**{field: per}).values(fld).order_by(fld).annotate(count=Count('id'))}
-                            } for per in periods
-                        ]
-                    options[fld] = set([k for p in period_data for k in p.keys()]).difference([period.title()])
+                        {
+                            **{period.title(): period_dict[per]},
+                            **dict(zip(field_options, counts[i].tolist()))
+                        } for i, per in enumerate(periods)
+                    ]
+                    options[fld] = field_options
                     data[fld] = {
                         'aspect-ratio': 2,
                         'stack': [list(options[fld])],
                         'x-label': period and period.title() or fld.replace('__', ' ').title(),
                         'data': period_data
                     }
-                    for opt in options[fld]:
-                        for e in data[fld]['data']:
-                            e[opt] = e.get(opt, 0)
                 else:
                     field_data = [
                         {